@@ -0,0 +1,93 @@
+"""Compare reading challenges into Challenge objects with the old approach.
+
+The old approach is a plain class with a __dict__, built by unpacking every
+row by hand and splitting its language constraints straight away. Run from
+the repository root:
+
+    python benchmarks/bench_challenges.py --rows 200000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(
+    os.path.dirname(__file__), "..")))
+
+from challengeme.challenges import LANGUAGE_SEPARATOR
+from challengeme.handlers.datahandler import CHALLENGE_COLUMNS, DataHandler
+
+LANGUAGES = ["C", "C++", "Rust", "Python", "Haskell", "OCaml", "Erlang"]
+
+class DictChallenge():
+    def __init__(self, chall_id, set_id, description, notes,
+                 language_constraints, date_started, date_finished,
+                 language_used):
+        self.id = chall_id
+        self.set_id = set_id
+        self.description = description
+        self.notes = notes
+        self.language_constraints = language_constraints
+        self.date_started = date_started
+        self.date_finished = date_finished
+        self.language_used = language_used
+
+def build_db(db_file, rows):
+    handler = DataHandler(os.path.dirname(db_file), db_file)
+    con = handler.load_db()
+    set_id = handler.get_challenge_set_id(con, "Self-added challenges")
+
+    rng = random.Random(0)
+    handler.import_challenges(con, set_id, [
+        {"description": f"Synthetic challenge {i}",
+         "notes": "Some notes",
+         "languageConstraints": rng.sample(LANGUAGES, rng.randrange(3))}
+        for i in range(rows)])
+    handler.unload_db(con)
+
+def read_dict_challenges(handler, con):
+    cur = con.cursor()
+    cur.execute(f"SELECT {CHALLENGE_COLUMNS} FROM challenges;")
+
+    res = []
+    for row in cur.fetchall():
+        langs = [] if row[4] is None else row[4].split(LANGUAGE_SEPARATOR)
+        res.append(DictChallenge(row[0], row[1], row[2], row[3],
+                                 langs, row[5], row[6], row[7]))
+    return res
+
+def read_challenges(handler, con):
+    return handler.query_challenges(con, virtual=False)
+
+def measure(name, read, handler, con):
+    # Timed without tracemalloc, which slows down every allocation.
+    start = time.perf_counter()
+    challenges = read(handler, con)
+    elapsed = time.perf_counter() - start
+    del challenges
+
+    tracemalloc.start()
+    challenges = read(handler, con)
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:>14}: {len(challenges)} challenges in {elapsed:.3f}s, "
+          f"{current / 2**20:.1f} MiB held, {peak / 2**20:.1f} MiB peak")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = os.path.join(tmp_dir, "bench.db")
+        build_db(db_file, args.rows)
+
+        handler = DataHandler(tmp_dir, db_file)
+        con = handler.load_db()
+        measure("__dict__ class", read_dict_challenges, handler, con)
+        measure("Challenge", read_challenges, handler, con)
+        handler.unload_db(con)
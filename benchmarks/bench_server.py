@@ -0,0 +1,112 @@
+"""Load-test the `serve` HTTP/JSON API.
+
+A server is started in-process on a synthetic database (see generate.py),
+and client threads on keep-alive connections send pick, list and accept
+requests to it. The requests per second and latency percentiles of each
+endpoint are printed as JSON. Run from the repository root:
+
+    python benchmarks/bench_server.py --challenges 100000 --clients 8
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(
+    os.path.dirname(__file__), "..")))
+
+from challengeme.handlers.datahandler import DataHandler
+from challengeme.server import ChallengeServer
+from generate import generate_db
+
+def percentile(times, fraction):
+    return times[min(len(times) - 1, int(len(times) * fraction))]
+
+def load_test(port, clients, requests, make_request):
+    """Send `requests` requests from each of `clients` threads.
+
+    make_request(client, i) returns the (method, path, body) of a request.
+    """
+    latencies = [[] for _ in range(clients)]
+    failures = [0] * clients
+
+    def client(n):
+        con = http.client.HTTPConnection("127.0.0.1", port)
+        for i in range(requests):
+            (method, path, body) = make_request(n, i)
+            start = time.perf_counter()
+            con.request(method, path,
+                        body=None if body is None else json.dumps(body))
+            response = con.getresponse()
+            response.read()
+            latencies[n].append((time.perf_counter() - start) * 1000)
+            if response.status != 200:
+                failures[n] += 1
+        con.close()
+
+    threads = [threading.Thread(target=client, args=(n,))
+               for n in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    times = sorted(t for client_times in latencies for t in client_times)
+    return {"requests": len(times), "failures": sum(failures),
+            "requests_per_second": len(times) / elapsed,
+            "p50_ms": statistics.median(times),
+            "p99_ms": percentile(times, 0.99),
+            "max_ms": times[-1]}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--challenges', type=int, default=100000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200,
+                        help="requests sent by each client per endpoint")
+    parser.add_argument('--pool-size', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = os.path.join(tmp_dir, "bench.db")
+        generate_db(db_file, challenges=args.challenges)
+
+        handler = DataHandler(tmp_dir, db_file)
+        con = handler.load_db()
+        unstarted = [chall.id for chall
+                     in handler.query_challenges(con, started=False,
+                                                 virtual=False)]
+        handler.unload_db(con)
+
+        server = ChallengeServer(("127.0.0.1", 0), handler, args.pool_size)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_port
+
+        # Every accept is for a different challenge, and invalidates the
+        # catalogue cache that picks are made from.
+        def accept(n, i):
+            return ("POST", "/accept",
+                    {"id": unstarted[n * args.requests + i],
+                     "language": "C"})
+
+        results = {
+            "pick": load_test(port, args.clients, args.requests,
+                              lambda n, i: ("GET", "/pick", None)),
+            "list": load_test(port, args.clients, args.requests,
+                              lambda n, i: ("GET", "/challenges?limit=20&"
+                                            f"offset={i * 20}", None)),
+            "accept": load_test(port, args.clients, args.requests, accept),
+        }
+        server.shutdown()
+        server.server_close()
+
+    json.dump({"params": vars(args), "results": results}, sys.stdout,
+              indent=2)
+    print()
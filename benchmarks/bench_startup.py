@@ -0,0 +1,80 @@
+"""Measure the cold-start import cost of every CLI subcommand.
+
+Each subcommand is run once under `python -X importtime` against a fresh
+database in a temporary directory, and the total time spent importing
+modules (as reported by -X importtime) is printed next to the wall-clock
+time of the whole run. A subcommand that fails stops the run with its
+error. Run from the repository root:
+
+    python benchmarks/bench_startup.py
+"""
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+MAIN = os.path.join(ROOT, "main.py")
+
+# (arguments, stdin) for each subcommand. Interactive commands are answered
+# so that they exit without changing anything.
+COMMANDS = [
+    (["get-languages"], ""),
+    (["add-language", "C"], ""),
+    (["get-challenges", "--limit", "1"], ""),
+    (["add-challenge"], "Benchmark challenge\n\n\n"),
+    (["delete-challenge"], "q\n"),
+    (["import-challenges", "challenges.jsonl"], ""),
+    (["pick-challenge", "--seed", "0"], "n\nn\n"),
+    (["active-challenges"], ""),
+    (["completed-challenges"], ""),
+    (["set-finished"], "q\n"),
+    (["due-revisits"], ""),
+    (["revisit-interval", "30", "--language", "C"], ""),
+    (["rescan-defaults"], ""),
+    (["stats"], ""),
+    (["search", "protocol"], ""),
+    (["export", "snapshot.jsonl"], ""),
+    (["import", "snapshot.jsonl", "--force"], ""),
+    (["backup", "backup.db"], ""),
+    (["build-catalogue", "catalogue.db"], ""),
+    (["serve", "--help"], ""),
+]
+
+IMPORT_LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)")
+
+def import_time(stderr):
+    """Return the total cumulative import time in ms of top-level imports."""
+    total = 0
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match is not None and len(match.group(2)) == 0:
+            total += int(match.group(1))
+    return total / 1000
+
+def run(args, stdin, cwd):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", MAIN] + args,
+                          input=stdin, capture_output=True, text=True,
+                          cwd=cwd)
+    elapsed = (time.perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        sys.exit(f"{' '.join(args)} failed with exit status "
+                 f"{proc.returncode}:\n{proc.stderr}")
+    return import_time(proc.stderr), elapsed
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.symlink(os.path.join(ROOT, "defaults"),
+                   os.path.join(tmp_dir, "defaults"))
+        # Create the database first so that its import isn't measured.
+        run(["get-languages"], "", tmp_dir)
+        with open(os.path.join(tmp_dir, "challenges.jsonl"), "w") as f:
+            f.write('{"description": "Imported benchmark challenge"}\n')
+
+        print(f"{'subcommand':<22}{'imports (ms)':>14}{'wall (ms)':>12}")
+        for (args, stdin) in COMMANDS:
+            (imports, elapsed) = run(args, stdin, tmp_dir)
+            print(f"{args[0]:<22}{imports:>14.1f}{elapsed:>12.1f}")
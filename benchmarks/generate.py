@@ -0,0 +1,136 @@
+"""Generate a synthetic challengeme database of a configurable size.
+
+    python benchmarks/generate.py bench.db --challenges 1000000 --sets 50
+
+The challenges are spread over the sets, a share of them have language
+constraints, and a share of them are started and finished. Numbered sets
+(like Project Euler) are added on top of the regular challenges.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(
+    os.path.dirname(__file__), "..")))
+
+from challengeme.handlers.datahandler import DataHandler
+
+LANGUAGES = ["C", "C++", "Rust", "x86/64 Assembly", "MIPS Assembly",
+             "ARM Assembly", "Python", "Haskell", "OCaml", "Common Lisp",
+             "Scheme", "Clojure", "JavaScript", "Erlang", "Julia", "COBOL"]
+
+# Rows written per executemany call, to keep memory use flat.
+CHUNK_SIZE = 10000
+
+def chunks(iterable, size=CHUNK_SIZE):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+def generate_db(db_file, challenges=10000, sets=10, languages=16,
+                constrained=0.2, started=0.05, finished=0.6,
+                numbered_sets=1, numbered_size=1000, seed=0):
+    """Create db_file and fill it with synthetic data.
+
+    `constrained` and `started` are the shares of the challenges that get
+    language constraints and that are started, and `finished` is the share
+    of the started challenges that are finished.
+    """
+    rng = random.Random(seed)
+    langs = LANGUAGES[:languages] + [f"Language {i}" for i
+                                     in range(len(LANGUAGES), languages)]
+
+    # An empty defaults directory, so only the personal set is created.
+    with tempfile.TemporaryDirectory() as defaults_dir:
+        handler = DataHandler(defaults_dir, db_file)
+        con = handler.load_db()
+
+    for lang in langs:
+        handler.add_language(con, lang)
+
+    cur = con.cursor()
+    set_ids = []
+    for i in range(sets):
+        cur.execute("INSERT INTO challenge_sets(name) VALUES(?);",
+                    (f"Synthetic set {i}",))
+        set_ids.append(cur.lastrowid)
+    for i in range(numbered_sets):
+        cur.execute("INSERT INTO challenge_sets(name) VALUES(?);",
+                    (f"Numbered set {i}",))
+        cur.execute("""INSERT INTO virtual_sets(set_id, num_challenges)
+                       VALUES(?,?);""", (cur.lastrowid, numbered_size))
+
+    def rows():
+        for i in range(challenges):
+            date_started = date_finished = language_used = None
+            if rng.random() < started:
+                day = rng.randrange(3650)
+                date_started = f"date('now', '-{day} days')"
+                language_used = rng.choice(langs)
+                if rng.random() < finished:
+                    date_finished = f"date('now', '-{rng.randrange(day + 1)} days')"
+            yield (rng.choice(set_ids), f"Synthetic challenge {i}",
+                   f"Notes for synthetic challenge {i}",
+                   date_started, date_finished, language_used)
+
+    # Dates are computed by SQLite so they are in the same format as the
+    # ones written by accept_challenge and finish_challenge.
+    for chunk in chunks(rows()):
+        cur.executemany("""INSERT INTO challenges(set_id, description, notes,
+                                                  date_started, date_finished,
+                                                  language_used)
+                           VALUES(?,?,?,?,?,?);""",
+                        [row[:3] + (None, None, None) for row in chunk])
+        first_id = cur.lastrowid - len(chunk) + 1
+        progress = [(row[3], row[4], row[5], first_id + i)
+                    for (i, row) in enumerate(chunk) if row[3] is not None]
+        for (date_started, date_finished, language_used, chall_id) in progress:
+            cur.execute(f"""UPDATE challenges
+                            SET date_started = {date_started},
+                                date_finished = {date_finished or 'NULL'},
+                                language_used = ?
+                            WHERE id = ?;""", (language_used, chall_id))
+
+    cur.execute("SELECT id FROM languages;")
+    lang_ids = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT min(id), max(id) FROM challenges;")
+    (first_id, last_id) = cur.fetchone()
+    if first_id is not None:
+        for chunk in chunks((chall_id, lang_id)
+                            for chall_id in range(first_id, last_id + 1)
+                            if rng.random() < constrained
+                            for lang_id in rng.sample(lang_ids,
+                                                      min(3, len(lang_ids)))):
+            cur.executemany("""INSERT OR IGNORE INTO challenge_languages(
+                                   challenge_id, language_id)
+                               VALUES(?,?);""", chunk)
+    cur.close()
+
+    handler.unload_db(con)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('db_file')
+    parser.add_argument('--challenges', type=int, default=10000)
+    parser.add_argument('--sets', type=int, default=10)
+    parser.add_argument('--languages', type=int, default=16)
+    parser.add_argument('--constrained', type=float, default=0.2)
+    parser.add_argument('--started', type=float, default=0.05)
+    parser.add_argument('--finished', type=float, default=0.6)
+    parser.add_argument('--numbered-sets', type=int, default=1)
+    parser.add_argument('--numbered-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.db_file):
+        sys.exit(f"{args.db_file} already exists")
+    generate_db(args.db_file, args.challenges, args.sets, args.languages,
+                args.constrained, args.started, args.finished,
+                args.numbered_sets, args.numbered_size, args.seed)
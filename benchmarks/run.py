@@ -0,0 +1,268 @@
+"""Time the main DataHandler operations and CLI commands on a large catalogue.
+
+A synthetic database is built with generate.py, every benchmark is run a
+few times against it and the results are written out as JSON, so that runs
+from different revisions can be compared. Run from the repository root:
+
+    python benchmarks/run.py --challenges 100000 --output before.json
+    python benchmarks/run.py --challenges 100000 --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+MAIN = os.path.join(ROOT, "main.py")
+sys.path.insert(0, ROOT)
+
+from challengeme.handlers.commandhandler import read_snapshot, write_snapshot
+from challengeme.handlers.datahandler import DataHandler
+from generate import generate_db
+
+# (arguments, stdin) of the CLI commands that are timed end to end.
+# Interactive commands are answered so that they exit without changing
+# anything.
+COMMANDS = [
+    (["get-languages"], ""),
+    (["get-challenges"], ""),
+    (["get-challenges", "--limit", "20"], ""),
+    (["pick-challenge", "--seed", "0"], "n\nn\n"),
+    (["active-challenges"], ""),
+    (["completed-challenges"], ""),
+    (["stats"], ""),
+    (["search", "synthetic"], ""),
+]
+
+def measure(func, repeat):
+    """Run func `repeat` times and summarise the wall-clock times in ms."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return {"min": min(times), "median": statistics.median(times),
+            "max": max(times), "repeat": repeat}
+
+def bench_datahandler(db_file, repeat):
+    handler = DataHandler(os.path.join(ROOT, "defaults"), db_file)
+    results = {}
+
+    def load_unload():
+        handler.unload_db(handler.load_db())
+    results["load_db"] = measure(load_unload, repeat)
+
+    con = handler.load_db()
+    set_id = handler.get_challenge_sets(con)[1][0]
+    lang = handler.get_languages(con)[0][1]
+
+    results["get_challenges"] = measure(
+        lambda: handler.get_challenges(con), repeat)
+    results["query_challenges_page"] = measure(
+        lambda: handler.query_challenges(con, limit=20, offset=1000), repeat)
+    results["query_challenges_set"] = measure(
+        lambda: handler.query_challenges(con, set_id=set_id), repeat)
+    results["query_challenges_active"] = measure(
+        lambda: handler.query_challenges(con, started=True, finished=False),
+        repeat)
+    results["count_challenges"] = measure(
+        lambda: handler.count_challenges(con), repeat)
+    results["get_sampler"] = measure(lambda: handler.get_sampler(con), repeat)
+
+    sampler = handler.get_sampler(con)
+    rng = random.Random(0)
+    results["sample"] = measure(lambda: sampler.sample(rng), repeat)
+    results["search_challenges"] = measure(
+        lambda: handler.search_challenges(con, "synthetic 42"), repeat)
+    results["get_language_stats"] = measure(
+        lambda: handler.get_language_stats(con), repeat)
+
+    # Each write commits its own transaction, as it does in a CLI command.
+    added = []
+    def add():
+        added.append(handler.add_challenge(con, set_id,
+                                           f"Benchmark {len(added)}"))
+    results["add_challenge"] = measure(add, repeat)
+
+    accepted = iter(added)
+    def accept():
+        handler.accept_challenge(con, next(accepted), lang)
+    results["accept_challenge"] = measure(accept, repeat)
+
+    finished = iter(added)
+    def finish():
+        handler.finish_challenge(con, next(finished))
+    results["finish_challenge"] = measure(finish, repeat)
+
+    handler.unload_db(con)
+    return results
+
+def bench_import(tmp_dir, size, repeat):
+    results = {}
+    runs = iter(range(repeat))
+
+    def load_defaults():
+        db_file = os.path.join(tmp_dir, f"defaults-{next(runs)}.db")
+        handler = DataHandler(os.path.join(ROOT, "defaults"), db_file)
+        handler.unload_db(handler.load_db())
+    results["load_defaults"] = measure(load_defaults, repeat)
+
+    challenges = [{"description": f"Imported challenge {i}",
+                   "notes": "Some notes",
+                   "languageConstraints": ["C"] if i % 5 == 0 else []}
+                  for i in range(size)]
+    runs = iter(range(repeat))
+    def import_challenges():
+        db_file = os.path.join(tmp_dir, f"import-{next(runs)}.db")
+        handler = DataHandler(tmp_dir, db_file)
+        con = handler.load_db()
+        set_id = handler.get_challenge_set_id(con, "Self-added challenges")
+        handler.import_challenges(con, set_id, challenges)
+        handler.unload_db(con)
+    results[f"import_challenges_{size}"] = measure(import_challenges, repeat)
+    return results
+
+def bench_snapshot(db_file, tmp_dir, repeat):
+    """Export the whole catalogue to a snapshot, import it into a new DB and
+    back the DB up. With --challenges 1000000 this covers a million-row
+    DB."""
+    handler = DataHandler(tmp_dir, db_file)
+    con = handler.load_db()
+    snapshot = os.path.join(tmp_dir, "snapshot.jsonl")
+    results = {}
+
+    def export():
+        with open(snapshot, "w", encoding="utf8") as f:
+            write_snapshot(handler, con, f)
+    results["export_snapshot"] = measure(export, repeat)
+
+    runs = iter(range(repeat))
+    def import_snapshot():
+        copy = DataHandler(tmp_dir,
+                           os.path.join(tmp_dir, f"snapshot-{next(runs)}.db"))
+        copy_con = copy.load_db()
+        with open(snapshot, encoding="utf8") as f:
+            copy.import_snapshot(copy_con, *read_snapshot(f))
+        copy.unload_db(copy_con)
+    results["import_snapshot"] = measure(import_snapshot, repeat)
+
+    runs = iter(range(repeat))
+    def backup():
+        handler.backup_db(con, os.path.join(tmp_dir,
+                                            f"backup-{next(runs)}.db"))
+    results["backup_db"] = measure(backup, repeat)
+
+    handler.unload_db(con)
+    return results
+
+def bench_cli(db_file, tmp_dir, repeat):
+    cli_dir = os.path.join(tmp_dir, "cli")
+    os.mkdir(cli_dir)
+    os.symlink(os.path.join(ROOT, "defaults"),
+               os.path.join(cli_dir, "defaults"))
+    shutil.copy(db_file, os.path.join(cli_dir, "data.db"))
+
+    # A command that fails is recorded as failed, and the other commands
+    # and sections still run.
+    results = {}
+    for (args, stdin) in COMMANDS:
+        name = "cli " + " ".join(args)
+        def run():
+            subprocess.run([sys.executable, MAIN] + args, input=stdin,
+                           capture_output=True, text=True, cwd=cli_dir,
+                           check=True)
+        try:
+            results[name] = measure(run, repeat)
+        except subprocess.CalledProcessError as err:
+            print(f"{name} failed with exit status {err.returncode}:\n"
+                  f"{err.stderr}", file=sys.stderr)
+            results[name] = {"failed": err.returncode}
+    return results
+
+def revision():
+    proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                          capture_output=True, text=True, cwd=ROOT)
+    return proc.stdout.strip() or None
+
+def compare(results, baseline):
+    print(f"{'benchmark':<40}{'before (ms)':>14}{'after (ms)':>14}"
+          f"{'ratio':>8}")
+    for (name, result) in results.items():
+        if name not in baseline:
+            continue
+        if "failed" in result or "failed" in baseline[name]:
+            print(f"{name:<40}{'failed':>36}")
+            continue
+        before = baseline[name]["median"]
+        after = result["median"]
+        ratio = after / before if before > 0 else float("inf")
+        print(f"{name:<40}{before:>14.2f}{after:>14.2f}{ratio:>8.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--challenges', type=int, default=100000)
+    parser.add_argument('--sets', type=int, default=20)
+    parser.add_argument('--languages', type=int, default=16)
+    parser.add_argument('--started', type=float, default=0.05)
+    parser.add_argument('--finished', type=float, default=0.6)
+    parser.add_argument('--numbered-size', type=int, default=1000)
+    parser.add_argument('--import-size', type=int, default=10000,
+                        help="number of challenges in the import benchmark")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--no-cli', action='store_true',
+                        help="skip the end-to-end CLI benchmarks")
+    parser.add_argument('--output', help="write the results to this file")
+    parser.add_argument('--compare',
+                        help="print the ratios against an earlier output")
+    args = parser.parse_args()
+
+    params = {"challenges": args.challenges, "sets": args.sets,
+              "languages": args.languages, "started": args.started,
+              "finished": args.finished,
+              "numbered_size": args.numbered_size,
+              "import_size": args.import_size, "repeat": args.repeat}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = os.path.join(tmp_dir, "bench.db")
+        generate_db(db_file, challenges=args.challenges, sets=args.sets,
+                    languages=args.languages, started=args.started,
+                    finished=args.finished,
+                    numbered_size=args.numbered_size)
+
+        # The CLI runs on a copy taken before the writes below.
+        results = {}
+        if not args.no_cli:
+            results.update(bench_cli(db_file, tmp_dir, args.repeat))
+        results.update(bench_datahandler(db_file, args.repeat))
+        results.update(bench_import(tmp_dir, args.import_size, args.repeat))
+        results.update(bench_snapshot(db_file, tmp_dir, args.repeat))
+
+    report = {"revision": revision(),
+              "python": platform.python_version(),
+              "sqlite": sqlite3.sqlite_version,
+              "params": params,
+              "results": results}
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["params"] != params:
+            print("Warning: the baseline was run with different parameters.",
+                  file=sys.stderr)
+        compare(results, baseline["results"])
+
+    if any("failed" in result for result in results.values()):
+        sys.exit(1)
@@ -0,0 +1,131 @@
+"""Use the DataHandler from asyncio without blocking the event loop.
+
+    async with AsyncDataHandler(defaultsdir, dbfile) as handler:
+        (challenge, language, modifier) = await handler.pick()
+"""
+import asyncio
+import functools
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .handlers.datahandler import DataHandler
+
+class AsyncDataHandler:
+    """Coroutine versions of the DataHandler operations.
+
+    Every call runs on a bounded set of DB threads, each with a connection
+    of its own. Writes go to a single thread, so they never wait on each
+    other's locks, and reads to a small pool of reader threads. A read that
+    is requested while an identical one is running shares its result, as
+    long as no write finished in between.
+    """
+
+    def __init__(self, defaultsdir, dbfile, readers=2, catalogue=None):
+        self.datahandler = DataHandler(defaultsdir, dbfile, catalogue)
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.writer = ThreadPoolExecutor(1, "challengeme-writer",
+                                         initializer=self.__connect)
+        self.readers = ThreadPoolExecutor(readers, "challengeme-reader",
+                                          initializer=self.__connect)
+        # Reads in progress, by (method, arguments, writes before them).
+        self.pending = {}
+        self.writes = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def __connect(self):
+        con = self.datahandler.load_db(shared=True)
+        self.local.con = con
+        with self.lock:
+            self.connections.append(con)
+
+    def __call(self, method, *args, **kwargs):
+        return method(self.local.con, *args, **kwargs)
+
+    async def __run(self, executor, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, functools.partial(self.__call, method, *args, **kwargs))
+
+    async def __read(self, method, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())),
+               self.writes)
+        future = self.pending.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.__run(self.readers, method,
+                                                      *args, **kwargs))
+            self.pending[key] = future
+            future.add_done_callback(lambda _: self.pending.pop(key, None))
+        # Shielded, so a caller that is cancelled doesn't cancel the read
+        # for the others, and copied, so callers can't change each other's
+        # results.
+        return list(await asyncio.shield(future))
+
+    async def __write(self, method, *args, **kwargs):
+        try:
+            return await self.__run(self.writer, method, *args, **kwargs)
+        finally:
+            self.writes += 1
+
+    async def get_languages(self):
+        return await self.__read(self.datahandler.get_languages)
+
+    async def get_challenge_sets(self):
+        return await self.__read(self.datahandler.get_challenge_sets)
+
+    async def get_challenges(self):
+        return await self.__read(self.datahandler.get_challenges)
+
+    async def query_challenges(self, **kwargs):
+        """Run DataHandler.query_challenges with the keyword arguments
+        given."""
+        return await self.__read(self.datahandler.query_challenges, **kwargs)
+
+    def __pick(self, con, set_id, language, rng):
+        sampler = self.datahandler.get_sampler(con)
+        return sampler.sample(rng, set_id, language)
+
+    async def pick(self, set_id=None, language=None, rng=random):
+        """Return a random (challenge, language, modifier) triple, or None
+        if there is nothing to pick."""
+        return await self.__run(self.readers, self.__pick, set_id, language,
+                                rng)
+
+    async def add_language(self, name):
+        return await self.__write(self.datahandler.add_language, name)
+
+    async def add_challenge(self, set_id, desc, notes="", langs=[]):
+        return await self.__write(self.datahandler.add_challenge, set_id,
+                                  desc, notes, langs)
+
+    async def materialise_challenge(self, set_id, number):
+        return await self.__write(self.datahandler.materialise_challenge,
+                                  set_id, number)
+
+    async def accept_challenge(self, chall_id, language, modifier=None):
+        return await self.__write(self.datahandler.accept_challenge,
+                                  chall_id, language, modifier)
+
+    async def finish_challenge(self, chall_id):
+        return await self.__write(self.datahandler.finish_challenge,
+                                  chall_id)
+
+    def __shutdown(self):
+        self.writer.shutdown()
+        self.readers.shutdown()
+        with self.lock:
+            for con in self.connections:
+                self.datahandler.unload_db(con)
+            self.connections.clear()
+
+    async def close(self):
+        """Wait for the calls in progress, then close the connections."""
+        await asyncio.get_running_loop().run_in_executor(None,
+                                                         self.__shutdown)
@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+
+class ReadCache:
+    """Results of DataHandler reads, kept until the DB changes.
+
+    Writes made through the DataHandler call invalidate(). Commits made by
+    other connections, including ones in other processes, are noticed
+    through PRAGMA data_version, which only costs a lookup in SQLite's
+    memory. Entries are evicted least recently used first once the sizes
+    given for them add up to more than `max_size`.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.changes = 0
+        # id(con) -> (con, the data_version last seen on it)
+        self.data_versions = {}
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        with self.lock:
+            self.__clear()
+
+    def __clear(self):
+        # The caller holds self.lock.
+        self.changes += 1
+        self.entries.clear()
+        self.size = 0
+
+    def forget(self, con):
+        """Stop tracking a connection that is being closed."""
+        with self.lock:
+            self.data_versions.pop(id(con), None)
+
+    def __stamp(self, con):
+        """Return the change count, after counting any changes committed by
+        other connections since `con` was last checked."""
+        cur = con.cursor()
+        cur.execute("PRAGMA data_version;")
+        version = cur.fetchone()[0]
+        cur.close()
+
+        with self.lock:
+            seen = self.data_versions.get(id(con))
+            # A connection seen for the first time has nothing to compare
+            # with.
+            if seen is None or seen[0] is not con or seen[1] != version:
+                self.data_versions[id(con)] = (con, version)
+                self.__clear()
+            return self.changes
+
+    def get(self, con, key, build, size=len):
+        """Return the cached value for `key`, or store what build() returns.
+
+        `size` gives the share of max_size that a value takes up.
+        """
+        stamp = self.__stamp(con)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry[0]
+
+        value = build()
+        value_size = size(value)
+        with self.lock:
+            # Not cached if the DB changed while it was being read.
+            if stamp == self.changes and value_size <= self.max_size:
+                if key in self.entries:
+                    self.size -= self.entries.pop(key)[1]
+                self.entries[key] = (value, value_size)
+                self.size += value_size
+                while self.size > self.max_size:
+                    (_, (_, evicted)) = self.entries.popitem(last=False)
+                    self.size -= evicted
+        return value
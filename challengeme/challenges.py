@@ -1,12 +1,62 @@
+import bisect
+
+# Separates language names when a challenge's constraints are read back
+# from the DB as a single string.
+LANGUAGE_SEPARATOR = "\x1f"
+
 class Challenge():
+    __slots__ = ("id", "set_id", "description", "notes", "_langs",
+                 "date_started", "date_finished", "language_used",
+                 "modifier_used", "number")
+
     def __init__(self, chall_id, set_id, description, notes,
                  language_constraints, date_started, date_finished,
-                 language_used):
+                 language_used, modifier_used=None, number=None):
         self.id = chall_id
         self.set_id = set_id
         self.description = description
         self.notes = notes
-        self.language_constraints = language_constraints
+        # Either a list of names, or the joined string (or None) from the
+        # DB, which is only split when the constraints are first used.
+        self._langs = language_constraints
         self.date_started = date_started
         self.date_finished = date_finished
         self.language_used = language_used
+        self.modifier_used = modifier_used
+        # Position in a numbered challenge set, or id in the shared
+        # catalogue. Challenges from those have no id until they are
+        # accepted.
+        self.number = number
+
+    @property
+    def language_constraints(self):
+        if self._langs is None:
+            self._langs = []
+        elif isinstance(self._langs, str):
+            self._langs = self._langs.split(LANGUAGE_SEPARATOR)
+        return self._langs
+
+    @language_constraints.setter
+    def language_constraints(self, langs):
+        self._langs = langs
+
+def challenge_factory(cursor, row):
+    """sqlite3 row factory for rows selected with CHALLENGE_COLUMNS."""
+    return Challenge(*row)
+
+def virtual_description(set_name, number):
+    return f"{set_name} challenge {number}"
+
+def nth_unmaterialised(materialised, n):
+    """Return the n-th number (from 0) that isn't in sorted `materialised`."""
+    # The answer lies in [n, n + len(materialised)]; binary search for the
+    # first number that has n + 1 free numbers up to and including it.
+    low = n
+    high = n + len(materialised)
+    while low < high:
+        mid = (low + high) // 2
+        if mid + 1 - bisect.bisect_right(materialised, mid) > n:
+            high = mid
+        else:
+            low = mid + 1
+    return low
@@ -0,0 +1,197 @@
+import argparse
+import importlib
+import os
+
+import challengeme.config
+
+# Each subcommand names its handler as "module:function". The module is only
+# imported once the command line has been parsed, so a command never pays for
+# importing another command's handler.
+HANDLERS = "challengeme.handlers.commandhandler"
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="challengeme")
+    parser.add_argument('--profile', action='store_true',
+                        help="time the command, its DataHandler calls and "
+                             "its queries, and print a report")
+    parser.add_argument('--profile-output', metavar="FILE",
+                        help="write the profile to this file as JSON "
+                             "instead of printing it")
+    user = parser.add_mutually_exclusive_group()
+    user.add_argument('--profile-user', metavar="NAME",
+                      help="keep this user's progress in a DB of their own "
+                           "in the users directory")
+    user.add_argument('--db', metavar="FILE",
+                      help="keep the progress in this DB")
+    parser.add_argument('--catalogue', metavar="FILE",
+                        help="read the challenge sets from this shared "
+                             "catalogue instead of the defaults files")
+    subparsers = parser.add_subparsers()
+
+    parser_getlang = subparsers.add_parser('get-languages')
+    parser_getlang.set_defaults(func=f"{HANDLERS}:get_languages")
+
+    parser_addlang = subparsers.add_parser('add-language')
+    parser_addlang.add_argument('language')
+    parser_addlang.set_defaults(func=f"{HANDLERS}:add_language")
+
+    parser_getchall = subparsers.add_parser('get-challenges')
+    parser_getchall.add_argument('--set', help="only list this challenge set")
+    parser_getchall.add_argument('--limit', type=int,
+                                 help="list at most this many challenges")
+    parser_getchall.add_argument('--offset', type=int, default=0,
+                                 help="skip this many challenges first")
+    parser_getchall.set_defaults(func=f"{HANDLERS}:get_challenges")
+
+    # TODO: ask for description, notes and language constraints.
+    parser_addchall = subparsers.add_parser('add-challenge')
+    parser_addchall.set_defaults(func=f"{HANDLERS}:add_challenge")
+
+    parser_import = subparsers.add_parser('import-challenges')
+    parser_import.add_argument('file',
+                               help="a JSON Lines or CSV file of challenges")
+    parser_import.add_argument('--set',
+                               help="add them to this challenge set instead "
+                                    "of the self-added challenges")
+    parser_import.add_argument('--format', choices=["jsonl", "csv"],
+                               help="the file format, by default guessed "
+                                    "from the file extension")
+    parser_import.set_defaults(func=f"{HANDLERS}:import_challenges")
+
+    parser_delchall = subparsers.add_parser('delete-challenge')
+    parser_delchall.add_argument('--search',
+                                 help="only list challenges matching this")
+    parser_delchall.add_argument('--ids', type=int, nargs="+",
+                                 help="delete these challenges without "
+                                      "asking")
+    parser_delchall.set_defaults(func=f"{HANDLERS}:del_challenge")
+
+    # TODO: add further options for modifier.
+    parser_pick = subparsers.add_parser('pick-challenge')
+    parser_pick.add_argument('--set', help="only pick from this challenge set")
+    parser_pick.add_argument('--language', help="only pick this language")
+    parser_pick.add_argument('--seed', type=int,
+                             help="seed the random picks, for repeatable runs")
+    parser_pick.add_argument('--revisits', action='store_true',
+                             help="first offer a finished challenge that is "
+                                  "due to be revisited")
+    parser_pick.set_defaults(func=f"{HANDLERS}:pick_challenge")
+
+    parser_active = subparsers.add_parser('active-challenges')
+    parser_active.set_defaults(func=f"{HANDLERS}:active_challenges")
+
+    parser_complete = subparsers.add_parser('completed-challenges')
+    parser_complete.set_defaults(func=f"{HANDLERS}:completed_challenges")
+
+    # TODO: this will give a menu of which challenge to set as finished.
+    parser_finish = subparsers.add_parser('set-finished')
+    parser_finish.add_argument('--search',
+                               help="only list challenges matching this")
+    parser_finish.add_argument('--ids', type=int, nargs="+",
+                               help="finish these challenges without asking")
+    parser_finish.set_defaults(func=f"{HANDLERS}:set_finished")
+
+    parser_revisits = subparsers.add_parser('due-revisits')
+    parser_revisits.add_argument('--limit', type=int,
+                                 help="list at most this many challenges")
+    parser_revisits.set_defaults(func=f"{HANDLERS}:due_revisits")
+
+    parser_interval = subparsers.add_parser('revisit-interval')
+    parser_interval.add_argument('days', type=int, nargs="?",
+                                 help="days after finishing a challenge to "
+                                      "revisit it; leave out to go back to "
+                                      "the default")
+    target = parser_interval.add_mutually_exclusive_group(required=True)
+    target.add_argument('--set', help="for the challenges of this set")
+    target.add_argument('--language',
+                        help="for challenges finished in this language")
+    parser_interval.set_defaults(func=f"{HANDLERS}:revisit_interval")
+
+    parser_rescan = subparsers.add_parser('rescan-defaults')
+    parser_rescan.set_defaults(func=f"{HANDLERS}:rescan_defaults")
+
+    parser_search = subparsers.add_parser('search')
+    parser_search.add_argument('query')
+    parser_search.add_argument('--limit', type=int, default=20,
+                               help="show at most this many challenges")
+    parser_search.set_defaults(func=f"{HANDLERS}:search")
+
+    parser_stats = subparsers.add_parser('stats')
+    parser_stats.add_argument('--days', type=int, default=30,
+                              help="size of the recent activity window")
+    parser_stats.set_defaults(func=f"{HANDLERS}:stats")
+
+    parser_export = subparsers.add_parser('export')
+    parser_export.add_argument('file',
+                               help="the snapshot to write, compressed if "
+                                    "it ends in .gz")
+    parser_export.set_defaults(func=f"{HANDLERS}:export_snapshot")
+
+    parser_importsnap = subparsers.add_parser('import')
+    parser_importsnap.add_argument('file', help="a snapshot made by export")
+    parser_importsnap.add_argument('--force', action='store_true',
+                                   help="replace the progress already in "
+                                        "the database")
+    parser_importsnap.set_defaults(func=f"{HANDLERS}:import_snapshot")
+
+    parser_backup = subparsers.add_parser('backup')
+    parser_backup.add_argument('file', help="the database file to write")
+    parser_backup.set_defaults(func=f"{HANDLERS}:backup")
+
+    parser_catalogue = subparsers.add_parser('build-catalogue')
+    parser_catalogue.add_argument('file',
+                                  help="the catalogue to write from the "
+                                       "defaults files")
+    parser_catalogue.set_defaults(func=f"{HANDLERS}:build_catalogue")
+
+    parser_serve = subparsers.add_parser('serve')
+    parser_serve.add_argument('--host', default="127.0.0.1",
+                              help="address to listen on")
+    parser_serve.add_argument('--port', type=int, default=8080,
+                              help="port to listen on")
+    parser_serve.add_argument('--pool-size', type=int, default=4,
+                              help="number of DB connections to keep open")
+    parser_serve.set_defaults(func=f"{HANDLERS}:serve")
+
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if "func" not in args:
+        parser.print_help()
+        return
+
+    if args.profile_user is not None:
+        if (os.path.basename(args.profile_user) != args.profile_user
+                or args.profile_user in ("", ".", "..")):
+            parser.error(f"invalid user name {args.profile_user!r}")
+        os.makedirs(challengeme.config.usersdir, exist_ok=True)
+        challengeme.config.dbfile = os.path.join(challengeme.config.usersdir,
+                                                 f"{args.profile_user}.db")
+    elif args.db is not None:
+        challengeme.config.dbfile = args.db
+    if args.catalogue is not None:
+        challengeme.config.catalogue = args.catalogue
+
+    (module, func) = args.func.split(":")
+    handler = getattr(importlib.import_module(module), func)
+    if not args.profile and args.profile_output is None:
+        handler(args)
+        return
+
+    from challengeme.profiler import Profiler
+
+    profiler = Profiler()
+    profiler.enable()
+    try:
+        profiler.run_command(func, handler, args)
+    finally:
+        profiler.disable()
+        if args.profile_output is None:
+            profiler.report()
+        else:
+            import json
+
+            with open(args.profile_output, "w") as f:
+                json.dump(profiler.to_json(), f, indent=2)
@@ -2,3 +2,8 @@
 personal = "Self-added challenges"
 defaultsdir = "defaults"
 dbfile = "data.db"
+# A shared catalogue DB to read the challenge sets from instead of the
+# defaults files, or None. Make one with build-catalogue.
+catalogue = None
+# Where the DBs of the users picked with --profile-user are kept.
+usersdir = "users"
@@ -3,3 +3,9 @@ class AlreadyInDBError(Exception):
 
 class CorruptDatabaseError(Exception):
     pass
+
+class InvalidChallengeError(Exception):
+    pass
+
+class InvalidSnapshotError(Exception):
+    pass
@@ -1,12 +1,16 @@
-import random
+import sqlite3
 
 import challengeme.config
-from challengeme.exceptions import CorruptDatabaseError, AlreadyInDBError
-from challengeme.handlers.datahandler import DataHandler
+from challengeme.exceptions import (CorruptDatabaseError, AlreadyInDBError,
+                                    InvalidChallengeError,
+                                    InvalidSnapshotError)
+from challengeme.handlers.datahandler import DataHandler, parse_challenge
+from challengeme.handlers.schema import DURATION_BUCKETS
 
 def get_languages(args):
     datahandler = DataHandler(challengeme.config.defaultsdir,
-                             challengeme.config.dbfile)
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
     con = datahandler.load_db()
 
     languages = list(map(lambda x : x[1], datahandler.get_languages(con)))
@@ -16,7 +20,8 @@ def get_languages(args):
 
 def add_language(args):
     datahandler = DataHandler(challengeme.config.defaultsdir,
-                             challengeme.config.dbfile)
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
     con = datahandler.load_db()
 
     try:
@@ -29,13 +34,23 @@ def add_language(args):
 
 def get_challenges(args):
     datahandler = DataHandler(challengeme.config.defaultsdir,
-                             challengeme.config.dbfile)
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
     con = datahandler.load_db()
 
-    challenges = datahandler.get_challenges(con)
+    set_id = None
+    if args.set is not None:
+        set_id = datahandler.get_challenge_set_id(con, args.set)
+        if set_id is None:
+            print(f"There is no challenge set called {args.set}.")
+            datahandler.unload_db(con)
+            return
 
-    print(f"There are a total of {len(challenges)} challenges:")
-    for challenge in challenges:
+    print(f"There are a total of "
+          f"{datahandler.count_challenges(con, set_id)} challenges:")
+    for challenge in datahandler.iter_challenges(con, set_id=set_id,
+                                                 limit=args.limit,
+                                                 offset=args.offset):
         print(f"""
 Challenge: {challenge.description}
 Notes: {challenge.notes}
@@ -46,7 +61,8 @@ Language constraints: {challenge.language_constraints}
 
 def add_challenge(args):
     datahandler = DataHandler(challengeme.config.defaultsdir,
-                             challengeme.config.dbfile)
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
     con = datahandler.load_db()
 
     print("Enter the challenge info:")
@@ -68,18 +84,87 @@ def add_challenge(args):
         print("A challenge with this description has already been added.")
     datahandler.unload_db(con)
 
+def read_jsonl(file):
+    import json
+
+    for (i, line) in enumerate(file, 1):
+        if len(line.strip()) == 0:
+            continue
+        try:
+            chall = json.loads(line)
+        except ValueError as err:
+            raise InvalidChallengeError(f"Line {i} is not valid JSON: {err}")
+        yield parse_challenge(chall, f"Line {i}")
+
+def read_csv(file):
+    import csv
+
+    # Language constraints are separated by semicolons, since language
+    # names can contain spaces.
+    reader = csv.DictReader(file)
+    for chall in reader:
+        langs = chall.get("languageConstraints") or ""
+        chall["languageConstraints"] = [lang.strip() for lang
+                                        in langs.split(";") if lang.strip()]
+        yield parse_challenge(chall, f"Line {reader.line_num}")
+
+def import_challenges(args):
+    datahandler = DataHandler(challengeme.config.defaultsdir,
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
+    con = datahandler.load_db()
+
+    name = args.set or challengeme.config.personal
+    set_id = datahandler.get_challenge_set_id(con, name)
+    if set_id is None:
+        print(f"There is no challenge set called {name}.")
+        datahandler.unload_db(con)
+        return
+
+    file_format = args.format
+    if file_format is None:
+        file_format = "csv" if args.file.endswith(".csv") else "jsonl"
+    reader = read_csv if file_format == "csv" else read_jsonl
+
+    try:
+        with open(args.file, newline="", encoding="utf8") as f:
+            ids = datahandler.add_challenges(con, set_id, reader(f))
+    except (OSError, InvalidChallengeError) as err:
+        print(f"Error: {err}. No challenges were imported.")
+        datahandler.unload_db(con)
+        return
+
+    added = sum(chall_id is not None for chall_id in ids)
+    print(f"Imported {added} challenges into {name}, skipped "
+          f"{len(ids) - added} that were already in the database.")
+
+    datahandler.unload_db(con)
+
+def print_batch_results(chall_ids, results, done, not_done):
+    for (chall_id, result) in zip(chall_ids, results):
+        print(f"Challenge {chall_id} {done if result else not_done}.")
+
 def del_challenge(args):
     """
     2. Let the user enter a number to delete.
     """
     datahandler = DataHandler(challengeme.config.defaultsdir,
-                             challengeme.config.dbfile)
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
     con = datahandler.load_db()
 
     # Get self-made challenges
-    challenges = datahandler.get_challenges(con)
     set_id = datahandler.get_challenge_set_id(con, challengeme.config.personal)
-    challenges = [chall for chall in challenges if chall.set_id == set_id]
+
+    if args.ids is not None:
+        results = datahandler.delete_challenges(con, args.ids, set_id)
+        print_batch_results(args.ids, results, "deleted",
+                            "is not a self-made challenge")
+        datahandler.unload_db(con)
+        return
+
+    challenges = datahandler.query_challenges(con, set_id=set_id,
+                                              search=args.search)
 
     # Print self-made challenges and number them.
     if len(challenges) == 0:
@@ -114,65 +199,150 @@ def del_challenge(args):
 
 def pick_challenge(args):
     datahandler = DataHandler(challengeme.config.defaultsdir,
-                             challengeme.config.dbfile)
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
     con = datahandler.load_db()
 
-    # Get all unstarted challenges
-    challenges = [chall for chall in datahandler.get_challenges(con)
-                 if chall.date_started is None]
-    challenge = random.choice(challenges)
-
     languages = [lang[1] for lang in datahandler.get_languages(con)]
     if len(languages) == 0:
         print("You have not added any languages!")
-        print(f"python ./{args.prog} add-language <language>")
-
-    if len(challenge.language_constraints) != 0:
-        languages = [lang for lang in languages
-                     if lang in challenge.language_constraints]
+        print("python ./main.py add-language <language>")
+        datahandler.unload_db(con)
+        return
 
-        # If there are no languages meeting the language constraints
-        if len(languages) == 0:
-            pick_challenge(args)
+    set_id = None
+    if args.set is not None:
+        set_id = datahandler.get_challenge_set_id(con, args.set)
+        if set_id is None:
+            print(f"There is no challenge set called {args.set}.")
+            datahandler.unload_db(con)
             return
 
-    language = random.choice(languages)
+    if args.revisits and offer_revisit(datahandler, con, set_id,
+                                       args.language):
+        datahandler.unload_db(con)
+        return
+
+    import random
+
+    # Pick from the unstarted challenges that can be done in a saved language
+    sampler = datahandler.get_sampler(con)
+    pick = sampler.sample(random.Random(args.seed), set_id, args.language)
+    if pick is None:
+        print("There are no unstarted challenges matching your languages.")
+        datahandler.unload_db(con)
+        return
+    (challenge, language, modifier) = pick
 
     print("Your task is:")
     print(f"{challenge.description}")
     print(f"({challenge.notes})")
     print(f"Language: {language}")
+    if modifier is not None:
+        print(f"Modifier: {modifier}")
 
     accept = input("Do you choose to accept it? [y/n] ")
     if accept.lower() == "y":
-        datahandler.accept_challenge(con, challenge.id, language)
-        print("Challenge accepted.")
+        if challenge.id is None:
+            challenge.id = datahandler.materialise_challenge(
+                con, challenge.set_id, challenge.number)
+        if datahandler.accept_challenge(con, challenge.id, language,
+                                        modifier):
+            print("Challenge accepted.")
+        else:
+            print("This challenge has already been accepted.")
+    else:
+        decline_challenge(datahandler, con, challenge, language, modifier)
 
     datahandler.unload_db(con)
 
+def offer_revisit(datahandler, con, set_id, language):
+    """Offer the finished challenge that has been due to be revisited the
+    longest. Returns True if the user took it."""
+    revisits = datahandler.get_due_revisits(con, set_id=set_id,
+                                            language=language, limit=1)
+    if len(revisits) == 0:
+        return False
+    (challenge, due) = revisits[0]
+
+    print("It is time to revisit:")
+    print(f"{challenge.description}")
+    print(f"Language: {challenge.language_used}")
+    print(f"Finished: {challenge.date_finished} (due {due})")
+    revisit = input("Do you want to refactor it now? [y/n] ")
+    if revisit.lower() != "y":
+        return False
+    datahandler.complete_revisit(con, challenge.id)
+    print("Revisit accepted.")
+    return True
+
+def decline_challenge(datahandler, con, challenge, language, modifier):
+    choices = {"l": "this challenge in this language"}
+    if modifier is not None:
+        choices["m"] = "this challenge with this modifier"
+        choices["b"] = "this language with this modifier"
+    print("Never pick:")
+    for (key, choice) in choices.items():
+        print(f"[{key}] {choice}")
+    try:
+        exclude = input("Exclude any of these? [" + "/".join(choices)
+                        + "/n] ").lower()
+    except EOFError:
+        # Scripts that only answer the accept prompt mean no.
+        print()
+        exclude = "n"
+    if exclude not in choices:
+        return
+
+    if exclude == "b":
+        datahandler.add_exclusion(con, language=language, modifier=modifier)
+    else:
+        if challenge.id is None:
+            challenge.id = datahandler.materialise_challenge(
+                con, challenge.set_id, challenge.number)
+        if exclude == "l":
+            datahandler.add_exclusion(con, challenge.id, language=language)
+        else:
+            datahandler.add_exclusion(con, challenge.id, modifier=modifier)
+    print(f"You will not be offered {choices[exclude]} again.")
+
 def active_challenges(args):
     datahandler = DataHandler(challengeme.config.defaultsdir,
-                             challengeme.config.dbfile)
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
     con = datahandler.load_db()
 
-    challenges = [chall for chall in datahandler.get_challenges(con)
-                 if chall.date_started is not None]
+    challenges = datahandler.query_challenges(con, started=True,
+                                              finished=False,
+                                              order_by="date_started")
 
     print("Here are your actively running challenges:")
     for chall in challenges:
         print(f"[{chall.language_used}] {chall.description}")
+        if chall.modifier_used is not None:
+            print(f"\tModifier: {chall.modifier_used}")
         print(f"\tStarted: {chall.date_started}")
 
     datahandler.unload_db(con)
 
 def set_finished(args):
     datahandler = DataHandler(challengeme.config.defaultsdir,
-                             challengeme.config.dbfile)
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
     con = datahandler.load_db()
 
+    if args.ids is not None:
+        results = datahandler.finish_challenges(con, args.ids)
+        print_batch_results(args.ids, results, "marked as finished",
+                            "is not an active challenge")
+        datahandler.unload_db(con)
+        return
+
     # Get active challenges
-    challenges = [chall for chall in datahandler.get_challenges(con)
-                 if chall.date_started is not None]
+    challenges = datahandler.query_challenges(con, started=True,
+                                              finished=False,
+                                              order_by="date_started",
+                                              search=args.search)
 
     if len(challenges) == 0:
         print(f"You have no active challenges, exiting...")
@@ -200,23 +370,286 @@ def set_finished(args):
 
     confirm = input(f"Finish challenge {to_finish}? [y/n] ")
     if confirm.lower() == "y":
-        datahandler.finish_challenge(con, challenges[to_finish].id)
-        print(f"Challenge marked as finished.")
+        if datahandler.finish_challenge(con, challenges[to_finish].id):
+            print(f"Challenge marked as finished.")
+        else:
+            print(f"This challenge has already been finished.")
 
     datahandler.unload_db(con)
 
 def completed_challenges(args):
     datahandler = DataHandler(challengeme.config.defaultsdir,
-                             challengeme.config.dbfile)
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
     con = datahandler.load_db()
 
-    challenges = [chall for chall in datahandler.get_challenges(con)
-                 if chall.date_finished is not None]
+    challenges = datahandler.query_challenges(con, finished=True,
+                                              order_by="date_finished")
 
     print("Here are your completed challenges:")
     for chall in challenges:
         print(f"[{chall.language_used}] {chall.description}")
+        if chall.modifier_used is not None:
+            print(f"\tModifier: {chall.modifier_used}")
         print(f"\tStarted: {chall.date_started}")
         print(f"\tFinished: {chall.date_started}")
 
     datahandler.unload_db(con)
+
+def due_revisits(args):
+    datahandler = DataHandler(challengeme.config.defaultsdir,
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
+    con = datahandler.load_db()
+
+    revisits = datahandler.get_due_revisits(con, limit=args.limit)
+    if len(revisits) == 0:
+        print("No finished challenges are due to be revisited.")
+    else:
+        print("These finished challenges are due to be revisited:")
+    for (chall, due) in revisits:
+        print(f"[{chall.language_used}] {chall.description}")
+        print(f"\tFinished: {chall.date_finished}")
+        print(f"\tDue: {due}")
+
+    datahandler.unload_db(con)
+
+def revisit_interval(args):
+    datahandler = DataHandler(challengeme.config.defaultsdir,
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
+    con = datahandler.load_db()
+
+    if args.set is not None:
+        set_id = datahandler.get_challenge_set_id(con, args.set)
+        if set_id is None:
+            print(f"There is no challenge set called {args.set}.")
+            datahandler.unload_db(con)
+            return
+        datahandler.set_revisit_interval(con, args.days, set_id=set_id)
+    else:
+        datahandler.set_revisit_interval(con, args.days,
+                                         language=args.language)
+
+    if args.set is not None:
+        target = f"Challenges from {args.set}"
+    else:
+        target = f"Challenges finished in {args.language}"
+    if args.days is None:
+        print(f"{target} are revisited after the default interval.")
+    else:
+        print(f"{target} are revisited {args.days} days after they are "
+              "finished.")
+
+    datahandler.unload_db(con)
+
+def search(args):
+    datahandler = DataHandler(challengeme.config.defaultsdir,
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
+    con = datahandler.load_db()
+
+    challenges = datahandler.search_challenges(con, args.query, args.limit)
+    if len(challenges) == 0:
+        print(f"No challenges match {args.query}.")
+    for challenge in challenges:
+        print(f"""
+Challenge: {challenge.description}
+Notes: {challenge.notes}
+Language constraints: {challenge.language_constraints}
+              """)
+
+    datahandler.unload_db(con)
+
+def rescan_defaults(args):
+    datahandler = DataHandler(challengeme.config.defaultsdir,
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
+    con = datahandler.load_db()
+
+    changed = datahandler.rescan_defaults(con)
+    if len(changed) == 0:
+        print("The challenge sets are up to date.")
+    for name in changed:
+        print(f"Imported challenge set file {name}.")
+
+    datahandler.unload_db(con)
+
+def stats(args):
+    datahandler = DataHandler(challengeme.config.defaultsdir,
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
+    con = datahandler.load_db()
+
+    (started, finished) = datahandler.get_activity(con, args.days)
+    print(f"In the last {args.days} days you started {started} and "
+          f"finished {finished} challenges.")
+
+    print("\nBy language:")
+    for (lang, started, finished, days) in datahandler.get_language_stats(con):
+        average = f", {days / finished:.1f} days on average" if finished else ""
+        print(f"[{lang}] {started} started, {finished} finished{average}")
+
+    print("\nBy challenge set:")
+    for (name, started, finished, days) in datahandler.get_set_stats(con):
+        print(f"[{name}] {started} started, {finished} finished")
+
+    print("\nTime taken to finish:")
+    labels = ([f"under {bound} day{'s' if bound > 1 else ''}"
+               for bound in DURATION_BUCKETS]
+              + [f"{DURATION_BUCKETS[-1]} days or more"])
+    for (label, count) in zip(labels,
+                              datahandler.get_duration_histogram(con)):
+        print(f"{label:>20}: {count}")
+
+    datahandler.unload_db(con)
+
+def open_snapshot(path, mode):
+    """Open a snapshot file for text, compressed if it ends in .gz."""
+    if path.endswith(".gz"):
+        import gzip
+        return gzip.open(path, mode + "t", encoding="utf8")
+    return open(path, mode, encoding="utf8")
+
+def write_snapshot(datahandler, con, file):
+    """Write a snapshot as JSON Lines: a header with the schema version,
+    then for each table a line with its columns followed by a line for
+    each row."""
+    import json
+
+    from challengeme.handlers.schema import SCHEMA_VERSION
+
+    encoder = json.JSONEncoder(separators=(",", ":"))
+    file.write(encoder.encode({"snapshot": SCHEMA_VERSION}) + "\n")
+    for (table, columns, rows) in datahandler.export_snapshot(con):
+        if len(rows) == 0:
+            file.write(encoder.encode({"table": table,
+                                       "columns": columns}) + "\n")
+        file.writelines(encoder.encode(row) + "\n" for row in rows)
+
+def read_snapshot(file):
+    """Return the schema version of a snapshot written by write_snapshot,
+    and an iterator over its (table, columns, rows) chunks."""
+    import json
+
+    from challengeme.handlers.datahandler import IMPORT_CHUNK_SIZE
+
+    def parse(lines):
+        for (i, line) in lines:
+            try:
+                yield json.loads(line)
+            except ValueError as err:
+                raise InvalidSnapshotError(f"Line {i} is not valid JSON: "
+                                           f"{err}")
+
+    records = parse(enumerate(file, 1))
+    header = next(records, None)
+    if not isinstance(header, dict) or "snapshot" not in header:
+        raise InvalidSnapshotError("The file is not a snapshot")
+
+    def chunks():
+        (table, columns, rows) = (None, None, [])
+        for record in records:
+            if isinstance(record, dict):
+                if table is not None:
+                    yield (table, columns, rows)
+                (table, columns, rows) = (record.get("table"),
+                                          record.get("columns"), [])
+            elif table is None:
+                raise InvalidSnapshotError("A row comes before its table")
+            else:
+                rows.append(record)
+                if len(rows) == IMPORT_CHUNK_SIZE:
+                    yield (table, columns, rows)
+                    rows = []
+        if table is not None:
+            yield (table, columns, rows)
+
+    return (header["snapshot"], chunks())
+
+def export_snapshot(args):
+    datahandler = DataHandler(challengeme.config.defaultsdir,
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
+    con = datahandler.load_db()
+
+    try:
+        with open_snapshot(args.file, "w") as f:
+            write_snapshot(datahandler, con, f)
+    except OSError as err:
+        print(f"Error: {err}.")
+    else:
+        print(f"Exported the database to {args.file}.")
+
+    datahandler.unload_db(con)
+
+def import_snapshot(args):
+    datahandler = DataHandler(challengeme.config.defaultsdir,
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
+    con = datahandler.load_db()
+
+    if (not args.force
+            and datahandler.query_challenges(con, started=True, limit=1)):
+        print("The database already holds progress, which importing would "
+              "replace. Use --force to import anyway.")
+        datahandler.unload_db(con)
+        return
+
+    try:
+        with open_snapshot(args.file, "r") as f:
+            datahandler.import_snapshot(con, *read_snapshot(f))
+    except (OSError, InvalidSnapshotError) as err:
+        print(f"Error: {err}. Nothing was imported.")
+    else:
+        print(f"Imported {args.file} into the database.")
+
+    datahandler.unload_db(con)
+
+def backup(args):
+    datahandler = DataHandler(challengeme.config.defaultsdir,
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
+    con = datahandler.load_db()
+
+    try:
+        datahandler.backup_db(con, args.file)
+    except sqlite3.Error as err:
+        print(f"Error: {err}.")
+    else:
+        print(f"Backed up the database to {args.file}.")
+
+    datahandler.unload_db(con)
+
+def build_catalogue(args):
+    import os
+
+    # Users' DBs read the catalogue as immutable, so it is built beside its
+    # final path and moved there in one step.
+    building = args.file + ".building"
+    for path in (building, building + "-wal", building + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+    datahandler = DataHandler(challengeme.config.defaultsdir, building)
+    con = datahandler.load_db()
+    datahandler.seal_catalogue(con)
+    datahandler.unload_db(con)
+    os.replace(building, args.file)
+    print(f"Built the catalogue {args.file} from "
+          f"{challengeme.config.defaultsdir}.")
+
+def serve(args):
+    from challengeme.server import ChallengeServer
+
+    datahandler = DataHandler(challengeme.config.defaultsdir,
+                             challengeme.config.dbfile,
+                             challengeme.config.catalogue)
+    server = ChallengeServer((args.host, args.port), datahandler,
+                             args.pool_size)
+    print(f"Serving on http://{args.host}:{server.server_port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -1,24 +1,198 @@
-import datetime
-import json
-from pathlib import Path
+import functools
 import os
 import sqlite3
 import sys
+import time
+from contextlib import contextmanager
+from itertools import islice
 
-from ..exceptions import CorruptDatabaseError, AlreadyInDBError
-from ..challenges import Challenge
+from ..cache import ReadCache
+from ..config import personal
+from ..exceptions import (CorruptDatabaseError, AlreadyInDBError,
+                          InvalidChallengeError, InvalidSnapshotError)
+from ..challenges import (Challenge, LANGUAGE_SEPARATOR, challenge_factory,
+                          nth_unmaterialised, virtual_description)
+from . import schema
+
+# Modules that only some commands need (json, hashlib, pathlib and the
+# sampler) are imported where they are used, to keep CLI start-up fast.
+
+# Number of rows looked up or written at a time by imports and the batch
+# methods.
+IMPORT_CHUNK_SIZE = 500
+
+# The challenges columns, with the language constraints joined in, in the
+# order expected by challenge_factory.
+CHALLENGE_COLUMNS = f"""challenges.id, challenges.set_id,
+                        challenges.description, challenges.notes,
+                        (SELECT group_concat(languages.name,
+                                             '{LANGUAGE_SEPARATOR}')
+                         FROM challenge_languages JOIN languages
+                         ON languages.id = challenge_languages.language_id
+                         WHERE challenge_id = challenges.id),
+                        challenges.date_started, challenges.date_finished,
+                        challenges.language_used, challenges.modifier_used"""
+
+# The columns of a shared catalogue's challenges, selected from
+# catalogue.challenges AS c, with their language constraints joined in.
+CATALOGUE_COLUMNS = f"""c.id, c.set_id, c.description, c.notes,
+                        (SELECT group_concat(languages.name,
+                                             '{LANGUAGE_SEPARATOR}')
+                         FROM catalogue.challenge_languages
+                         JOIN catalogue.languages
+                         ON languages.id = challenge_languages.language_id
+                         WHERE challenge_id = c.id)"""
+
+# Number of rows fetched at a time by iter_challenges.
+ITER_BATCH_SIZE = 256
+
+# Columns that query_challenges can order by.
+ORDER_COLUMNS = ("id", "set_id", "description", "date_started",
+                 "date_finished", "language_used")
+
+# Most challenges the read cache holds, over all of its cached lists.
+CACHE_SIZE = 200000
+
+# Seconds a statement waits for another connection's lock before failing.
+BUSY_TIMEOUT = 5.0
+
+# How many times, and after how long at first, a write transaction retries
+# taking the write lock once the busy timeout has run out.
+WRITE_RETRIES = 5
+RETRY_DELAY = 0.05
+
+# Pages copied per step of a backup. Other connections can use the DB
+# between steps.
+BACKUP_PAGES = 1024
+
+# Bytes of a shared catalogue that are memory-mapped, so that the processes
+# reading it share the OS page cache instead of each copying its pages.
+CATALOGUE_MMAP_SIZE = 1 << 30
+
+def begin_write(con):
+    """Take the write lock with BEGIN IMMEDIATE, retrying with exponential
+    backoff while another connection holds it."""
+    delay = RETRY_DELAY
+    for attempt in range(WRITE_RETRIES):
+        try:
+            con.execute("BEGIN IMMEDIATE;")
+            return
+        except sqlite3.OperationalError as err:
+            if ("locked" not in str(err) and "busy" not in str(err)
+                    or attempt == WRITE_RETRIES - 1):
+                raise
+        import random
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay *= 2
+
+def write_transaction(method):
+    """Run a DataHandler method that writes in a short transaction of its
+    own, committed when it returns and rolled back if it raises.
+
+    The write lock is taken before anything is read, so the method can't be
+    interrupted by another writer and never has to be re-run. A method called
+    while a transaction is already open is simply part of that transaction.
+    """
+    @functools.wraps(method)
+    def wrapper(self, con, *args, **kwargs):
+        # Reads made during or after the write mustn't come from the cache.
+        self.cache.invalidate()
+        if con.in_transaction:
+            return method(self, con, *args, **kwargs)
+
+        begin_write(con)
+        try:
+            result = method(self, con, *args, **kwargs)
+        except BaseException:
+            con.rollback()
+            self.cache.invalidate()
+            raise
+        con.commit()
+        self.cache.invalidate()
+        return result
+    return wrapper
+
+@contextmanager
+def read_transaction(con):
+    """Make the reads inside the block see a single snapshot of the DB,
+    even if other connections commit meanwhile."""
+    if con.in_transaction:
+        yield
+        return
+    con.execute("BEGIN;")
+    try:
+        yield
+    finally:
+        con.rollback()
+
+def chunked(iterable, size):
+    """Split an iterable into lists of at most `size` items."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while len(chunk) > 0:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+def parse_challenge(chall, name):
+    """Validate a challenge dict and return it as a (description, notes,
+    langs) tuple. `name` says where the challenge came from in errors."""
+    if not isinstance(chall, dict):
+        raise InvalidChallengeError(f"{name} is not an object")
+
+    desc = chall.get("description")
+    if not isinstance(desc, str) or len(desc) == 0:
+        raise InvalidChallengeError(f"{name} has no description")
+
+    notes = chall.get("notes", "")
+    if notes is None:
+        notes = ""
+    if not isinstance(notes, str):
+        raise InvalidChallengeError(f"{name} ({desc}) has invalid notes")
+
+    langs = chall.get("languageConstraints", [])
+    if (not isinstance(langs, list)
+            or not all(isinstance(lang, str) and len(lang) > 0
+                       for lang in langs)):
+        raise InvalidChallengeError(f"{name} ({desc}) has invalid language "
+                                    "constraints")
+    return (desc, notes, langs)
+
+def fts_query(text):
+    """Turn free text into an FTS5 query that matches every word as a
+    prefix, so that user input can't be a syntax error."""
+    return " ".join('"' + word.replace('"', '""') + '"*'
+                    for word in text.split())
 
 class DataHandler:
-    """Handle reading and writing saved challenge data."""
+    """Handle reading and writing saved challenge data.
+
+    Given a `catalogue`, the challenge sets come from that shared DB, which
+    is attached read-only, instead of from the defaults files, and `dbfile`
+    only holds the user's own data. A catalogue challenge gets a row in
+    `dbfile` once it is accepted or declined, like a numbered challenge.
+    """
+
+    # The class of the connections opened by load_db, which the profiler
+    # replaces with one that times queries.
+    connection_factory = sqlite3.Connection
 
-    def __init__(self, defaultsdir, dbfile):
+    def __init__(self, defaultsdir, dbfile, catalogue=None):
         self.defaultsdir = defaultsdir
         self.dbfile = dbfile
+        self.catalogue = catalogue
         self.challenges = []
+        # Whether each attached DB has the full-text index, by name.
+        self.fts = {}
+        self.cache = ReadCache(CACHE_SIZE)
 
-    def __connect_to_db(self):
+    def __connect_to_db(self, shared):
         try:
-            con = sqlite3.connect(self.dbfile)
+            # The catalogue is attached by URI, which only works on a
+            # connection that allows them. A plain path is still a path.
+            con = sqlite3.connect(self.dbfile, timeout=BUSY_TIMEOUT,
+                                  check_same_thread=not shared,
+                                  factory=self.connection_factory,
+                                  uri=self.catalogue is not None)
         except sqlite3.Error as err:
             print(err, file=sys.stderr)
         return con
@@ -27,38 +201,10 @@ class DataHandler:
         if con:
             con.close()
 
-    def __create_tables(self, con):
-        cur = con.cursor()
-        cur.execute("""
-                       CREATE TABLE IF NOT EXISTS challenge_sets (
-                           id integer PRIMARY KEY,
-                           name text NOT NULL
-                      );
-                       """)
-        cur.execute("""
-                       CREATE TABLE IF NOT EXISTS languages (
-                           id integer PRIMARY KEY,
-                           name text NOT NULL
-                      );
-                       """)
-        cur.execute("""
-                       CREATE TABLE IF NOT EXISTS challenges (
-                           id integer PRIMARY KEY,
-                           set_id integer NOT NULL,
-                           description text NOT NULL UNIQUE,
-                           notes text,
-                           language_constraints text,
-                           date_started text,
-                           date_finished text,
-                           language_used integer,
-                           FOREIGN KEY (set_id) REFERENCES challenge_sets (id)
-                      );
-                       """)
-        cur.close()
-
     def get_language_id(self, con, name):
         cur = con.cursor()
-        cur.execute("SELECT id FROM languages WHERE name = ?;", (name,))
+        cur.execute("SELECT id FROM languages WHERE name = ? AND saved = 1;",
+                    (name,))
 
         row = cur.fetchone()
         if row is None:
@@ -70,20 +216,60 @@ class DataHandler:
         return lang_id
 
     def get_languages(self, con):
-        cur = con.cursor()
-        cur.execute("SELECT * FROM languages;")
+        def read():
+            cur = con.cursor()
+            cur.execute("SELECT id, name FROM languages WHERE saved = 1;")
+            return cur.fetchall()
 
-        return list(cur.fetchall())
+        return list(self.cache.get(con, "languages", read))
 
+    @write_transaction
     def add_language(self, con, name):
         cur = con.cursor()
         if self.get_language_id(con, name) is not None:
             raise AlreadyInDBError(f"Language {name} is already in the DB")
 
-        cur.execute("INSERT INTO languages(name) VALUES(?);", (name,))
+        cur.execute("UPDATE languages SET saved = 1 WHERE name = ?;", (name,))
+        if cur.rowcount == 0:
+            cur.execute("INSERT INTO languages(name) VALUES(?);", (name,))
         cur.close()
         return self.get_language_id(con, name)
 
+    def __get_language_ids(self, con, names):
+        """Map language names to their ids.
+
+        Languages that aren't in the DB yet are added without being saved,
+        so they don't show up in get_languages.
+        """
+        cur = con.cursor()
+        lang_ids = {}
+        for name in names:
+            if name in lang_ids:
+                continue
+            cur.execute("SELECT id FROM languages WHERE name = ?;", (name,))
+            row = cur.fetchone()
+            if row is None:
+                cur.execute("""INSERT INTO languages(name, saved)
+                               VALUES(?, 0);""", (name,))
+                lang_ids[name] = cur.lastrowid
+            else:
+                lang_ids[name] = row[0]
+        cur.close()
+        return lang_ids
+
+    def __add_language_constraints(self, con, constraints):
+        """Record (challenge id, language name) pairs in challenge_languages."""
+        lang_ids = self.__get_language_ids(con, (name for (chall_id, name)
+                                                 in constraints))
+        rows = [(chall_id, lang_ids[name]) for (chall_id, name)
+                in constraints]
+
+        cur = con.cursor()
+        cur.executemany("""INSERT OR IGNORE INTO challenge_languages(
+                               challenge_id, language_id)
+                           VALUES(?,?);""", rows)
+        cur.close()
+
     def get_challenge_id(self, con, desc):
         cur = con.cursor()
         cur.execute("SELECT id FROM challenges WHERE description = ?;",
@@ -99,16 +285,634 @@ class DataHandler:
         return challenge_id
 
     def get_challenges(self, con):
+        return self.query_challenges(con)
+
+    def query_challenges(self, con, set_id=None, started=None, finished=None,
+                         language_used=None, order_by="id", descending=False,
+                         limit=None, offset=0, virtual=True,
+                         allowed_language=None, search=None):
+        """Return the challenges matching all of the given predicates.
+
+        `started` and `finished` select challenges with (True) or without
+        (False) a start or finish date, and None doesn't filter on them.
+        `allowed_language` selects the challenges that have no language
+        constraints or that allow the language with that name, and `search`
+        the ones whose description or notes contain all of its words.
+        Unaccepted challenges from numbered sets and from the catalogue have
+        no row to order by, so they always come after the other challenges,
+        the catalogue's first. Pass virtual=False to leave them out.
+
+        The lists of all challenges and of the challenges in a set are
+        cached, so the Challenge objects in them must not be changed.
+        """
+        if (started, finished, language_used, order_by, descending, limit,
+                offset, virtual, allowed_language, search) == (
+                None, None, None, "id", False, None, 0, True, None, None):
+            return list(self.cache.get(
+                con, ("challenges", set_id),
+                lambda: list(self.iter_challenges(con, set_id=set_id))))
+        return list(self.iter_challenges(
+            con, set_id=set_id, started=started, finished=finished,
+            language_used=language_used, order_by=order_by,
+            descending=descending, limit=limit, offset=offset,
+            virtual=virtual, allowed_language=allowed_language,
+            search=search))
+
+    def iter_challenges(self, con, set_id=None, started=None, finished=None,
+                        language_used=None, order_by="id", descending=False,
+                        limit=None, offset=0, virtual=True,
+                        allowed_language=None, search=None,
+                        batch_size=ITER_BATCH_SIZE):
+        """Yield the challenges matching the query_challenges predicates.
+
+        Rows are read from the DB `batch_size` at a time, so memory use
+        doesn't depend on how many challenges match.
+        """
+        if order_by not in ORDER_COLUMNS:
+            raise ValueError(f"Can't order challenges by {order_by}")
+
+        where = []
+        params = []
+        if set_id is not None:
+            where.append("set_id = ?")
+            params.append(set_id)
+        for (column, value) in (("date_started", started),
+                                ("date_finished", finished)):
+            if value is not None:
+                where.append(f"{column} IS {'NOT ' if value else ''}NULL")
+        if language_used is not None:
+            where.append("language_used = ?")
+            params.append(language_used)
+        if allowed_language is not None:
+            where.append("""(NOT EXISTS (SELECT 1 FROM challenge_languages
+                                         WHERE challenge_id = challenges.id)
+                             OR id IN (SELECT challenge_id
+                                       FROM challenge_languages
+                                       JOIN languages
+                                       ON languages.id = language_id
+                                       WHERE languages.name = ?))""")
+            params.append(allowed_language)
+        if search is not None and len(search.split()) > 0:
+            if self.__has_fts(con):
+                where.append("""id IN (SELECT rowid FROM challenges_fts
+                                       WHERE challenges_fts MATCH ?)""")
+                params.append(fts_query(search))
+            else:
+                for word in search.split():
+                    where.append("(description LIKE ? OR notes LIKE ?)")
+                    params.extend([f"%{word}%"] * 2)
+        where = f"WHERE {' AND '.join(where)}" if len(where) > 0 else ""
+
+        cur = con.cursor()
+        cur.row_factory = challenge_factory
+        cur.execute(f"""SELECT {CHALLENGE_COLUMNS} FROM challenges {where}
+                        ORDER BY {order_by} {'DESC' if descending else 'ASC'},
+                                 id {'DESC' if descending else 'ASC'}
+                        LIMIT ? OFFSET ?;""",
+                    params + [-1 if limit is None else limit, offset])
+        found = 0
+        challenges = cur.fetchmany(batch_size)
+        while len(challenges) > 0:
+            yield from challenges
+            found += len(challenges)
+            challenges = cur.fetchmany(batch_size)
+
+        # Challenges without a row are never started, finished or given a
+        # language.
+        if (not virtual or started is True or finished is True
+                or language_used is not None
+                or (limit is not None and found >= limit)):
+            cur.close()
+            return
+
+        if found > 0 or offset == 0:
+            skip = 0
+        else:
+            cur.row_factory = None
+            cur.execute(f"SELECT COUNT(*) FROM challenges {where};", params)
+            skip = max(0, offset - cur.fetchone()[0])
+        cur.close()
+
+        remaining = None if limit is None else limit - found
+        if self.catalogue is not None:
+            shown = 0
+            for chall in self.__get_catalogue_challenges(
+                    con, set_id, allowed_language, search, skip, remaining,
+                    batch_size):
+                yield chall
+                shown += 1
+            if remaining is not None:
+                remaining -= shown
+                if remaining <= 0:
+                    return
+            if shown == 0 and skip > 0:
+                skip = max(0, skip - self.__count_catalogue_challenges(
+                    con, set_id, allowed_language, search))
+            else:
+                skip = 0
+
+        # Numbered challenges aren't in the full-text index.
+        if search is None:
+            yield from self.__get_virtual_challenges(con, set_id, skip,
+                                                     remaining)
+
+    def __has_fts(self, con, db="main"):
+        if db not in self.fts:
+            cur = con.cursor()
+            cur.execute(f"""SELECT 1 FROM {db}.sqlite_master
+                            WHERE name = 'challenges_fts';""")
+            self.fts[db] = cur.fetchone() is not None
+            cur.close()
+        return self.fts[db]
+
+    def search_challenges(self, con, text, limit=20):
+        """Return the challenges whose description or notes contain all of
+        the words in `text`, best matches first.
+
+        Challenges from numbered sets can only be found once accepted.
+        """
+        if not self.__has_fts(con):
+            return self.query_challenges(con, search=text, limit=limit)
+        if len(text.split()) == 0:
+            return []
+
+        cur = con.cursor()
+        cur.execute(f"""SELECT {CHALLENGE_COLUMNS}, bm25(challenges_fts)
+                        FROM challenges_fts JOIN challenges
+                        ON challenges.id = challenges_fts.rowid
+                        WHERE challenges_fts MATCH ?
+                        ORDER BY bm25(challenges_fts)
+                        LIMIT ?;""", (fts_query(text), limit))
+        found = [(row[-1], challenge_factory(cur, row[:-1]))
+                 for row in cur.fetchall()]
+        cur.close()
+        if self.catalogue is None:
+            return [chall for (rank, chall) in found]
+
+        # The best matches of both DBs, merged by rank.
+        where = self.__catalogue_where(con)
+        if not self.__has_fts(con, "catalogue"):
+            found.extend((0.0, chall) for chall
+                         in self.__get_catalogue_challenges(con, search=text,
+                                                            limit=limit))
+        elif where is not None:
+            cur = con.cursor()
+            cur.execute(f"""SELECT {CATALOGUE_COLUMNS}, bm25(challenges_fts)
+                            FROM catalogue.challenges_fts
+                            JOIN catalogue.challenges AS c
+                            ON c.id = challenges_fts.rowid
+                            WHERE challenges_fts MATCH ? AND {where[0]}
+                            ORDER BY bm25(challenges_fts)
+                            LIMIT ?;""",
+                        [fts_query(text)] + where[1] + [limit])
+            found.extend((row[-1], self.__catalogue_challenge(con, row[:-1]))
+                         for row in cur.fetchall())
+            cur.close()
+        found.sort(key=lambda match: match[0])
+        return [chall for (rank, chall) in found[:limit]]
+
+    def count_challenges(self, con, set_id=None):
+        """Return the number of challenges, including numbered ones."""
+        cur = con.cursor()
+        if set_id is None:
+            cur.execute("SELECT COUNT(*) FROM challenges;")
+        else:
+            cur.execute("SELECT COUNT(*) FROM challenges WHERE set_id = ?;",
+                        (set_id,))
+        count = cur.fetchone()[0]
+        cur.close()
+
+        for (vset_id, name, num) in self.get_virtual_sets(con):
+            if set_id is None or vset_id == set_id:
+                count += num - len(self.get_materialised_numbers(con, vset_id))
+        if self.catalogue is not None:
+            count += self.__count_catalogue_challenges(con, set_id)
+        return count
+
+    def __catalogue_sets(self, con):
+        """Map the ids of the catalogue's sets to the ids of the same sets,
+        by name, in the user's DB."""
+        def read():
+            cur = con.cursor()
+            cur.execute("""SELECT c.id, m.id
+                           FROM catalogue.challenge_sets AS c
+                           JOIN main.challenge_sets AS m ON m.name = c.name;""")
+            return dict(cur.fetchall())
+
+        return self.cache.get(con, "catalogue_sets", read)
+
+    def __catalogue_where(self, con, set_id=None, allowed_language=None,
+                          search=None):
+        """Return the condition and parameters that select the catalogue
+        challenges without a row in the user's DB, matching the
+        query_challenges predicates, or None if there can't be any."""
+        sets = [cset_id for (cset_id, mset_id)
+                in self.__catalogue_sets(con).items()
+                if set_id is None or mset_id == set_id]
+        if len(sets) == 0:
+            return None
+
+        # A user's row with the same description takes the challenge's place.
+        where = [f"c.set_id IN ({','.join('?' * len(sets))})",
+                 """NOT EXISTS (SELECT 1 FROM main.challenges AS m
+                                WHERE m.description = c.description)"""]
+        params = sets
+        if allowed_language is not None:
+            where.append("""(NOT EXISTS (SELECT 1
+                                         FROM catalogue.challenge_languages
+                                         WHERE challenge_id = c.id)
+                             OR c.id IN (SELECT challenge_id
+                                         FROM catalogue.challenge_languages
+                                         JOIN catalogue.languages
+                                         ON languages.id = language_id
+                                         WHERE languages.name = ?))""")
+            params.append(allowed_language)
+        if search is not None and len(search.split()) > 0:
+            if self.__has_fts(con, "catalogue"):
+                where.append("""c.id IN (SELECT rowid
+                                         FROM catalogue.challenges_fts
+                                         WHERE challenges_fts MATCH ?)""")
+                params.append(fts_query(search))
+            else:
+                for word in search.split():
+                    where.append("(c.description LIKE ? OR c.notes LIKE ?)")
+                    params.extend([f"%{word}%"] * 2)
+        return (" AND ".join(where), params)
+
+    def __catalogue_challenge(self, con, row):
+        """Turn a row of CATALOGUE_COLUMNS into a Challenge without an id,
+        whose number is its id in the catalogue."""
+        (cat_id, cset_id, desc, notes, langs) = row
+        return Challenge(None, self.__catalogue_sets(con)[cset_id], desc,
+                         notes, langs, None, None, None, number=cat_id)
+
+    def __get_catalogue_challenges(self, con, set_id=None,
+                                   allowed_language=None, search=None, skip=0,
+                                   limit=None, batch_size=ITER_BATCH_SIZE):
+        where = self.__catalogue_where(con, set_id, allowed_language, search)
+        if where is None:
+            return
+        cur = con.cursor()
+        cur.execute(f"""SELECT {CATALOGUE_COLUMNS}
+                        FROM catalogue.challenges AS c WHERE {where[0]}
+                        ORDER BY c.id LIMIT ? OFFSET ?;""",
+                    where[1] + [-1 if limit is None else limit, skip])
+        rows = cur.fetchmany(batch_size)
+        while len(rows) > 0:
+            for row in rows:
+                yield self.__catalogue_challenge(con, row)
+            rows = cur.fetchmany(batch_size)
+        cur.close()
+
+    def __count_catalogue_challenges(self, con, set_id=None,
+                                     allowed_language=None, search=None):
+        where = self.__catalogue_where(con, set_id, allowed_language, search)
+        if where is None:
+            return 0
+        cur = con.cursor()
+        cur.execute(f"""SELECT COUNT(*) FROM catalogue.challenges AS c
+                        WHERE {where[0]};""", where[1])
+        count = cur.fetchone()[0]
+        cur.close()
+        return count
+
+    def get_virtual_sets(self, con):
+        def read():
+            cur = con.cursor()
+            cur.execute("""SELECT virtual_sets.set_id, challenge_sets.name,
+                                  virtual_sets.num_challenges
+                           FROM virtual_sets JOIN challenge_sets
+                           ON challenge_sets.id = virtual_sets.set_id;""")
+            return cur.fetchall()
+
+        return list(self.cache.get(con, "virtual_sets", read))
+
+    def get_materialised_numbers(self, con, set_id):
         cur = con.cursor()
-        cur.execute("SELECT * FROM challenges;")
+        # Numbers past the end of a set that was shrunk by a rescan are
+        # ordinary challenges now.
+        cur.execute("""SELECT number FROM virtual_challenges
+                       JOIN virtual_sets USING (set_id)
+                       WHERE set_id = ? AND number < num_challenges;""",
+                    (set_id,))
+
+        return [row[0] for row in cur.fetchall()]
+
+    def __get_virtual_challenges(self, con, only_set=None, skip=0,
+                                 limit=None):
+        # Only the challenges without a row of their own are generated here,
+        # the others were already returned from the challenges table.
+        for (set_id, name, num) in self.get_virtual_sets(con):
+            if only_set is not None and set_id != only_set:
+                continue
+
+            materialised = sorted(self.get_materialised_numbers(con, set_id))
+            available = num - len(materialised)
+            if skip >= available:
+                skip -= available
+                continue
+
+            number = nth_unmaterialised(materialised, skip)
+            skip = 0
+            materialised = set(materialised)
+            while number < num:
+                if limit is not None and limit <= 0:
+                    return
+                if number not in materialised:
+                    yield Challenge(None, set_id,
+                                    virtual_description(name, number), "",
+                                    [], None, None, None, number=number)
+                    if limit is not None:
+                        limit -= 1
+                number += 1
+
+    def get_sampler(self, con):
+        """Return a ChallengeSampler over all of the unstarted challenges.
+
+        Picks are made from the running counts in the pick tables, so only
+        the picked challenge is read from the DB.
+        """
+        from ..sampler import ChallengeSampler
 
-        res = []
-        for row in cur.fetchall():
-            langs = [] if len(row[4]) == 0 else row[4].split(',')
-            res.append(Challenge(row[0], row[1], row[2], row[3],
-                              langs, row[5], row[6], row[7]))
-        return res
+        return ChallengeSampler(functools.partial(self.__pick_groups, con),
+                                functools.partial(self.__pick_challenge, con),
+                                functools.partial(read_transaction, con))
+
+    def __pick_groups(self, con, set_id=None, language=None):
+        """Return the eligible (challenge, language, modifier) triples as
+        groups that share a set and language, each a tuple of (language,
+        size, part). A part is what __pick_challenge needs to read the
+        triples of a group from one place: the DB, the catalogue or a
+        numbered set.
+        """
+        cur = con.cursor()
+        if set_id is None:
+            cur.execute("""SELECT id, modifiers_enabled FROM challenge_sets
+                           ORDER BY id;""")
+        else:
+            cur.execute("""SELECT id, modifiers_enabled FROM challenge_sets
+                           WHERE id = ?;""", (set_id,))
+        sets = cur.fetchall()
+        if language is None:
+            cur.execute("""SELECT id, name FROM languages WHERE saved = 1
+                           ORDER BY id;""")
+        else:
+            cur.execute("""SELECT id, name FROM languages
+                           WHERE saved = 1 AND name = ?;""", (language,))
+        languages = cur.fetchall()
+
+        applies = schema.modifier_applies_sql("modifiers.id", "languages.id")
+        cur.execute(f"""SELECT languages.id, modifiers.id,
+                               modifiers.description
+                        FROM languages, modifiers
+                        WHERE languages.saved = 1 AND {applies}
+                        ORDER BY modifiers.id;""")
+        modifiers = {}
+        for (lang_id, modifier_id, desc) in cur.fetchall():
+            modifiers.setdefault(lang_id, []).append((modifier_id, desc))
+        modifier_ids = {lang_id: {modifier[0] for modifier in usable}
+                        for (lang_id, usable) in modifiers.items()}
+
+        # Language 0 holds the unconstrained challenges of a set.
+        cur.execute("SELECT set_id, language_id, count FROM pick_pairs;")
+        pairs = {(row[0], row[1]): row[2] for row in cur.fetchall()}
+        cur.execute("""SELECT set_id, language_id, modifier_id, count
+                       FROM pick_modifiers WHERE count != 0;""")
+        excluded = {}
+        for (chall_set, lang_id, modifier_id, count) in cur.fetchall():
+            excluded.setdefault((chall_set, lang_id), {})[modifier_id] = count
+        cur.execute("""SELECT set_id, language_id, count FROM pick_fallbacks
+                       WHERE count != 0;""")
+        fallbacks = {(row[0], row[1]): row[2] for row in cur.fetchall()}
+        cur.execute("""SELECT set_id, num_challenges - (
+                               SELECT COUNT(*) FROM virtual_challenges
+                               WHERE set_id = virtual_sets.set_id
+                               AND number < num_challenges)
+                       FROM virtual_sets;""")
+        numbered = dict(cur.fetchall())
+        cur.close()
+        catalogue = ({} if self.catalogue is None
+                     else self.__catalogue_pick_counts(con))
+
+        # Every usable modifier goes with each challenge of a group that
+        # doesn't exclude it, and the challenges that exclude all of them
+        # go without one, so only the number of challenges that exclude
+        # each modifier is needed to size a group.
+        groups = []
+        for (chall_set, modifiers_enabled) in sets:
+            for (lang_id, lang) in languages:
+                (usable, ids) = ([], set())
+                if modifiers_enabled:
+                    usable = modifiers.get(lang_id, [])
+                    ids = modifier_ids.get(lang_id, set())
+                base = (pairs.get((chall_set, 0), 0)
+                        + pairs.get((chall_set, lang_id), 0))
+                if base > 0:
+                    counts = {}
+                    for key in [(chall_set, 0), (chall_set, lang_id)]:
+                        for (modifier_id, count) in excluded.get(key,
+                                                                 {}).items():
+                            if modifier_id in ids:
+                                counts[modifier_id] = (counts.get(modifier_id,
+                                                                  0)
+                                                       + count)
+                    size = base
+                    if len(usable) > 0:
+                        size = (base * len(usable) - sum(counts.values())
+                                + fallbacks.get((chall_set, lang_id), 0))
+                    groups.append((lang, size, ("challenges", chall_set,
+                                                lang_id, usable, base,
+                                                counts)))
+
+                for (part, size) in [(("catalogue", chall_set, lang),
+                                      catalogue.get((chall_set, None), 0)
+                                      + catalogue.get((chall_set, lang), 0)),
+                                     (("numbered", chall_set, lang),
+                                      numbered.get(chall_set, 0))]:
+                    if size > 0:
+                        groups.append((lang, size * max(len(usable), 1),
+                                       part + (usable, size, {})))
+        return [group for group in groups if group[1] > 0]
+
+    def __catalogue_pick_counts(self, con):
+        """Map (set id, language name) to the number of catalogue
+        challenges without a row in the user's DB that allow the language,
+        where a language of None counts the unconstrained ones."""
+        sets = self.__catalogue_sets(con)
+        counts = {}
+        cur = con.cursor()
+        cur.execute("""SELECT pick_pairs.set_id, languages.name,
+                              pick_pairs.count
+                       FROM catalogue.pick_pairs
+                       LEFT JOIN catalogue.languages
+                       ON languages.id = pick_pairs.language_id;""")
+        for (cset_id, lang, count) in cur.fetchall():
+            if cset_id in sets:
+                counts[(sets[cset_id], lang)] = count
+
+        # A user's row with the same description takes the challenge's place.
+        cur.execute("""SELECT c.set_id, NULL, COUNT(*)
+                       FROM main.challenges AS m
+                       JOIN catalogue.challenges AS c
+                       ON c.description = m.description
+                       WHERE NOT EXISTS (
+                           SELECT 1 FROM catalogue.challenge_languages
+                           WHERE challenge_id = c.id)
+                       GROUP BY 1
+                       UNION ALL
+                       SELECT c.set_id, languages.name, COUNT(*)
+                       FROM main.challenges AS m
+                       JOIN catalogue.challenges AS c
+                       ON c.description = m.description
+                       JOIN catalogue.challenge_languages AS cl
+                       ON cl.challenge_id = c.id
+                       JOIN catalogue.languages
+                       ON languages.id = cl.language_id
+                       GROUP BY 1, 2;""")
+        for (cset_id, lang, count) in cur.fetchall():
+            if cset_id in sets:
+                key = (sets[cset_id], lang)
+                counts[key] = counts.get(key, 0) - count
+        cur.close()
+        return counts
+
+    def __pick_challenge(self, con, part, i):
+        """Return the i-th (challenge, modifier) pair of a group from
+        __pick_groups."""
+        # The language is an id in the DB and a name in the catalogue. The
+        # triples run through the usable modifiers in turn, and then the
+        # challenges left without one.
+        (kind, chall_set, lang, usable, size, excluded) = part
+        (modifier_id, desc) = (None, None)
+        for modifier in usable:
+            if i < size - excluded.get(modifier[0], 0):
+                (modifier_id, desc) = modifier
+                break
+            i -= size - excluded.get(modifier[0], 0)
+
+        if kind == "numbered":
+            (name,) = [name for (set_id, name, num)
+                       in self.get_virtual_sets(con) if set_id == chall_set]
+            number = nth_unmaterialised(
+                sorted(self.get_materialised_numbers(con, chall_set)), i)
+            return (Challenge(None, chall_set,
+                              virtual_description(name, number), "", [],
+                              None, None, None, number=number), desc)
+
+        cur = con.cursor()
+        if kind == "catalogue":
+            (cset_id,) = [cset_id for (cset_id, mset_id)
+                          in self.__catalogue_sets(con).items()
+                          if mset_id == chall_set]
+            cur.execute(f"""SELECT {CATALOGUE_COLUMNS}
+                            FROM catalogue.challenges AS c
+                            WHERE c.set_id = :set_id
+                            AND (NOT EXISTS (
+                                     SELECT 1 FROM catalogue.challenge_languages
+                                     WHERE challenge_id = c.id)
+                                 OR c.id IN (
+                                     SELECT challenge_id
+                                     FROM catalogue.challenge_languages
+                                     JOIN catalogue.languages
+                                     ON languages.id = language_id
+                                     WHERE languages.name = :language))
+                            AND NOT EXISTS (SELECT 1 FROM main.challenges AS m
+                                            WHERE m.description =
+                                                c.description)
+                            ORDER BY c.id LIMIT 1 OFFSET :offset;""",
+                        {"set_id": cset_id, "language": lang, "offset": i})
+            row = cur.fetchone()
+            cur.close()
+            return self.__catalogue_challenge(con, row), desc
 
+        # Exclusions are answered through the primary keys of the exclusion
+        # tables as the unstarted challenges of the set are stepped through.
+        params = {"set_id": chall_set, "language": lang, "offset": i}
+        where = [schema.pick_eligible_sql("challenges.id", ":language")]
+        if modifier_id is not None:
+            params["modifier"] = modifier_id
+            where.append("""NOT EXISTS (SELECT 1
+                                        FROM excluded_challenge_modifiers
+                                        WHERE challenge_id = challenges.id
+                                        AND modifier_id = :modifier)""")
+        elif len(usable) > 0:
+            # What is left are the challenges that exclude every modifier
+            # usable here.
+            params.update((f"modifier{j}", modifier[0])
+                          for (j, modifier) in enumerate(usable))
+            where.append(f"""NOT EXISTS (
+                                 SELECT 1 FROM modifiers
+                                 WHERE id IN ({",".join(
+                                     f":modifier{j}"
+                                     for j in range(len(usable)))})
+                                 AND NOT EXISTS (
+                                     SELECT 1
+                                     FROM excluded_challenge_modifiers
+                                     WHERE challenge_id = challenges.id
+                                     AND modifier_id = modifiers.id))""")
+        cur.row_factory = challenge_factory
+        cur.execute(f"""SELECT {CHALLENGE_COLUMNS} FROM challenges
+                        WHERE set_id = :set_id AND date_started IS NULL
+                        AND {" AND ".join(where)}
+                        ORDER BY id LIMIT 1 OFFSET :offset;""", params)
+        chall = cur.fetchone()
+        cur.close()
+        return chall, desc
+
+    @write_transaction
+    def materialise_challenge(self, con, set_id, number):
+        """Give challenge `number` of a numbered set, or the challenge with
+        id `number` in the catalogue, a row of its own.
+
+        Returns the id of the row, which is created if it doesn't exist yet.
+        """
+        cur = con.cursor()
+        cur.execute("""SELECT challenge_id FROM virtual_challenges
+                       WHERE set_id = ? AND number = ?;""", (set_id, number))
+        row = cur.fetchone()
+        if row is not None:
+            cur.close()
+            return row[0]
+
+        cur.execute("""SELECT challenge_sets.name, virtual_sets.num_challenges
+                       FROM virtual_sets JOIN challenge_sets
+                       ON challenge_sets.id = virtual_sets.set_id
+                       WHERE virtual_sets.set_id = ?;""", (set_id,))
+        row = cur.fetchone()
+        if row is None and self.catalogue is not None:
+            cur.close()
+            return self.__materialise_catalogue_challenge(con, set_id, number)
+        if row is None or not 0 <= number < row[1]:
+            raise ValueError(f"Set {set_id} has no numbered challenge {number}")
+
+        chall_id = self.add_challenge(con, set_id,
+                                      virtual_description(row[0], number))
+        cur.execute("""INSERT INTO virtual_challenges(set_id, number,
+                                                      challenge_id)
+                       VALUES(?,?,?);""", (set_id, number, chall_id))
+        cur.close()
+        return chall_id
+
+    def __materialise_catalogue_challenge(self, con, set_id, cat_id):
+        cur = con.cursor()
+        cur.execute(f"""SELECT {CATALOGUE_COLUMNS}
+                        FROM catalogue.challenges AS c WHERE c.id = ?;""",
+                    (cat_id,))
+        row = cur.fetchone()
+        cur.close()
+        if row is None or self.__catalogue_sets(con).get(row[1]) != set_id:
+            raise ValueError(f"Set {set_id} has no catalogue challenge "
+                             f"{cat_id}")
+
+        chall = self.__catalogue_challenge(con, row)
+        chall_id = self.get_challenge_id(con, chall.description)
+        if chall_id is None:
+            chall_id = self.add_challenge(con, set_id, chall.description,
+                                          chall.notes or "",
+                                          chall.language_constraints)
+        return chall_id
+
+    @write_transaction
     def add_challenge(self, con, set_id, desc, notes="", langs=[]):
         cur = con.cursor()
         if self.get_challenge_id(con, desc) is not None:
@@ -116,29 +920,151 @@ class DataHandler:
 
         cur.execute("""INSERT INTO challenges(set_id,
                                               description,
-                                              notes,
-                                              language_constraints)
-                       VALUES(?,?,?,?);""", (set_id, desc, notes,
-                                             ",".join(langs)))
+                                              notes)
+                       VALUES(?,?,?);""", (set_id, desc, notes))
+        chall_id = cur.lastrowid
         cur.close()
-        return self.get_challenge_id(con, desc)
+        self.__add_language_constraints(con, [(chall_id, lang)
+                                              for lang in langs])
+        return chall_id
 
+    @write_transaction
     def del_challenge(self, con, chall_id):
         cur = con.cursor()
         cur.execute("DELETE FROM challenges WHERE id = ?;", (chall_id,))
+        cur.execute("DELETE FROM challenge_languages WHERE challenge_id = ?;",
+                    (chall_id,))
+        cur.execute("DELETE FROM virtual_challenges WHERE challenge_id = ?;",
+                    (chall_id,))
+        cur.execute("""DELETE FROM excluded_challenge_languages
+                       WHERE challenge_id = ?;""", (chall_id,))
+        cur.execute("""DELETE FROM excluded_challenge_modifiers
+                       WHERE challenge_id = ?;""", (chall_id,))
 
-    def accept_challenge(self, con, chall_id, language):
+    @write_transaction
+    def accept_challenge(self, con, chall_id, language, modifier=None):
+        """Start a challenge. Returns False if it was already started."""
         cur = con.cursor()
         cur.execute("""UPDATE challenges SET language_used = ?,
-                       date_started = ?
-                       WHERE id = ?;""", (language,
-                    datetime.date.today().isoformat(), chall_id))
+                       modifier_used = ?,
+                       date_started = date('now', 'localtime')
+                       WHERE id = ? AND date_started IS NULL;""",
+                    (language, modifier, chall_id))
+        accepted = cur.rowcount == 1
+        cur.close()
+        return accepted
 
+    @write_transaction
     def finish_challenge(self, con, chall_id):
+        """Finish a challenge. Returns False if it isn't active."""
+        cur = con.cursor()
+        cur.execute("""UPDATE challenges
+                       SET date_finished = date('now', 'localtime')
+                       WHERE id = ? AND date_started IS NOT NULL
+                       AND date_finished IS NULL;""", (chall_id,))
+        finished = cur.rowcount == 1
+        cur.close()
+        return finished
+
+    @write_transaction
+    def add_challenges(self, con, set_id, challenges):
+        """Add (description, notes, langs) tuples to a challenge set.
+
+        The challenges are written in chunks in one transaction, so they can
+        come from a generator. Returns the id of each new challenge, or None
+        for the ones whose description was already taken.
+        """
+        ids = []
+        for chunk in chunked(challenges, IMPORT_CHUNK_SIZE):
+            ids.extend(self.__insert_chunk(con, set_id, chunk))
+        return ids
+
+    def __existing_ids(self, con, chall_ids, condition="1", params=()):
         cur = con.cursor()
-        cur.execute("""UPDATE challenges SET date_finished = ?
-                       WHERE id = ?;""", (datetime.date.today().isoformat(),
-                                          chall_id))
+        cur.execute(f"""SELECT id FROM challenges
+                        WHERE id IN ({','.join('?' * len(chall_ids))})
+                        AND {condition};""", list(chall_ids) + list(params))
+        found = {row[0] for row in cur.fetchall()}
+        cur.close()
+        return found
+
+    @write_transaction
+    def delete_challenges(self, con, chall_ids, set_id=None):
+        """Delete challenges by id, in one transaction.
+
+        If set_id is given, only challenges in that set are deleted. Returns
+        whether each challenge was deleted.
+        """
+        deleted = []
+        cur = con.cursor()
+        for chunk in chunked(chall_ids, IMPORT_CHUNK_SIZE):
+            if set_id is None:
+                found = self.__existing_ids(con, chunk)
+            else:
+                found = self.__existing_ids(con, chunk, "set_id = ?",
+                                            (set_id,))
+            rows = [(chall_id,) for chall_id in found]
+            cur.executemany("DELETE FROM challenges WHERE id = ?;", rows)
+            cur.executemany("""DELETE FROM challenge_languages
+                               WHERE challenge_id = ?;""", rows)
+            cur.executemany("""DELETE FROM virtual_challenges
+                               WHERE challenge_id = ?;""", rows)
+            cur.executemany("""DELETE FROM excluded_challenge_languages
+                               WHERE challenge_id = ?;""", rows)
+            cur.executemany("""DELETE FROM excluded_challenge_modifiers
+                               WHERE challenge_id = ?;""", rows)
+            for chall_id in chunk:
+                deleted.append(chall_id in found)
+                found.discard(chall_id)
+        cur.close()
+        return deleted
+
+    @write_transaction
+    def accept_challenges(self, con, accepted):
+        """Start (challenge id, language) pairs, in one transaction.
+
+        Returns whether each challenge was started; challenges that don't
+        exist or were already started are left alone.
+        """
+        results = []
+        cur = con.cursor()
+        for chunk in chunked(accepted, IMPORT_CHUNK_SIZE):
+            found = self.__existing_ids(con, [row[0] for row in chunk],
+                                        "date_started IS NULL")
+            rows = []
+            for (chall_id, language) in chunk:
+                results.append(chall_id in found)
+                if chall_id in found:
+                    rows.append((language, chall_id))
+                    found.discard(chall_id)
+            cur.executemany("""UPDATE challenges SET language_used = ?,
+                               date_started = date('now', 'localtime')
+                               WHERE id = ?;""", rows)
+        cur.close()
+        return results
+
+    @write_transaction
+    def finish_challenges(self, con, chall_ids):
+        """Finish challenges by id, in one transaction.
+
+        Returns whether each challenge was finished; challenges that aren't
+        active are left alone.
+        """
+        results = []
+        cur = con.cursor()
+        for chunk in chunked(chall_ids, IMPORT_CHUNK_SIZE):
+            found = self.__existing_ids(con, chunk,
+                                        "date_started IS NOT NULL "
+                                        "AND date_finished IS NULL")
+            cur.executemany("""UPDATE challenges
+                               SET date_finished = date('now', 'localtime')
+                               WHERE id = ?;""",
+                            [(chall_id,) for chall_id in found])
+            for chall_id in chunk:
+                results.append(chall_id in found)
+                found.discard(chall_id)
+        cur.close()
+        return results
 
     def get_challenge_set_id(self, con, name):
         cur = con.cursor()
@@ -154,11 +1080,271 @@ class DataHandler:
         return set_id
 
     def get_challenge_sets(self, con):
+        def read():
+            cur = con.cursor()
+            cur.execute("SELECT id, name FROM challenge_sets;")
+            return cur.fetchall()
+
+        return list(self.cache.get(con, "challenge_sets", read))
+
+    def get_sets_without_modifiers(self, con):
+        """Return the ids of the sets whose defaults file disables
+        modifiers."""
+        def read():
+            cur = con.cursor()
+            cur.execute("""SELECT id FROM challenge_sets
+                           WHERE modifiers_enabled = 0;""")
+            return [row[0] for row in cur.fetchall()]
+
+        return list(self.cache.get(con, "sets_without_modifiers", read))
+
+    def get_modifiers(self, con):
+        """Return (description, languages) for every modifier, where an
+        empty list of languages means that it applies to all of them."""
+        def read():
+            cur = con.cursor()
+            cur.execute(f"""SELECT modifiers.description,
+                                   group_concat(languages.name,
+                                                '{LANGUAGE_SEPARATOR}')
+                            FROM modifiers
+                            LEFT JOIN modifier_languages
+                            ON modifier_languages.modifier_id = modifiers.id
+                            LEFT JOIN languages
+                            ON languages.id = modifier_languages.language_id
+                            GROUP BY modifiers.id
+                            ORDER BY modifiers.id;""")
+            return [(desc, [] if langs is None
+                     else langs.split(LANGUAGE_SEPARATOR))
+                    for (desc, langs) in cur.fetchall()]
+
+        return list(self.cache.get(con, "modifiers", read))
+
+    def __get_modifier_id(self, con, desc):
+        cur = con.cursor()
+        cur.execute("SELECT id FROM modifiers WHERE description = ?;",
+                    (desc,))
+        row = cur.fetchone()
+        cur.close()
+        if row is None:
+            raise ValueError(f"There is no modifier {desc}")
+        return row[0]
+
+    @write_transaction
+    def add_exclusion(self, con, chall_id=None, language=None, modifier=None):
+        """Never offer a pair of challenge, language and modifier together
+        again. Exactly two of them must be given.
+
+        Returns False if the pair was already excluded.
+        """
+        given = [part is not None for part in (chall_id, language, modifier)]
+        if given.count(True) != 2:
+            raise ValueError("An exclusion is a pair of challenge, language "
+                             "and modifier")
+
         cur = con.cursor()
-        cur.execute("SELECT * FROM challenge_sets;")
+        if modifier is None:
+            lang_id = self.__get_language_ids(con, [language])[language]
+            cur.execute("""INSERT OR IGNORE INTO excluded_challenge_languages(
+                               challenge_id, language_id)
+                           VALUES(?,?);""", (chall_id, lang_id))
+        elif language is None:
+            cur.execute("""INSERT OR IGNORE INTO excluded_challenge_modifiers(
+                               challenge_id, modifier_id)
+                           VALUES(?,?);""",
+                        (chall_id, self.__get_modifier_id(con, modifier)))
+        else:
+            lang_id = self.__get_language_ids(con, [language])[language]
+            cur.execute("""INSERT OR IGNORE INTO excluded_language_modifiers(
+                               language_id, modifier_id)
+                           VALUES(?,?);""",
+                        (lang_id, self.__get_modifier_id(con, modifier)))
+        added = cur.rowcount == 1
+        cur.close()
+        return added
+
+    def get_exclusions(self, con):
+        """Return the excluded pairs as three dicts: challenge id to
+        languages, challenge id to modifiers, and language to modifiers."""
+        def read():
+            cur = con.cursor()
+            exclusions = ({}, {}, {})
+            cur.execute("""SELECT challenge_id, languages.name
+                           FROM excluded_challenge_languages
+                           JOIN languages ON languages.id = language_id;""")
+            for (chall_id, lang) in cur:
+                exclusions[0].setdefault(chall_id, set()).add(lang)
+            cur.execute("""SELECT challenge_id, modifiers.description
+                           FROM excluded_challenge_modifiers
+                           JOIN modifiers ON modifiers.id = modifier_id;""")
+            for (chall_id, desc) in cur:
+                exclusions[1].setdefault(chall_id, set()).add(desc)
+            cur.execute("""SELECT languages.name, modifiers.description
+                           FROM excluded_language_modifiers
+                           JOIN languages ON languages.id = language_id
+                           JOIN modifiers ON modifiers.id = modifier_id;""")
+            for (lang, desc) in cur:
+                exclusions[2].setdefault(lang, set()).add(desc)
+            cur.close()
+            return exclusions
+
+        return self.cache.get(con, "exclusions", read,
+                              lambda exclusions: sum(map(len, exclusions)))
+
+    @write_transaction
+    def set_revisit_interval(self, con, days, set_id=None, language=None):
+        """Revisit the challenges of a set, or those finished in a language,
+        `days` days after finishing them. Exactly one of set_id and language
+        must be given; days=None goes back to the default interval.
+
+        Challenges that are already waiting to be revisited are rescheduled.
+        """
+        if (set_id is None) == (language is None):
+            raise ValueError("A revisit interval is for a set or a language")
+        if set_id is None:
+            (column, chall_column, key) = ("language", "language_used",
+                                           language)
+        else:
+            (column, chall_column, key) = ("set_id", "set_id", set_id)
+        due = schema.revisit_due_sql("challenges")
+
+        cur = con.cursor()
+        if days is None:
+            cur.execute(f"DELETE FROM revisit_intervals WHERE {column} = ?;",
+                        (key,))
+        else:
+            cur.execute(f"""INSERT INTO revisit_intervals({column}, days)
+                            VALUES(?, ?)
+                            ON CONFLICT({column}) DO UPDATE
+                            SET days = excluded.days;""", (key, days))
+        cur.execute(f"""UPDATE revisits
+                        SET due = (SELECT {due}
+                                   FROM challenges
+                                   WHERE challenges.id = revisits.challenge_id)
+                        WHERE challenge_id IN (SELECT id FROM challenges
+                                               WHERE {chall_column} = ?);""",
+                    (key,))
+        cur.close()
+
+    def get_revisit_intervals(self, con):
+        """Return (set name, language, days) for every interval that was
+        set, with None for whichever of the set and language it isn't for."""
+        cur = con.cursor()
+        cur.execute("""SELECT challenge_sets.name, language, days
+                       FROM revisit_intervals LEFT JOIN challenge_sets
+                       ON challenge_sets.id = revisit_intervals.set_id
+                       ORDER BY 1, 2;""")
+        intervals = cur.fetchall()
+        cur.close()
+        return intervals
+
+    def get_due_revisits(self, con, day=None, set_id=None, language=None,
+                         limit=None):
+        """Return (challenge, due date) for the finished challenges that are
+        due to be revisited by `day` (days since 1970-01-01, by default
+        today), earliest first, optionally only from one set or finished in
+        one language.
+
+        The due challenges are a range of the revisits_due index, so this
+        never reads the rest of the history.
+        """
+        where = []
+        params = []
+        if set_id is not None:
+            where.append("AND challenges.set_id = ?")
+            params.append(set_id)
+        if language is not None:
+            where.append("AND challenges.language_used = ?")
+            params.append(language)
+
+        # CROSS JOIN keeps revisits as the outer loop, so the filters are
+        # checked on the due challenges instead of the index of a whole set
+        # or language being read.
+        cur = con.cursor()
+        cur.execute(f"""SELECT {CHALLENGE_COLUMNS},
+                               date(revisits.due * 86400, 'unixepoch')
+                        FROM revisits CROSS JOIN challenges
+                        ON challenges.id = revisits.challenge_id
+                        WHERE revisits.due <= coalesce(
+                            ?, CAST(julianday('now', 'localtime')
+                                    - 2440587.5 AS integer))
+                        {' '.join(where)}
+                        ORDER BY revisits.due, revisits.challenge_id
+                        LIMIT ?;""",
+                    [day] + params + [-1 if limit is None else limit])
+        revisits = [(challenge_factory(cur, row[:-1]), row[-1])
+                    for row in cur.fetchall()]
+        cur.close()
+        return revisits
+
+    @write_transaction
+    def complete_revisit(self, con, chall_id):
+        """Take a challenge off the revisit queue. Returns False if it
+        wasn't on it."""
+        cur = con.cursor()
+        cur.execute("DELETE FROM revisits WHERE challenge_id = ?;",
+                    (chall_id,))
+        completed = cur.rowcount == 1
+        cur.close()
+        return completed
+
+    def get_language_stats(self, con):
+        """Return (language, started, finished, total days) for every
+        language that challenges were started in, most used first.
+
+        Like the other statistics, these come from summary tables that
+        triggers keep up to date, so they don't depend on the history size.
+        """
+        cur = con.cursor()
+        cur.execute("""SELECT language, started, finished, total_days
+                       FROM stats_languages WHERE started > 0
+                       ORDER BY started DESC, language;""")
 
         return list(cur.fetchall())
 
+    def get_set_stats(self, con):
+        """Return (set name, started, finished, total days) for every set
+        that challenges were started from."""
+        cur = con.cursor()
+        cur.execute("""SELECT challenge_sets.name, started, finished,
+                              total_days
+                       FROM stats_sets JOIN challenge_sets
+                       ON challenge_sets.id = stats_sets.set_id
+                       WHERE started > 0
+                       ORDER BY started DESC, challenge_sets.name;""")
+
+        return list(cur.fetchall())
+
+    def get_duration_histogram(self, con, language=None):
+        """Return how many finished challenges fall in each of the
+        schema.DURATION_BUCKETS, optionally for a single language."""
+        cur = con.cursor()
+        if language is None:
+            cur.execute("""SELECT bucket, sum(count) FROM stats_durations
+                           GROUP BY bucket;""")
+        else:
+            cur.execute("""SELECT bucket, count FROM stats_durations
+                           WHERE language = ?;""", (language,))
+
+        counts = [0] * (len(schema.DURATION_BUCKETS) + 1)
+        for (bucket, count) in cur.fetchall():
+            counts[bucket] = count
+        cur.close()
+        return counts
+
+    def get_activity(self, con, days):
+        """Return how many challenges were (started, finished) in the last
+        `days` days, today included."""
+        cur = con.cursor()
+        cur.execute("""SELECT coalesce(sum(started), 0),
+                              coalesce(sum(finished), 0)
+                       FROM stats_days
+                       WHERE day > CAST(julianday('now', 'localtime')
+                                        - 2440587.5 AS integer) - ?;""",
+                    (days,))
+        activity = cur.fetchone()
+        cur.close()
+        return activity
+
     def __add_challenge_set(self, con, name):
         cur = con.cursor()
         if self.get_challenge_set_id(con, name) is not None:
@@ -170,100 +1356,663 @@ class DataHandler:
         cur.close()
         return set_id
 
-    def __load_defaults(self, con):
+    def __sync_virtual_set(self, con, set_id, name, num_challenges):
+        cur = con.cursor()
+        cur.execute("""INSERT INTO virtual_sets(set_id, num_challenges)
+                       VALUES(?,?)
+                       ON CONFLICT(set_id) DO UPDATE
+                       SET num_challenges = excluded.num_challenges;""",
+                    (set_id, num_challenges))
+
+        # Rows from older versions of the set are dropped if they were never
+        # started or declined, and otherwise take the place of their numbered
+        # challenge.
+        cur.execute("""SELECT challenge_id FROM excluded_challenge_languages
+                       UNION
+                       SELECT challenge_id FROM excluded_challenge_modifiers;""")
+        excluded = {row[0] for row in cur.fetchall()}
+        prefix = virtual_description(name, "")
+        for chall in self.query_challenges(con, set_id=set_id, virtual=False):
+            if chall.date_started is None and chall.id not in excluded:
+                self.del_challenge(con, chall.id)
+            elif (chall.description.startswith(prefix)
+                    and chall.description[len(prefix):].isdigit()):
+                cur.execute("""INSERT OR IGNORE INTO virtual_challenges(
+                                   set_id, number, challenge_id)
+                               VALUES(?,?,?);""",
+                            (set_id, int(chall.description[len(prefix):]),
+                             chall.id))
+        cur.close()
+
+    def __sync_challenges(self, con, set_id, file):
+        """Make a set hold the challenges of a defaults file, staged in
+        temp.staged_challenges, keeping all progress.
+
+        Challenges that were started are kept even if they were removed from
+        the set. Returns the descriptions skipped as duplicates.
+        """
+        cur = con.cursor()
+        cur.execute("DELETE FROM virtual_challenges WHERE set_id = ?;",
+                    (set_id,))
+        cur.execute("DELETE FROM virtual_sets WHERE set_id = ?;", (set_id,))
+
+        # Later copies of a description in the file are skipped.
+        first = """NOT EXISTS (SELECT 1 FROM temp.staged_challenges AS other
+                               WHERE other.file = staged.file
+                               AND other.description = staged.description
+                               AND other.pos < staged.pos)"""
+        cur.execute(f"""SELECT description
+                        FROM temp.staged_challenges AS staged
+                        WHERE file = ? AND NOT {first} ORDER BY pos;""",
+                    (file,))
+        skipped = [row[0] for row in cur.fetchall()]
+
+        cur.execute("""SELECT id FROM challenges
+                       WHERE set_id = ? AND date_started IS NULL
+                       AND description NOT IN (
+                           SELECT description FROM temp.staged_challenges
+                           WHERE file = ?);""", (set_id, file))
+        for (chall_id,) in cur.fetchall():
+            self.del_challenge(con, chall_id)
+
+        staged = con.cursor()
+        staged.execute(f"""SELECT description, notes, langs
+                           FROM temp.staged_challenges AS staged
+                           WHERE file = ? AND {first} ORDER BY pos;""",
+                       (file,))
+        rows = staged.fetchmany(IMPORT_CHUNK_SIZE)
+        while len(rows) > 0:
+            rows = [(desc, notes, [] if langs is None
+                     else langs.split(LANGUAGE_SEPARATOR))
+                    for (desc, notes, langs) in rows]
+            # Looked up by description alone, which is indexed, since
+            # SQLite would rather scan the whole set.
+            cur.row_factory = challenge_factory
+            cur.execute(f"""SELECT {CHALLENGE_COLUMNS} FROM challenges
+                            WHERE description IN
+                            ({",".join("?" * len(rows))});""",
+                        [row[0] for row in rows])
+            existing = {chall.description: chall for chall in cur.fetchall()
+                        if chall.set_id == set_id}
+            cur.row_factory = None
+
+            new_rows = []
+            for (desc, notes, langs) in rows:
+                chall = existing.get(desc)
+                if chall is None:
+                    new_rows.append((desc, notes, langs))
+                    continue
+                if chall.notes != notes:
+                    cur.execute("""UPDATE challenges SET notes = ?
+                                   WHERE id = ?;""", (notes, chall.id))
+                if sorted(chall.language_constraints) != sorted(langs):
+                    cur.execute("""DELETE FROM challenge_languages
+                                   WHERE challenge_id = ?;""", (chall.id,))
+                    self.__add_language_constraints(con, [(chall.id, lang)
+                                                          for lang in langs])
+            ids = self.__insert_chunk(con, set_id, new_rows)
+            skipped.extend(row[0] for (row, chall_id) in zip(new_rows, ids)
+                           if chall_id is None)
+            rows = staged.fetchmany(IMPORT_CHUNK_SIZE)
+        staged.close()
+        cur.close()
+        return skipped
+
+    def __parse_challenges(self, challenges):
+        """Validate a list of challenge dicts in memory.
+
+        Returns a list of (description, notes, langs) tuples with duplicate
+        descriptions removed, and the list of descriptions that were
+        dropped as duplicates.
+        """
+        rows = []
+        seen = set()
+        skipped = []
+        for (i, chall) in enumerate(challenges):
+            (desc, notes, langs) = parse_challenge(chall, f"Challenge {i}")
+            if desc in seen:
+                skipped.append(desc)
+                continue
+            seen.add(desc)
+            rows.append((desc, notes, langs))
+        return rows, skipped
+
+    def __get_challenge_ids(self, con, descs):
+        """Map each description in `descs` that is in the DB to its id."""
+        # Looked up in chunks through the UNIQUE index on description, so
+        # the cost depends on the size of the import and not of the DB.
+        cur = con.cursor()
+        ids = {}
+        for i in range(0, len(descs), IMPORT_CHUNK_SIZE):
+            chunk = descs[i:i + IMPORT_CHUNK_SIZE]
+            cur.execute("SELECT description, id FROM challenges "
+                        "WHERE description IN "
+                        f"({','.join('?' * len(chunk))});", chunk)
+            ids.update(cur.fetchall())
+        cur.close()
+        return ids
+
+    def __insert_chunk(self, con, set_id, rows):
+        """Insert (description, notes, langs) rows into a challenge set.
+
+        Returns the id of the new challenge for each row, or None if its
+        description was already in the DB or earlier in `rows`.
+        """
+        existing = self.__get_challenge_ids(con, [row[0] for row in rows])
+        new_rows = {}
+        for (desc, notes, langs) in rows:
+            if desc not in existing and desc not in new_rows:
+                new_rows[desc] = (notes, langs)
+
+        cur = con.cursor()
+        cur.executemany("""INSERT INTO challenges(set_id,
+                                                  description,
+                                                  notes)
+                           VALUES(?,?,?);""",
+                        ((set_id, desc, notes)
+                         for (desc, (notes, langs)) in new_rows.items()))
+        cur.close()
+
+        ids = self.__get_challenge_ids(con, list(new_rows))
+        self.__add_language_constraints(con, [
+            (ids[desc], lang) for (desc, (notes, langs)) in new_rows.items()
+            for lang in langs])
+        return [ids.pop(row[0], None) for row in rows]
+
+    def __insert_challenges(self, con, set_id, rows):
+        """Insert (description, notes, langs) rows in chunks.
+
+        Returns the descriptions that were skipped as duplicates.
+        """
+        skipped = []
+        for chunk in chunked(rows, IMPORT_CHUNK_SIZE):
+            ids = self.__insert_chunk(con, set_id, chunk)
+            skipped.extend(row[0] for (row, chall_id) in zip(chunk, ids)
+                           if chall_id is None)
+        return skipped
+
+    def import_challenges(self, con, set_id, challenges):
+        """Add a whole list of challenge dicts to a challenge set.
+
+        Every challenge is validated before anything is written, so an
+        InvalidChallengeError leaves the DB untouched. Returns the
+        descriptions that were skipped because they were duplicated,
+        either within the list or against the DB.
+        """
+        rows, skipped = self.__parse_challenges(challenges)
+        return skipped + self.__insert_challenges(con, set_id, rows)
+
+    def __import_modifiers(self, con, name, modifiers):
+        """Make the modifiers loaded from the defaults file `name` match
+        `modifiers`, a list of (description, langs) tuples."""
         cur = con.cursor()
+        cur.execute("SELECT description, file FROM modifiers;")
+        owners = dict(cur.fetchall())
+
+        descs = set()
+        for (desc, notes, langs) in modifiers:
+            if owners.get(desc, name) != name or desc in descs:
+                print(f"You have a duplicate modifier: {desc}. "
+                      "It will not be added to the database.",
+                      file=sys.stderr)
+                continue
+            descs.add(desc)
+            cur.execute("""INSERT INTO modifiers(description, file)
+                           VALUES(?,?)
+                           ON CONFLICT(description) DO NOTHING;""",
+                        (desc, name))
+            cur.execute("SELECT id FROM modifiers WHERE description = ?;",
+                        (desc,))
+            modifier_id = cur.fetchone()[0]
+            cur.execute("""DELETE FROM modifier_languages
+                           WHERE modifier_id = ?;""", (modifier_id,))
+            cur.executemany("""INSERT OR IGNORE INTO modifier_languages(
+                                   modifier_id, language_id)
+                               VALUES(?,?);""",
+                            [(modifier_id, lang_id) for lang_id
+                             in self.__get_language_ids(con, langs).values()])
 
-        self.__add_challenge_set(con, "Self-added challenges")
+        for (desc, owner) in owners.items():
+            if owner == name and desc not in descs:
+                for table in ("modifier_languages",
+                              "excluded_challenge_modifiers",
+                              "excluded_language_modifiers"):
+                    cur.execute(f"""DELETE FROM {table}
+                                    WHERE modifier_id = (
+                                        SELECT id FROM modifiers
+                                        WHERE description = ?);""", (desc,))
+                cur.execute("DELETE FROM modifiers WHERE description = ?;",
+                            (desc,))
+        cur.close()
 
-        default_files = Path(self.defaultsdir).glob("*.json")
-        for file in default_files:
-            with open(file, encoding="utf8") as data_fp:
-                chall_data = json.load(data_fp)
+    def __import_defaults_file(self, con, file, fields, modifiers, set_id,
+                               taken_sets):
+        """Add or update the challenge set or the modifiers described by a
+        defaults file, from the top-level `fields` of the file, its
+        modifiers and its challenges staged in temp.staged_challenges.
+
+        Returns the id of the set, or None for a file of modifiers. Raises
+        InvalidChallengeError if the file can't be imported.
+        """
+        try:
+            if "name" not in fields and "modifiers" in fields:
+                if not isinstance(fields["modifiers"], list):
+                    raise ValueError("modifiers must be a list")
+                self.__import_modifiers(con, file.name, modifiers)
+                return None
+
+            name = fields["name"]
+            if not isinstance(name, str):
+                raise ValueError("name must be a string")
+            modifiers_enabled = fields.get("allowModifiers", True)
+            if not isinstance(modifiers_enabled, bool):
+                raise ValueError("allowModifiers must be true or false")
+            if not isinstance(fields.get("challenges", []), list):
+                raise ValueError("challenges must be a list")
+            cur = con.cursor()
+            cur.execute("""SELECT COUNT(*) FROM temp.staged_challenges
+                           WHERE file = ?;""", (file.name,))
+            num = None
+            if cur.fetchone()[0] == 0 and "num-challenges" in fields:
+                num = fields["num-challenges"]
+                if (not isinstance(num, int) or isinstance(num, bool)
+                        or num < 0):
+                    raise ValueError("num-challenges must be a positive "
+                                     "number")
+            cur.close()
+        except (ValueError, KeyError) as err:
+            raise InvalidChallengeError(f"Invalid challenge set in file "
+                                        f"{file}: {err}")
+
+        if set_id is None:
+            # Sets loaded before the manifest existed are matched by name.
+            set_id = self.get_challenge_set_id(con, name)
+            if name == personal or set_id in taken_sets:
+                raise InvalidChallengeError("You have a duplicate challenge "
+                                            f"set in file {file}")
+            if set_id is None:
+                set_id = self.__add_challenge_set(con, name)
+        cur = con.cursor()
+        cur.execute("""UPDATE challenge_sets SET name = ?,
+                       modifiers_enabled = ? WHERE id = ?;""",
+                    (name, modifiers_enabled, set_id))
+        cur.close()
 
+        if num is not None:
+            self.__sync_virtual_set(con, set_id, name, num)
+            return set_id
+        for desc in self.__sync_challenges(con, set_id, file.name):
+            print(f"You have a duplicate challenge: {desc}. "
+                  "It will not be added to the database.",
+                  file=sys.stderr)
+        return set_id
+
+    def __scan_defaults(self, con):
+        import hashlib
+        from pathlib import Path
+
+        from .defaultsloader import read_defaults_files
+
+        cur = con.cursor()
+        cur.execute("""SELECT path, size, mtime, hash, set_id
+                       FROM defaults_manifest;""")
+        manifest = {row[0]: row[1:] for row in cur.fetchall()}
+
+        # The files that changed since the last scan, by path, with their
+        # stat and hash.
+        files = {}
+        for file in sorted(Path(self.defaultsdir).glob("*.json")):
+            stat = file.stat()
+            entry = manifest.get(file.name)
+            if (entry is not None and entry[0] == stat.st_size
+                    and entry[1] == stat.st_mtime_ns):
+                continue
+
+            digest = hashlib.sha256()
+            with open(file, "rb") as f:
+                for block in iter(lambda: f.read(1 << 16), b""):
+                    digest.update(block)
+            digest = digest.hexdigest()
+            if entry is not None and entry[2] == digest:
+                self.__record_manifest(con, manifest, file, stat, digest,
+                                       entry[3])
+            else:
+                files[str(file)] = (file, stat, digest)
+
+        # Files are parsed in parallel, and their challenges staged as they
+        # arrive, but they are imported in order, so that the first of two
+        # files with the same set name wins.
+        cur.execute("""CREATE TEMP TABLE IF NOT EXISTS staged_challenges (
+                           file text NOT NULL,
+                           pos integer NOT NULL,
+                           description text NOT NULL,
+                           notes text NOT NULL,
+                           langs text,
+                           PRIMARY KEY (file, pos)
+                       );""")
+        cur.execute("""CREATE INDEX IF NOT EXISTS
+                       temp.staged_challenges_description
+                       ON staged_challenges (file, description, pos);""")
+        order = list(files)
+        results = {}
+        modifiers = {path: [] for path in files}
+        changed = []
+        for (path, (kind, value)) in read_defaults_files(order):
+            if kind == "challenges":
+                name = files[path][0].name
+                cur.executemany("""INSERT INTO temp.staged_challenges(
+                                       file, pos, description, notes, langs)
+                                   VALUES(?,?,?,?,?);""",
+                                [(name, pos, desc, notes,
+                                  LANGUAGE_SEPARATOR.join(langs) or None)
+                                 for (pos, desc, notes, langs) in value])
+            elif kind == "modifiers":
+                modifiers[path].extend(value)
+            else:
+                results[path] = (kind, value)
+
+            while len(order) > 0 and order[0] in results:
+                path = order.pop(0)
+                (file, stat, digest) = files[path]
+                (kind, value) = results.pop(path)
                 try:
-                    set_id = self.__add_challenge_set(con, chall_data["name"])
-                except AlreadyInDBError:
-                    print(f"You have a duplicate challenge set in file {file}."
-                          " It will not be added to the database.",
-                         file=sys.stderr)
-                    return
+                    if kind == "error":
+                        raise InvalidChallengeError(
+                            f"Invalid challenge set in file {file}: {value}")
+                    entry = manifest.get(file.name)
+                    taken_sets = {other[3] for (other_path, other)
+                                  in manifest.items()
+                                  if other_path != file.name
+                                  and other[3] is not None}
+                    set_id = self.__import_defaults_file(
+                        con, file, value, modifiers.pop(path),
+                        None if entry is None else entry[3], taken_sets)
+                except InvalidChallengeError as err:
+                    print(f"{err}. It will not be added to the database.",
+                          file=sys.stderr)
+                else:
+                    self.__record_manifest(con, manifest, file, stat, digest,
+                                           set_id)
+                    changed.append(file.name)
+                cur.execute("""DELETE FROM temp.staged_challenges
+                               WHERE file = ?;""", (file.name,))
+        cur.close()
+        return changed
 
-                if ("challenges" in chall_data.keys()
-                    and len(chall_data["challenges"]) > 0):
-                    for chall in chall_data["challenges"]:
-                        if "languageConstraints" in chall:
-                            langs = chall["languageConstraints"]
-                        else:
-                            langs = []
-
-                        try:
-                            self.add_challenge(con, set_id,
-                                               chall["description"],
-                                               chall["notes"], langs)
-                        except AlreadyInDBError:
-                            print("You have a duplicate challenge: "
-                                  f"{chall['description']}. "
-                                  "It will not be added to the database.",
-                                  file=sys.stderr)
-                elif "num-challenges" in chall_data.keys():
-                    for i in range(chall_data["num-challenges"]):
-                        try:
-                            name = f'{chall_data["name"]} challenge {i}'
-                            self.add_challenge(con, set_id, name, "", [])
-                        except AlreadyInDBError:
-                            print("Duplicate challenge was added in "
-                                  "_load_defaults. This is a bug.")
+    def __record_manifest(self, con, manifest, file, stat, digest, set_id):
+        manifest[file.name] = (stat.st_size, stat.st_mtime_ns, digest,
+                               set_id)
+        cur = con.cursor()
+        cur.execute("""INSERT OR REPLACE INTO defaults_manifest(
+                           path, size, mtime, hash, set_id)
+                       VALUES(?,?,?,?,?);""",
+                    (file.name, stat.st_size, stat.st_mtime_ns, digest,
+                     set_id))
         cur.close()
 
-    def is_db_valid(self, con):
+    @write_transaction
+    def rescan_defaults(self, con):
+        """Import the defaults files that were added or changed since the
+        last scan, in one transaction.
+
+        Files whose size and modification time are unchanged aren't read.
+        Returns the names of the files that were imported. With a catalogue,
+        its sets and modifiers are copied instead, if they changed, and the
+        name of its file is returned.
+        """
+        if self.catalogue is None:
+            return self.__scan_defaults(con)
+        if not self.__catalogue_changed(con):
+            return []
+        self.__sync_catalogue(con)
+        return [os.path.basename(self.catalogue)]
+
+    def __load_defaults(self, con):
+        self.__add_challenge_set(con, personal)
+        self.rescan_defaults(con)
+
+    def __catalogue_state(self, con, db):
+        """Return the sets, numbered sets and modifiers of the attached DB
+        `db`, which are what a user's DB copies from its catalogue."""
         cur = con.cursor()
-        cur.execute("""SELECT name FROM sqlite_master
-                       WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
-                       ORDER BY 1;""")
-        if set(cur.fetchall()) != {('challenge_sets',),
-                                   ('challenges',),
-                                   ('languages',)}:
-            return False
-
-        cur.execute('SELECT * FROM challenge_sets LIMIT 0;')
-        challset_cols = [desc[0] for desc in cur.description]
-        cur.execute('SELECT * FROM challenges LIMIT 0;')
-        chall_cols = [desc[0] for desc in cur.description]
-        cur.execute('SELECT * FROM languages LIMIT 0;')
-        language_cols = [desc[0] for desc in cur.description]
-
-        if challset_cols != ['id', 'name']:
-            return False
-        if chall_cols != ['id', 'set_id', 'description', 'notes',
-                          'language_constraints', 'date_started',
-                          'date_finished', 'language_used']:
-            return False
-        if language_cols != ['id', 'name']:
-            return False
-
-        return True
-
-    def load_db(self):
-        load_defaults = False
-        if not (os.path.exists(self.dbfile)
-                and os.path.isfile(self.dbfile)
-                and os.stat(self.dbfile).st_size > 0):
-            load_defaults = True
-
-        con = self.__connect_to_db()
+        cur.execute(f"""SELECT name, modifiers_enabled
+                        FROM {db}.challenge_sets;""")
+        sets = set(cur.fetchall())
+        cur.execute(f"""SELECT challenge_sets.name, num_challenges
+                        FROM {db}.virtual_sets JOIN {db}.challenge_sets
+                        ON challenge_sets.id = virtual_sets.set_id
+                        ORDER BY 1;""")
+        numbered = cur.fetchall()
+        cur.execute(f"""SELECT modifiers.description, modifiers.file,
+                               languages.name
+                        FROM {db}.modifiers
+                        LEFT JOIN {db}.modifier_languages
+                        ON modifier_id = modifiers.id
+                        LEFT JOIN {db}.languages ON languages.id = language_id
+                        ORDER BY 1, 3;""")
+        modifiers = cur.fetchall()
+        cur.close()
+        return (sets, numbered, modifiers)
+
+    def __catalogue_changed(self, con):
+        (sets, numbered, modifiers) = self.__catalogue_state(con, "catalogue")
+        (own_sets, own_numbered, own_modifiers) = self.__catalogue_state(
+            con, "main")
+        # Sets that left the catalogue are kept for the progress in them.
+        return not (sets <= own_sets and numbered == own_numbered
+                    and modifiers == own_modifiers)
+
+    def __sync_catalogue(self, con):
+        """Copy the catalogue's sets and modifiers into the user's DB, which
+        only stores them by name. Its challenges are read where they are."""
+        (sets, numbered, modifiers) = self.__catalogue_state(con, "catalogue")
+        cur = con.cursor()
+        for (name, modifiers_enabled) in sets:
+            set_id = self.get_challenge_set_id(con, name)
+            if set_id is None:
+                set_id = self.__add_challenge_set(con, name)
+            cur.execute("""UPDATE challenge_sets SET modifiers_enabled = ?
+                           WHERE id = ?;""", (modifiers_enabled, set_id))
+
+        numbered = dict(numbered)
+        for (set_id, name, num) in self.get_virtual_sets(con):
+            if name not in numbered:
+                cur.execute("DELETE FROM virtual_sets WHERE set_id = ?;",
+                            (set_id,))
+        for (name, num) in numbered.items():
+            self.__sync_virtual_set(con, self.get_challenge_set_id(con, name),
+                                    name, num)
+
+        files = {}
+        cur.execute("SELECT DISTINCT file FROM modifiers;")
+        for (file,) in cur.fetchall():
+            files[file] = {}
+        for (desc, file, lang) in modifiers:
+            langs = files.setdefault(file, {}).setdefault(desc, [])
+            if lang is not None:
+                langs.append(lang)
+        for (file, descs) in files.items():
+            self.__import_modifiers(con, file,
+                                    [(desc, "", langs)
+                                     for (desc, langs) in descs.items()])
+        cur.close()
+
+    def __attach_catalogue(self, con):
+        """Attach the catalogue read-only as "catalogue". It is opened as
+        immutable, so SQLite reads it without locks or checks for changes:
+        a new version has to be moved into its place, not written in it."""
+        from urllib.parse import quote
+
+        uri = (f"file:{quote(os.path.abspath(self.catalogue))}"
+               "?mode=ro&immutable=1")
+        try:
+            con.execute("ATTACH DATABASE ? AS catalogue;", (uri,))
+            con.execute(f"PRAGMA catalogue.mmap_size = {CATALOGUE_MMAP_SIZE};")
+            version = con.execute(
+                "PRAGMA catalogue.user_version;").fetchone()[0]
+        except sqlite3.DatabaseError as err:
+            raise CorruptDatabaseError(f"Can't open the catalogue "
+                                       f"{self.catalogue}: {err}")
+        if version != schema.SCHEMA_VERSION:
+            raise CorruptDatabaseError(f"The catalogue {self.catalogue} is "
+                                       f"from schema version {version}, not "
+                                       f"{schema.SCHEMA_VERSION}")
+
+    def seal_catalogue(self, con):
+        """Make the DB a single file that can be attached as a catalogue.
+        Immutable readers never look at a write-ahead log, so everything in
+        it is checkpointed into the DB and WAL mode is left."""
+        con.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+        con.execute("PRAGMA journal_mode = DELETE;")
+
+    def export_snapshot(self, con):
+        """Yield (table, columns, rows) for the tables in
+        schema.SNAPSHOT_TABLES, with the rows of a table split over chunks
+        of at most IMPORT_CHUNK_SIZE rows.
+
+        The rows are read in one transaction, so the snapshot is consistent
+        even if other connections write to the DB meanwhile.
+        """
+        cur = con.cursor()
+        began = not con.in_transaction
+        if began:
+            cur.execute("BEGIN;")
+        try:
+            for table in schema.SNAPSHOT_TABLES:
+                cur.execute(f"SELECT * FROM {table};")
+                columns = [desc[0] for desc in cur.description]
+                yield (table, columns, [])
+                rows = cur.fetchmany(IMPORT_CHUNK_SIZE)
+                while len(rows) > 0:
+                    yield (table, columns, rows)
+                    rows = cur.fetchmany(IMPORT_CHUNK_SIZE)
+        finally:
+            cur.close()
+            if began:
+                con.rollback()
+
+    @write_transaction
+    def import_snapshot(self, con, version, chunks):
+        """Replace the data in the DB with a snapshot from export_snapshot.
+
+        `chunks` is an iterable of (table, columns, rows), so a snapshot can
+        be streamed from a file. Raises InvalidSnapshotError, and leaves the
+        DB untouched, if the snapshot can't be loaded.
+        """
+        if version != schema.SCHEMA_VERSION:
+            raise InvalidSnapshotError(f"The snapshot is from schema version "
+                                       f"{version}, not "
+                                       f"{schema.SCHEMA_VERSION}")
 
+        # The triggers keep the stats, pick and full-text tables up to date
+        # row by row, which would take most of the time of a bulk load, so
+        # they are dropped and those tables rebuilt at the end.
+        cur = con.cursor()
+        cur.execute("""SELECT name, sql FROM sqlite_master
+                       WHERE type = 'trigger';""")
+        triggers = cur.fetchall()
+        for (name, sql) in triggers:
+            cur.execute(f"DROP TRIGGER {name};")
+        for table in reversed(schema.SNAPSHOT_TABLES + schema.STATS_TABLES
+                              + schema.PICK_TABLES):
+            cur.execute(f"DELETE FROM {table};")
+
+        known = {}
+        for (table, columns, rows) in chunks:
+            if table not in known:
+                if table not in schema.SNAPSHOT_TABLES:
+                    raise InvalidSnapshotError(f"Unknown table {table}")
+                cur.execute(f"SELECT * FROM {table} LIMIT 0;")
+                known[table] = [desc[0] for desc in cur.description]
+            if columns != known[table]:
+                raise InvalidSnapshotError(f"The columns of {table} don't "
+                                           "match the DB")
+            try:
+                cur.executemany(f"""INSERT INTO {table}
+                                    VALUES({",".join("?" * len(columns))});""",
+                                rows)
+            except (sqlite3.IntegrityError, sqlite3.ProgrammingError) as err:
+                raise InvalidSnapshotError(f"Invalid row in {table}: {err}")
+
+        for (name, sql) in triggers:
+            cur.execute(sql)
+        schema.backfill_stats(con)
+        schema.backfill_picks(con)
+        if self.__has_fts(con):
+            cur.execute("""INSERT INTO challenges_fts(challenges_fts)
+                           VALUES('rebuild');""")
+        cur.close()
+
+    def backup_db(self, con, target, pages=BACKUP_PAGES, progress=None):
+        """Copy the DB to the file `target`, a few pages at a time, so that
+        other connections can keep using it meanwhile.
+
+        progress(status, remaining, total) is called after every step.
+        """
+        dest = sqlite3.connect(target)
         try:
-            valid = self.is_db_valid(con)
+            con.backup(dest, pages=pages, progress=progress)
+        finally:
+            dest.close()
+
+    def is_db_valid(self, con):
+        return schema.get_schema_version(con) == schema.SCHEMA_VERSION
+
+    @write_transaction
+    def __upgrade_db(self, con):
+        """Create or upgrade the tables (and import every defaults file into
+        a new DB) in a single transaction."""
+        # Another process may have done it while we waited for the lock.
+        version = schema.get_schema_version(con)
+        if version == 0:
+            schema.create_tables(con)
+            self.__load_defaults(con)
+        elif version < schema.SCHEMA_VERSION:
+            schema.migrate(con, version)
+            self.rescan_defaults(con)
+
+    def load_db(self, shared=False):
+        """Open the DB, creating or upgrading it if needed.
+
+        A shared connection can be handed from thread to thread, as long as
+        only one thread uses it at a time.
+        """
+        con = self.__connect_to_db(shared)
+
+        try:
+            version = schema.get_schema_version(con)
+            # In WAL mode readers don't block the writer or each other.
+            con.execute("PRAGMA journal_mode = WAL;")
         except sqlite3.DatabaseError:
             raise CorruptDatabaseError("db_file " + self.dbfile + " corrupted")
 
-        if not load_defaults and not valid:
-            raise CorruptDatabaseError("db_file " + self.dbfile + " corrupted")
-        elif load_defaults:
-            self.__create_tables(con)
-            self.__load_defaults(con)
+        if version > schema.SCHEMA_VERSION:
+            raise CorruptDatabaseError("db_file " + self.dbfile + " was made "
+                                       "by a newer version of challengeme")
+        if self.catalogue is not None:
+            self.__attach_catalogue(con)
+        if version < schema.SCHEMA_VERSION:
+            self.__upgrade_db(con)
+        if self.catalogue is not None:
+            cur = con.cursor()
+            cur.execute("SELECT 1 FROM main.defaults_manifest LIMIT 1;")
+            if cur.fetchone() is not None:
+                raise CorruptDatabaseError("db_file " + self.dbfile + " has "
+                                           "challenge sets of its own, so it "
+                                           "can't use a catalogue")
+            cur.close()
+            # A user's DB picks up a new version of the catalogue the first
+            # time it is opened with it.
+            if self.__catalogue_changed(con):
+                self.rescan_defaults(con)
         return con
 
+    def invalidate_cache(self):
+        """Drop every cached read. Only needed after writing to the DB
+        through the connection directly, not through a DataHandler method."""
+        self.cache.invalidate()
+
     def unload_db(self, con):
+        self.cache.forget(con)
         con.commit()
         self.__disconnect_from_db(con)
@@ -0,0 +1,282 @@
+"""Parse and validate defaults files, streaming their lists of challenges.
+
+A file is read a block at a time, and the entries of its "challenges" and
+"modifiers" lists are decoded one by one, so memory use doesn't depend on
+the size of the file. Files are parsed in worker processes when there is
+enough to parse, and the validated entries are handed in batches to the
+single process that writes them.
+"""
+import json
+import os
+import queue
+import re
+
+from ..exceptions import InvalidChallengeError
+from .datahandler import IMPORT_CHUNK_SIZE, parse_challenge
+
+# Characters read from a file at a time.
+BLOCK_SIZE = 1 << 16
+
+# Longest a single JSON value in a defaults file may be, so that a broken
+# file can't make the parser read all of it into memory.
+MAX_VALUE_SIZE = 1 << 22
+
+# Top-level lists whose entries are streamed rather than decoded whole.
+STREAMED_KEYS = ("challenges", "modifiers")
+
+# Total size of the files to parse above which they are parsed in worker
+# processes. Below it, starting the processes costs more than it saves.
+PARALLEL_MIN_BYTES = 1 << 23
+
+# Messages that may wait for the writer before the workers block.
+QUEUE_SIZE = 64
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# The queue that a worker process puts its messages on.
+worker_queue = None
+
+class JsonStream:
+    """A JSON document read from a text file a block at a time."""
+
+    def __init__(self, file):
+        self.file = file
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        # Position in the file of the start of buf, and its line and column
+        # (from 1).
+        self.offset = 0
+        self.line = 1
+        self.column = 1
+
+    def __fill(self):
+        """Drop the text before pos and read another block. Returns False
+        at the end of the file."""
+        if self.eof:
+            return False
+        consumed = self.buf[:self.pos]
+        newlines = consumed.count("\n")
+        if newlines > 0:
+            self.line += newlines
+            self.column = len(consumed) - consumed.rfind("\n")
+        else:
+            self.column += len(consumed)
+
+        block = self.file.read(BLOCK_SIZE)
+        self.eof = len(block) == 0
+        self.buf = self.buf[self.pos:] + block
+        self.offset += self.pos
+        self.pos = 0
+        return not self.eof
+
+    def where(self, pos=None):
+        """Describe where `pos` (by default the current position) in the
+        buffer is in the file."""
+        before = self.buf[:self.pos if pos is None else pos]
+        newlines = before.count("\n")
+        if newlines == 0:
+            column = self.column + len(before)
+        else:
+            column = len(before) - before.rfind("\n")
+        return f"line {self.line + newlines}, column {column}"
+
+    def error(self, message, pos=None):
+        return InvalidChallengeError(f"{message} at {self.where(pos)}")
+
+    def peek(self):
+        """Skip whitespace and return the next character, or "" at the end
+        of the file."""
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self.__fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise self.error(f"Expected {char!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next value."""
+        self.peek()
+        while True:
+            try:
+                (value, end) = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as err:
+                # The value may just be cut off at the end of the buffer.
+                if (len(self.buf) - self.pos > MAX_VALUE_SIZE
+                        or not self.__fill()):
+                    raise self.error(err.msg, err.pos)
+                continue
+            # So may a number.
+            if end == len(self.buf) and self.__fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        """Yield ("value", key, value) for each member of the top-level
+        object, except that the lists in STREAMED_KEYS give
+        ("item", key, index, where, value) for each of their entries, where
+        where() describes the entry's position.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+        else:
+            while True:
+                key = self.value()
+                if not isinstance(key, str):
+                    raise self.error("Expected a key")
+                self.expect(":")
+                if key in STREAMED_KEYS and self.peek() == "[":
+                    yield ("value", key, [])
+                    yield from self.__items(key)
+                else:
+                    yield ("value", key, self.value())
+
+                if self.peek() == "}":
+                    self.pos += 1
+                    break
+                self.expect(",")
+        if self.peek() != "":
+            raise self.error("Unexpected data after the object")
+
+    def __items(self, key):
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            self.peek()
+            start = self.offset + self.pos
+            value = self.value()
+            # Nothing is read between decoding the value and validating it,
+            # so its start is still in the buffer.
+            yield ("item", key, index,
+                   lambda: self.where(start - self.offset), value)
+            index += 1
+            if self.peek() == "]":
+                self.pos += 1
+                return
+            self.expect(",")
+
+def read_defaults_file(path, batch_size=IMPORT_CHUNK_SIZE):
+    """Parse and validate a defaults file.
+
+    Yields ("challenges", rows) with batches of (position, description,
+    notes, langs) rows and ("modifiers", rows) with batches of
+    (description, notes, langs) rows, then ("meta", fields) with the rest of
+    the top-level fields. The streamed lists show up in the fields as empty
+    lists. Raises InvalidChallengeError, saying where the problem is.
+    """
+    fields = {}
+    batches = {key: [] for key in STREAMED_KEYS}
+    with open(path, encoding="utf8") as f:
+        try:
+            for member in JsonStream(f).members():
+                if member[0] == "value":
+                    fields[member[1]] = member[2]
+                    continue
+
+                (_, key, index, where, value) = member
+                name = "Challenge" if key == "challenges" else "Modifier"
+                try:
+                    (desc, notes, langs) = parse_challenge(value,
+                                                           f"{name} {index}")
+                except InvalidChallengeError as err:
+                    raise InvalidChallengeError(f"{err} at {where()}")
+                batch = batches[key]
+                if key == "challenges":
+                    batch.append((index, desc, notes, langs))
+                else:
+                    batch.append((desc, notes, langs))
+                if len(batch) == batch_size:
+                    yield (key, batch)
+                    batches[key] = []
+        except UnicodeDecodeError as err:
+            raise InvalidChallengeError(f"The file is not UTF-8: {err}")
+
+    for (key, batch) in batches.items():
+        if len(batch) > 0:
+            yield (key, batch)
+    yield ("meta", fields)
+
+def parse_into_queue(path):
+    """Worker process task: put (path, message) on the queue for each
+    message of read_defaults_file, or (path, ("error", message))."""
+    try:
+        for message in read_defaults_file(path):
+            worker_queue.put((path, message))
+    except (OSError, InvalidChallengeError) as err:
+        worker_queue.put((path, ("error", str(err))))
+
+def set_worker_queue(messages):
+    global worker_queue
+    worker_queue = messages
+
+def read_serially(paths):
+    for path in paths:
+        try:
+            for message in read_defaults_file(path):
+                yield (path, message)
+        except (OSError, InvalidChallengeError) as err:
+            yield (path, ("error", str(err)))
+
+def read_in_parallel(paths, workers):
+    import multiprocessing
+    import threading
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Forking is cheap and doesn't re-run the main module, but isn't safe
+    # while other threads are running.
+    if ("fork" in multiprocessing.get_all_start_methods()
+            and threading.active_count() == 1):
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context("spawn")
+    messages = context.Queue(QUEUE_SIZE)
+    with ProcessPoolExecutor(workers, context, initializer=set_worker_queue,
+                             initargs=(messages,)) as pool:
+        futures = [pool.submit(parse_into_queue, path) for path in paths]
+        remaining = len(paths)
+        try:
+            while remaining > 0:
+                try:
+                    (path, message) = messages.get(timeout=1)
+                except queue.Empty:
+                    # A worker that died won't send anything more.
+                    for future in futures:
+                        if future.done() and future.exception() is not None:
+                            raise future.exception()
+                    continue
+                if message[0] in ("meta", "error"):
+                    remaining -= 1
+                yield (path, message)
+        finally:
+            # Unblock workers waiting to put messages that nobody will read.
+            for future in futures:
+                future.cancel()
+            while not all(future.done() for future in futures):
+                try:
+                    messages.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+def read_defaults_files(paths):
+    """Yield (path, message) for the messages of read_defaults_file for each
+    path, with ("error", message) in place of any that failed.
+
+    The messages of one file are in order, but those of different files may
+    be interleaved. Each file's last message is "meta" or "error".
+    """
+    paths = list(paths)
+    size = sum(os.path.getsize(path) for path in paths)
+    if size < PARALLEL_MIN_BYTES:
+        return read_serially(paths)
+    # Even a single file is worth a worker, which parses it while this
+    # process writes.
+    return read_in_parallel(paths, min(len(paths), os.cpu_count() or 1))
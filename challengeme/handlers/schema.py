@@ -0,0 +1,702 @@
+import sqlite3
+
+from ..exceptions import CorruptDatabaseError
+
+# The version of the schema made by this code, stored in PRAGMA user_version.
+# Databases from before the version was stored read 0 and are version 1.
+SCHEMA_VERSION = 8
+
+# The tables that hold the user's data, in an order that they can be filled
+# in. The stats and full-text tables are rebuilt from these by triggers.
+SNAPSHOT_TABLES = ["languages", "challenge_sets", "virtual_sets",
+                   "challenges", "challenge_languages", "virtual_challenges",
+                   "revisit_intervals", "revisits", "modifiers",
+                   "modifier_languages",
+                   "excluded_challenge_languages",
+                   "excluded_challenge_modifiers",
+                   "excluded_language_modifiers", "defaults_manifest"]
+
+STATS_TABLES = ["stats_languages", "stats_sets", "stats_durations",
+                "stats_days"]
+
+PICK_TABLES = ["pick_challenges", "pick_pairs", "pick_modifiers",
+               "pick_fallbacks"]
+
+def get_schema_version(con):
+    """Return the schema version of a database, or 0 if it is empty."""
+    cur = con.cursor()
+    cur.execute("PRAGMA user_version;")
+    version = cur.fetchone()[0]
+    if version == 0:
+        cur.execute("""SELECT COUNT(*) FROM sqlite_master
+                       WHERE type = 'table';""")
+        if cur.fetchone()[0] > 0:
+            if not is_version_1(con):
+                raise CorruptDatabaseError("Unknown database schema")
+            version = 1
+    cur.close()
+    return version
+
+def is_version_1(con):
+    cur = con.cursor()
+    cur.execute("""SELECT name FROM sqlite_master
+                   WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+                   ORDER BY 1;""")
+    if not {('challenge_sets',),
+            ('challenges',),
+            ('languages',)}.issubset(cur.fetchall()):
+        return False
+
+    cur.execute('SELECT * FROM challenge_sets LIMIT 0;')
+    challset_cols = [desc[0] for desc in cur.description]
+    cur.execute('SELECT * FROM challenges LIMIT 0;')
+    chall_cols = [desc[0] for desc in cur.description]
+    cur.execute('SELECT * FROM languages LIMIT 0;')
+    language_cols = [desc[0] for desc in cur.description]
+    cur.close()
+
+    if challset_cols != ['id', 'name']:
+        return False
+    if chall_cols != ['id', 'set_id', 'description', 'notes',
+                      'language_constraints', 'date_started',
+                      'date_finished', 'language_used']:
+        return False
+    if language_cols[:2] != ['id', 'name']:
+        return False
+
+    return True
+
+def create_tables(con):
+    """Create the current schema in an empty database."""
+    cur = con.cursor()
+    cur.execute("""
+                   CREATE TABLE challenge_sets (
+                       id integer PRIMARY KEY,
+                       name text NOT NULL
+                  );
+                   """)
+    cur.execute("""
+                   CREATE TABLE languages (
+                       id integer PRIMARY KEY,
+                       name text NOT NULL
+                  );
+                   """)
+    cur.execute("""
+                   CREATE TABLE challenges (
+                       id integer PRIMARY KEY,
+                       set_id integer NOT NULL,
+                       description text NOT NULL UNIQUE,
+                       notes text,
+                       language_constraints text,
+                       date_started text,
+                       date_finished text,
+                       language_used integer,
+                       FOREIGN KEY (set_id) REFERENCES challenge_sets (id)
+                  );
+                   """)
+    cur.close()
+    migrate(con, 1)
+
+def migrate(con, version):
+    """Upgrade a database one version at a time, up to SCHEMA_VERSION.
+
+    The caller is responsible for running this inside a transaction.
+    """
+    while version < SCHEMA_VERSION:
+        MIGRATIONS[version](con)
+        version += 1
+        con.execute(f"PRAGMA user_version = {version};")
+
+def migrate_1_to_2(con):
+    # Databases made between the schema changes and the introduction of
+    # user_version may already have some of this, hence IF NOT EXISTS.
+    cur = con.cursor()
+    cur.execute("PRAGMA table_info(languages);")
+    if "saved" not in [row[1] for row in cur.fetchall()]:
+        # Languages that are only named in a constraint have saved = 0.
+        cur.execute("""ALTER TABLE languages
+                       ADD COLUMN saved integer NOT NULL DEFAULT 1;""")
+
+    # Numbered challenge sets only store their size. A challenge from one of
+    # them gets a row in challenges (and in virtual_challenges) once it is
+    # accepted.
+    cur.execute("""
+                   CREATE TABLE IF NOT EXISTS virtual_sets (
+                       set_id integer PRIMARY KEY,
+                       num_challenges integer NOT NULL,
+                       FOREIGN KEY (set_id) REFERENCES challenge_sets (id)
+                  );
+                   """)
+    cur.execute("""
+                   CREATE TABLE IF NOT EXISTS virtual_challenges (
+                       set_id integer NOT NULL,
+                       number integer NOT NULL,
+                       challenge_id integer NOT NULL UNIQUE,
+                       PRIMARY KEY (set_id, number),
+                       FOREIGN KEY (set_id) REFERENCES virtual_sets (set_id),
+                       FOREIGN KEY (challenge_id) REFERENCES challenges (id)
+                  );
+                   """)
+
+    cur.execute("""SELECT name FROM sqlite_master
+                   WHERE type = 'table' AND name = 'challenge_languages';""")
+    move_constraints = cur.fetchone() is None
+    cur.execute("""
+                   CREATE TABLE IF NOT EXISTS challenge_languages (
+                       challenge_id integer NOT NULL,
+                       language_id integer NOT NULL,
+                       PRIMARY KEY (challenge_id, language_id),
+                       FOREIGN KEY (challenge_id) REFERENCES challenges (id),
+                       FOREIGN KEY (language_id) REFERENCES languages (id)
+                  ) WITHOUT ROWID;
+                   """)
+    cur.execute("""CREATE INDEX IF NOT EXISTS challenge_languages_language
+                   ON challenge_languages (language_id, challenge_id);""")
+    if move_constraints:
+        # Move the comma-separated constraints into challenge_languages.
+        cur.execute("""SELECT id, language_constraints FROM challenges
+                       WHERE language_constraints != '';""")
+        for (chall_id, langs) in cur.fetchall():
+            for lang in langs.split(','):
+                cur.execute("""INSERT INTO languages(name, saved)
+                               SELECT ?, 0 WHERE NOT EXISTS (
+                                   SELECT 1 FROM languages WHERE name = ?);""",
+                            (lang, lang))
+                cur.execute("""INSERT OR IGNORE INTO challenge_languages(
+                                   challenge_id, language_id)
+                               SELECT ?, id FROM languages WHERE name = ?;""",
+                            (chall_id, lang))
+        cur.execute("UPDATE challenges SET language_constraints = NULL;")
+
+    # What each defaults file looked like when it was last imported.
+    cur.execute("""
+                   CREATE TABLE IF NOT EXISTS defaults_manifest (
+                       path text PRIMARY KEY,
+                       size integer NOT NULL,
+                       mtime integer NOT NULL,
+                       hash text NOT NULL,
+                       set_id integer NOT NULL,
+                       FOREIGN KEY (set_id) REFERENCES challenge_sets (id)
+                  );
+                   """)
+    for column in ("set_id", "date_started", "date_finished",
+                   "language_used"):
+        cur.execute(f"""CREATE INDEX IF NOT EXISTS challenges_{column}
+                        ON challenges ({column});""")
+    cur.close()
+
+# Upper bounds (in days) of the buckets of the stats_durations histogram. The
+# last bucket holds everything that took longer.
+DURATION_BUCKETS = [1, 7, 30, 90, 365]
+
+def stats_delta_sql(row, sign):
+    """Return statements that add (sign 1) or remove (sign -1) the progress
+    of trigger row `row` (OLD or NEW) to or from the stats tables."""
+    started = f"{row}.date_started IS NOT NULL"
+    finished = f"{started} AND {row}.date_finished IS NOT NULL"
+    language = f"coalesce({row}.language_used, '')"
+    days = (f"CAST(julianday({row}.date_finished) "
+            f"- julianday({row}.date_started) AS integer)")
+    bucket = "CASE " + " ".join(f"WHEN {days} < {bound} THEN {i}"
+                                for (i, bound)
+                                in enumerate(DURATION_BUCKETS))
+    bucket += f" ELSE {len(DURATION_BUCKETS)} END"
+
+    def epoch_day(column):
+        return f"CAST(julianday({row}.{column}) - 2440587.5 AS integer)"
+
+    counters = f"""started = started + excluded.started,
+                   finished = finished + excluded.finished,
+                   total_days = total_days + excluded.total_days"""
+    return [
+        f"""INSERT INTO stats_languages(language, started, finished,
+                                        total_days)
+            SELECT {language}, {sign}, {sign} * ({finished}),
+                   {sign} * (CASE WHEN {finished} THEN {days} ELSE 0 END)
+            WHERE {started}
+            ON CONFLICT(language) DO UPDATE SET {counters};""",
+        f"""INSERT INTO stats_sets(set_id, started, finished, total_days)
+            SELECT {row}.set_id, {sign}, {sign} * ({finished}),
+                   {sign} * (CASE WHEN {finished} THEN {days} ELSE 0 END)
+            WHERE {started}
+            ON CONFLICT(set_id) DO UPDATE SET {counters};""",
+        f"""INSERT INTO stats_durations(language, bucket, count)
+            SELECT {language}, {bucket}, {sign} WHERE {finished}
+            ON CONFLICT(language, bucket) DO UPDATE
+            SET count = count + excluded.count;""",
+        f"""INSERT INTO stats_days(day, started, finished)
+            SELECT {epoch_day('date_started')}, {sign}, 0 WHERE {started}
+            ON CONFLICT(day) DO UPDATE
+            SET started = started + excluded.started;""",
+        f"""INSERT INTO stats_days(day, started, finished)
+            SELECT {epoch_day('date_finished')}, 0, {sign} WHERE {finished}
+            ON CONFLICT(day) DO UPDATE
+            SET finished = finished + excluded.finished;""",
+    ]
+
+def migrate_2_to_3(con):
+    # Summary tables kept up to date by triggers on challenges, so that
+    # statistics never have to scan the challenges themselves. Durations are
+    # whole days, and stats_days is keyed by days since 1970-01-01 so that a
+    # time window is a range of its primary key.
+    cur = con.cursor()
+    cur.execute("""
+                   CREATE TABLE stats_languages (
+                       language text PRIMARY KEY,
+                       started integer NOT NULL,
+                       finished integer NOT NULL,
+                       total_days integer NOT NULL
+                  );
+                   """)
+    cur.execute("""
+                   CREATE TABLE stats_sets (
+                       set_id integer PRIMARY KEY,
+                       started integer NOT NULL,
+                       finished integer NOT NULL,
+                       total_days integer NOT NULL,
+                       FOREIGN KEY (set_id) REFERENCES challenge_sets (id)
+                  );
+                   """)
+    cur.execute("""
+                   CREATE TABLE stats_durations (
+                       language text NOT NULL,
+                       bucket integer NOT NULL,
+                       count integer NOT NULL,
+                       PRIMARY KEY (language, bucket)
+                  ) WITHOUT ROWID;
+                   """)
+    cur.execute("""
+                   CREATE TABLE stats_days (
+                       day integer PRIMARY KEY,
+                       started integer NOT NULL,
+                       finished integer NOT NULL
+                  );
+                   """)
+
+    new = "\n".join(stats_delta_sql("NEW", 1))
+    old = "\n".join(stats_delta_sql("OLD", -1))
+    cur.execute(f"""CREATE TRIGGER stats_insert AFTER INSERT ON challenges
+                    BEGIN {new} END;""")
+    cur.execute(f"""CREATE TRIGGER stats_update
+                    AFTER UPDATE OF set_id, date_started, date_finished,
+                                    language_used ON challenges
+                    BEGIN {old} {new} END;""")
+    cur.execute(f"""CREATE TRIGGER stats_delete AFTER DELETE ON challenges
+                    BEGIN {old} END;""")
+    cur.close()
+
+    # Count the progress made before the triggers existed.
+    backfill_stats(con)
+
+def backfill_stats(con):
+    """Add the progress of every started challenge to the stats tables, by
+    replaying them through a temporary copy of the insert trigger."""
+    new = "\n".join(stats_delta_sql("NEW", 1))
+    cur = con.cursor()
+    cur.execute("""CREATE TEMP TABLE stats_backfill AS
+                   SELECT * FROM challenges LIMIT 0;""")
+    cur.execute(f"""CREATE TEMP TRIGGER stats_backfill_insert
+                    AFTER INSERT ON stats_backfill
+                    BEGIN {new} END;""")
+    cur.execute("""INSERT INTO temp.stats_backfill
+                   SELECT * FROM challenges
+                   WHERE date_started IS NOT NULL;""")
+    cur.execute("DROP TABLE temp.stats_backfill;")
+    cur.close()
+
+def migrate_3_to_4(con):
+    # Full-text index over the challenges, kept in sync by triggers. SQLite
+    # may be built without FTS5, in which case searches fall back to LIKE.
+    cur = con.cursor()
+    try:
+        cur.execute("""CREATE VIRTUAL TABLE challenges_fts
+                       USING fts5(description, notes,
+                                  content='challenges', content_rowid='id');""")
+    except sqlite3.OperationalError:
+        cur.close()
+        return
+
+    insert = """INSERT INTO challenges_fts(rowid, description, notes)
+                VALUES(NEW.id, NEW.description, NEW.notes);"""
+    delete = """INSERT INTO challenges_fts(challenges_fts, rowid, description,
+                                           notes)
+                VALUES('delete', OLD.id, OLD.description, OLD.notes);"""
+    cur.execute(f"""CREATE TRIGGER challenges_fts_insert
+                    AFTER INSERT ON challenges
+                    BEGIN {insert} END;""")
+    cur.execute(f"""CREATE TRIGGER challenges_fts_update
+                    AFTER UPDATE OF description, notes ON challenges
+                    BEGIN {delete} {insert} END;""")
+    cur.execute(f"""CREATE TRIGGER challenges_fts_delete
+                    AFTER DELETE ON challenges
+                    BEGIN {delete} END;""")
+    cur.execute("""INSERT INTO challenges_fts(challenges_fts)
+                   VALUES('rebuild');""")
+    cur.close()
+
+def migrate_4_to_5(con):
+    # Modifiers come from the defaults files, which name the file each one
+    # was loaded from. A modifier without languages applies to all of them.
+    cur = con.cursor()
+    cur.execute("""
+                   CREATE TABLE modifiers (
+                       id integer PRIMARY KEY,
+                       description text NOT NULL UNIQUE,
+                       file text
+                  );
+                   """)
+    cur.execute("""
+                   CREATE TABLE modifier_languages (
+                       modifier_id integer NOT NULL,
+                       language_id integer NOT NULL,
+                       PRIMARY KEY (modifier_id, language_id),
+                       FOREIGN KEY (modifier_id) REFERENCES modifiers (id),
+                       FOREIGN KEY (language_id) REFERENCES languages (id)
+                  ) WITHOUT ROWID;
+                   """)
+    cur.execute("""ALTER TABLE challenge_sets
+                   ADD COLUMN modifiers_enabled integer NOT NULL DEFAULT 1;""")
+    cur.execute("ALTER TABLE challenges ADD COLUMN modifier_used text;")
+
+    # Files of modifiers have no set, and every defaults file is read again
+    # for its modifier settings, so the manifest is started afresh.
+    cur.execute("DROP TABLE defaults_manifest;")
+    cur.execute("""
+                   CREATE TABLE defaults_manifest (
+                       path text PRIMARY KEY,
+                       size integer NOT NULL,
+                       mtime integer NOT NULL,
+                       hash text NOT NULL,
+                       set_id integer,
+                       FOREIGN KEY (set_id) REFERENCES challenge_sets (id)
+                  );
+                   """)
+    cur.close()
+
+def migrate_5_to_6(con):
+    # Pairs the user never wants to be offered together again.
+    cur = con.cursor()
+    cur.execute("""
+                   CREATE TABLE excluded_challenge_languages (
+                       challenge_id integer NOT NULL,
+                       language_id integer NOT NULL,
+                       PRIMARY KEY (challenge_id, language_id),
+                       FOREIGN KEY (challenge_id) REFERENCES challenges (id),
+                       FOREIGN KEY (language_id) REFERENCES languages (id)
+                  ) WITHOUT ROWID;
+                   """)
+    cur.execute("""
+                   CREATE TABLE excluded_challenge_modifiers (
+                       challenge_id integer NOT NULL,
+                       modifier_id integer NOT NULL,
+                       PRIMARY KEY (challenge_id, modifier_id),
+                       FOREIGN KEY (challenge_id) REFERENCES challenges (id),
+                       FOREIGN KEY (modifier_id) REFERENCES modifiers (id)
+                  ) WITHOUT ROWID;
+                   """)
+    cur.execute("""
+                   CREATE TABLE excluded_language_modifiers (
+                       language_id integer NOT NULL,
+                       modifier_id integer NOT NULL,
+                       PRIMARY KEY (language_id, modifier_id),
+                       FOREIGN KEY (language_id) REFERENCES languages (id),
+                       FOREIGN KEY (modifier_id) REFERENCES modifiers (id)
+                  ) WITHOUT ROWID;
+                   """)
+    cur.close()
+
+# Days after finishing a challenge that it is due to be revisited, unless its
+# set or language has an interval of its own.
+DEFAULT_REVISIT_DAYS = 60
+
+def revisit_due_sql(row):
+    """Return an expression for the day (since 1970-01-01) that challenge row
+    `row` is due to be revisited. A set's interval wins over a language's."""
+    return f"""CAST(julianday({row}.date_finished) - 2440587.5 AS integer)
+               + coalesce((SELECT days FROM revisit_intervals
+                           WHERE set_id = {row}.set_id),
+                          (SELECT days FROM revisit_intervals
+                           WHERE language = {row}.language_used),
+                          {DEFAULT_REVISIT_DAYS})"""
+
+def migrate_6_to_7(con):
+    # Finished challenges waiting to be revisited, keyed by the day they are
+    # due so that the due ones are a range of the index. A trigger queues a
+    # challenge when it is finished; it leaves the queue once revisited.
+    cur = con.cursor()
+    cur.execute("""
+                   CREATE TABLE revisit_intervals (
+                       set_id integer UNIQUE,
+                       language text UNIQUE,
+                       days integer NOT NULL,
+                       CHECK ((set_id IS NULL) != (language IS NULL)),
+                       FOREIGN KEY (set_id) REFERENCES challenge_sets (id)
+                  );
+                   """)
+    cur.execute("""
+                   CREATE TABLE revisits (
+                       challenge_id integer PRIMARY KEY,
+                       due integer NOT NULL,
+                       FOREIGN KEY (challenge_id) REFERENCES challenges (id)
+                  );
+                   """)
+    cur.execute("CREATE INDEX revisits_due ON revisits (due);")
+    cur.execute(f"""CREATE TRIGGER revisits_finish
+                    AFTER UPDATE OF date_finished ON challenges
+                    WHEN NEW.date_finished IS NOT OLD.date_finished
+                    BEGIN
+                        DELETE FROM revisits WHERE challenge_id = NEW.id;
+                        INSERT INTO revisits(challenge_id, due)
+                        SELECT NEW.id, {revisit_due_sql("NEW")}
+                        WHERE NEW.date_finished IS NOT NULL;
+                    END;""")
+    cur.execute("""CREATE TRIGGER revisits_delete AFTER DELETE ON challenges
+                   BEGIN
+                       DELETE FROM revisits WHERE challenge_id = OLD.id;
+                   END;""")
+    # Queue what was finished before the scheduler existed.
+    cur.execute(f"""INSERT INTO revisits(challenge_id, due)
+                    SELECT id, {revisit_due_sql("challenges")}
+                    FROM challenges WHERE date_finished IS NOT NULL;""")
+    cur.close()
+
+def pick_eligible_sql(chall, language):
+    """Return a condition for challenge `chall` being eligible in
+    `language`: allowed by its constraints and not excluded."""
+    return f"""(NOT EXISTS (SELECT 1 FROM challenge_languages
+                            WHERE challenge_id = {chall})
+                OR EXISTS (SELECT 1 FROM challenge_languages
+                           WHERE challenge_id = {chall}
+                           AND language_id = {language}))
+               AND NOT EXISTS (SELECT 1 FROM excluded_challenge_languages
+                               WHERE challenge_id = {chall}
+                               AND language_id = {language})"""
+
+def modifier_applies_sql(modifier, language):
+    """Return a condition for `modifier` going with `language`: it applies
+    to the language and the pair isn't excluded."""
+    return f"""(NOT EXISTS (SELECT 1 FROM modifier_languages
+                            WHERE modifier_id = {modifier})
+                OR EXISTS (SELECT 1 FROM modifier_languages
+                           WHERE modifier_id = {modifier}
+                           AND language_id = {language}))
+               AND NOT EXISTS (SELECT 1 FROM excluded_language_modifiers
+                               WHERE language_id = {language}
+                               AND modifier_id = {modifier})"""
+
+def pick_fallback_sql(chall, language):
+    """Return a condition for challenge `chall` having excluded every
+    modifier that goes with `language`, when there are any."""
+    applies = modifier_applies_sql("modifiers.id", language)
+    return f"""EXISTS (SELECT 1 FROM modifiers WHERE {applies})
+               AND NOT EXISTS (
+                   SELECT 1 FROM modifiers WHERE {applies}
+                   AND NOT EXISTS (SELECT 1 FROM excluded_challenge_modifiers
+                                   WHERE challenge_id = {chall}
+                                   AND modifier_id = modifiers.id))"""
+
+def pick_delta_sql(chall, set_id, sign):
+    """Return statements that add (sign 1) or remove (sign -1) the
+    contribution of challenge `chall` in set `set_id` to the pick tables.
+
+    An unconstrained challenge counts once under language 0 and minus once
+    under each language it excludes, so that adding a language doesn't
+    touch every challenge. A constrained one counts under each language it
+    allows and doesn't exclude.
+    """
+    constrained = f"""EXISTS (SELECT 1 FROM challenge_languages
+                              WHERE challenge_id = {chall})"""
+    weights = f"""(SELECT 0 AS language_id, 1 AS weight
+                   WHERE NOT {constrained}
+                   UNION ALL
+                   SELECT language_id, -1 FROM excluded_challenge_languages
+                   WHERE challenge_id = {chall} AND NOT {constrained}
+                   UNION ALL
+                   SELECT language_id, 1 FROM challenge_languages AS allowed
+                   WHERE challenge_id = {chall}
+                   AND NOT EXISTS (
+                       SELECT 1 FROM excluded_challenge_languages
+                       WHERE challenge_id = {chall}
+                       AND language_id = allowed.language_id))"""
+    # An upsert from a SELECT needs a WHERE, or the ON of ON CONFLICT is
+    # read as a join constraint.
+    return [
+        f"""INSERT INTO pick_pairs(set_id, language_id, count)
+            SELECT {set_id}, language_id, {sign} * weight FROM {weights}
+            WHERE 1
+            ON CONFLICT(set_id, language_id) DO UPDATE
+            SET count = count + excluded.count;""",
+        f"""INSERT INTO pick_modifiers(set_id, language_id, modifier_id,
+                                       count)
+            SELECT {set_id}, weights.language_id, x.modifier_id,
+                   {sign} * weights.weight
+            FROM {weights} AS weights, excluded_challenge_modifiers AS x
+            WHERE x.challenge_id = {chall}
+            ON CONFLICT(set_id, language_id, modifier_id) DO UPDATE
+            SET count = count + excluded.count;""",
+        f"""INSERT INTO pick_fallbacks(set_id, language_id, count)
+            SELECT {set_id}, languages.id, {sign} FROM languages
+            WHERE EXISTS (SELECT 1 FROM excluded_challenge_modifiers
+                          WHERE challenge_id = {chall})
+            AND {pick_eligible_sql(chall, "languages.id")}
+            AND {pick_fallback_sql(chall, "languages.id")}
+            ON CONFLICT(set_id, language_id) DO UPDATE
+            SET count = count + excluded.count;""",
+    ]
+
+def pick_fallbacks_sql(language=None):
+    """Return statements that recount pick_fallbacks, for one language or
+    for all of them, after the modifiers that go with them changed."""
+    where = "" if language is None else f"WHERE language_id = {language}"
+    only = "" if language is None else f"AND languages.id = {language}"
+    return [
+        f"DELETE FROM pick_fallbacks {where};",
+        f"""INSERT INTO pick_fallbacks(set_id, language_id, count)
+            SELECT challenges.set_id, languages.id, COUNT(*)
+            FROM challenges, languages
+            WHERE challenges.date_started IS NULL {only}
+            AND challenges.id IN (SELECT challenge_id
+                                  FROM excluded_challenge_modifiers)
+            AND {pick_eligible_sql("challenges.id", "languages.id")}
+            AND {pick_fallback_sql("challenges.id", "languages.id")}
+            GROUP BY 1, 2;""",
+    ]
+
+# Tables that say which languages a challenge can be picked with, and the
+# column besides challenge_id in their primary key.
+PICK_CHALLENGE_TABLES = [("challenge_languages", "language_id"),
+                         ("excluded_challenge_languages", "language_id"),
+                         ("excluded_challenge_modifiers", "modifier_id")]
+
+def migrate_7_to_8(con):
+    # Running counts of the eligible (challenge, language) pairs kept by
+    # triggers, so that a pick reads a few counts and then the one challenge
+    # it picked instead of every unstarted challenge. pick_modifiers counts
+    # the pairs that exclude a modifier, and pick_fallbacks the ones that
+    # exclude every modifier that goes with the language, which are picked
+    # without one.
+    cur = con.cursor()
+    cur.execute("""
+                   CREATE TABLE pick_pairs (
+                       set_id integer NOT NULL,
+                       language_id integer NOT NULL,
+                       count integer NOT NULL,
+                       PRIMARY KEY (set_id, language_id)
+                  ) WITHOUT ROWID;
+                   """)
+    cur.execute("""
+                   CREATE TABLE pick_modifiers (
+                       set_id integer NOT NULL,
+                       language_id integer NOT NULL,
+                       modifier_id integer NOT NULL,
+                       count integer NOT NULL,
+                       PRIMARY KEY (set_id, language_id, modifier_id)
+                  ) WITHOUT ROWID;
+                   """)
+    cur.execute("""
+                   CREATE TABLE pick_fallbacks (
+                       set_id integer NOT NULL,
+                       language_id integer NOT NULL,
+                       count integer NOT NULL,
+                       PRIMARY KEY (set_id, language_id)
+                  ) WITHOUT ROWID;
+                   """)
+    # The unstarted challenges of a set, in id order, for picks to step
+    # through.
+    cur.execute("""CREATE INDEX challenges_unstarted ON challenges (set_id)
+                   WHERE date_started IS NULL;""")
+
+    # pick_challenges holds the unstarted challenges, and its triggers add
+    # and take away what a challenge counts for. The other triggers only
+    # add and remove rows of it, so the counting SQL is stored just once.
+    cur.execute("""
+                   CREATE TABLE pick_challenges (
+                       id integer PRIMARY KEY,
+                       set_id integer NOT NULL
+                  );
+                   """)
+    new = "\n".join(pick_delta_sql("NEW.id", "NEW.set_id", 1))
+    old = "\n".join(pick_delta_sql("OLD.id", "OLD.set_id", -1))
+    cur.execute(f"""CREATE TRIGGER pick_challenges_insert
+                    AFTER INSERT ON pick_challenges
+                    BEGIN {new} END;""")
+    cur.execute(f"""CREATE TRIGGER pick_challenges_delete
+                    AFTER DELETE ON pick_challenges
+                    BEGIN {old} END;""")
+
+    add = """INSERT INTO pick_challenges(id, set_id)
+             SELECT NEW.id, NEW.set_id WHERE NEW.date_started IS NULL;"""
+    remove = "DELETE FROM pick_challenges WHERE id = OLD.id;"
+    cur.execute(f"""CREATE TRIGGER pick_insert AFTER INSERT ON challenges
+                    BEGIN {add} END;""")
+    cur.execute(f"""CREATE TRIGGER pick_update
+                    AFTER UPDATE OF set_id, date_started ON challenges
+                    BEGIN {remove} {add} END;""")
+    cur.execute(f"""CREATE TRIGGER pick_delete AFTER DELETE ON challenges
+                    BEGIN {remove} END;""")
+
+    # A row of these tables changes what its challenge counts for: the
+    # challenge is taken away before and added back after. The WHEN skips
+    # rows that INSERT OR IGNORE won't insert.
+    for (table, column) in PICK_CHALLENGE_TABLES:
+        for (row, when) in (("NEW", f"""WHEN NOT EXISTS (
+                                            SELECT 1 FROM {table}
+                                            WHERE challenge_id =
+                                                NEW.challenge_id
+                                            AND {column} = NEW.{column})"""),
+                            ("OLD", "")):
+            event = "INSERT" if row == "NEW" else "DELETE"
+            chall = f"{row}.challenge_id"
+            name = f"{table}_pick_{event.lower()}"
+            cur.execute(f"""CREATE TRIGGER {name}_before
+                            BEFORE {event} ON {table} {when}
+                            BEGIN
+                                DELETE FROM pick_challenges
+                                WHERE id = {chall};
+                            END;""")
+            cur.execute(f"""CREATE TRIGGER {name} AFTER {event} ON {table}
+                            BEGIN
+                                INSERT INTO pick_challenges(id, set_id)
+                                SELECT id, set_id FROM challenges
+                                WHERE id = {chall}
+                                AND date_started IS NULL;
+                            END;""")
+
+    # Which modifiers go with a language rarely changes, and pick_fallbacks
+    # only has rows for challenges that exclude modifiers.
+    recount = "WHEN EXISTS (SELECT 1 FROM excluded_challenge_modifiers)"
+    for (table, language) in (("modifiers", None),
+                              ("modifier_languages", None),
+                              ("excluded_language_modifiers", "language_id"),
+                              ("languages", "id")):
+        for (event, row) in (("INSERT", "NEW"), ("DELETE", "OLD")):
+            if table == "languages" and event == "DELETE":
+                continue
+            statements = "\n".join(pick_fallbacks_sql(
+                None if language is None else f"{row}.{language}"))
+            cur.execute(f"""CREATE TRIGGER {table}_pick_{event.lower()}
+                            AFTER {event} ON {table} {recount}
+                            BEGIN {statements} END;""")
+    cur.close()
+
+    # Count the challenges that were there before the triggers.
+    backfill_picks(con)
+
+def backfill_picks(con):
+    """Add every unstarted challenge to the pick tables."""
+    cur = con.cursor()
+    cur.execute("""INSERT INTO pick_challenges(id, set_id)
+                   SELECT id, set_id FROM challenges
+                   WHERE date_started IS NULL;""")
+    cur.close()
+
+# MIGRATIONS[n] upgrades a database from version n to version n + 1.
+MIGRATIONS = {
+    1: migrate_1_to_2,
+    2: migrate_2_to_3,
+    3: migrate_3_to_4,
+    4: migrate_4_to_5,
+    5: migrate_5_to_6,
+    6: migrate_6_to_7,
+    7: migrate_7_to_8,
+}
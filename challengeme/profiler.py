@@ -0,0 +1,213 @@
+import functools
+import inspect
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from .handlers.datahandler import DataHandler
+
+# Slowest calls kept for each query shape, method and command.
+SLOWEST = 3
+
+# Rows shown for each section of the text report.
+REPORT_ROWS = 20
+
+def query_shape(sql):
+    """Return `sql` with its whitespace collapsed and lists of placeholders
+    shortened, so that queries which only differ in those count as one."""
+    sql = " ".join(sql.split())
+    return re.sub(r"\?(\s*,\s*\?)+", "?, ...", sql)
+
+class Timings:
+    """The number of calls, total time and slowest calls for each key."""
+
+    def __init__(self):
+        # key -> [calls, seconds, [(seconds, details) of the slowest calls]]
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def add(self, key, elapsed, details=None, calls=1):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = [0, 0.0, []]
+            entry[0] += calls
+            entry[1] += elapsed
+            slowest = entry[2]
+            if calls > 0 and (len(slowest) < SLOWEST
+                              or elapsed > slowest[-1][0]):
+                slowest.append((elapsed, details))
+                slowest.sort(key=lambda call: call[0], reverse=True)
+                del slowest[SLOWEST:]
+
+    def sorted(self):
+        """Return (key, calls, seconds, slowest) by total time, longest
+        first."""
+        with self.lock:
+            return sorted(((key, *entry) for (key, entry)
+                           in self.entries.items()),
+                          key=lambda row: row[2], reverse=True)
+
+class ProfiledCursor(sqlite3.Cursor):
+    """A cursor that adds the time of its statements, and of fetching their
+    rows, to profiler.queries."""
+
+    profiler = None
+    shape = None
+
+    def execute(self, sql, params=()):
+        self.shape = query_shape(sql)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self.profiler.queries.add(self.shape,
+                                      time.perf_counter() - start,
+                                      repr(params)[:200])
+
+    def executemany(self, sql, params):
+        self.shape = query_shape(sql)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, params)
+        finally:
+            self.profiler.queries.add(self.shape,
+                                      time.perf_counter() - start,
+                                      "executemany")
+
+    def __fetch(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            if self.shape is not None:
+                self.profiler.queries.add(self.shape,
+                                          time.perf_counter() - start,
+                                          calls=0)
+
+    def fetchone(self):
+        return self.__fetch(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self.__fetch(super().fetchmany, *args)
+
+    def fetchall(self):
+        return self.__fetch(super().fetchall)
+
+    def __next__(self):
+        return self.__fetch(super().__next__)
+
+class ProfiledConnection(sqlite3.Connection):
+    cursor_factory = ProfiledCursor
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or self.cursor_factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, params):
+        return self.cursor().executemany(sql, params)
+
+class Profiler:
+    """Time the queries, DataHandler methods and CLI commands that run while
+    it is enabled.
+
+    Nothing is wrapped until enable() is called, so the code runs as usual
+    when profiling is off. Method times include the methods they call.
+    """
+
+    def __init__(self):
+        self.queries = Timings()
+        self.methods = Timings()
+        self.commands = Timings()
+        self.originals = {}
+
+    def enable(self):
+        cursor = type("ProfiledCursor", (ProfiledCursor,),
+                      {"profiler": self})
+        self.originals["connection_factory"] = DataHandler.connection_factory
+        DataHandler.connection_factory = type("ProfiledConnection",
+                                              (ProfiledConnection,),
+                                              {"cursor_factory": cursor})
+        for (name, method) in list(vars(DataHandler).items()):
+            if (inspect.isfunction(method)
+                    and not (name.startswith("__") and name.endswith("__"))):
+                self.originals[name] = method
+                setattr(DataHandler, name, self.__timed(method))
+
+    def disable(self):
+        for (name, original) in self.originals.items():
+            setattr(DataHandler, name, original)
+        self.originals.clear()
+
+    def __timed(self, method):
+        name = method.__name__
+
+        if inspect.isgeneratorfunction(method):
+            @functools.wraps(method)
+            def timed_generator(*args, **kwargs):
+                # Only the time spent inside the generator is counted.
+                elapsed = 0.0
+                gen = method(*args, **kwargs)
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            item = next(gen)
+                        except StopIteration:
+                            return
+                        finally:
+                            elapsed += time.perf_counter() - start
+                        yield item
+                finally:
+                    gen.close()
+                    self.methods.add(name, elapsed)
+            return timed_generator
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.methods.add(name, time.perf_counter() - start)
+        return timed
+
+    def run_command(self, name, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.commands.add(name, time.perf_counter() - start)
+
+    def to_json(self):
+        def section(timings):
+            return {key: {"calls": calls, "total_ms": seconds * 1000,
+                          "slowest": [{"ms": elapsed * 1000,
+                                       "details": details}
+                                      for (elapsed, details) in slowest]}
+                    for (key, calls, seconds, slowest) in timings.sorted()}
+
+        return {"commands": section(self.commands),
+                "methods": section(self.methods),
+                "queries": section(self.queries)}
+
+    def report(self, file=sys.stderr):
+        sections = [("Commands", self.commands),
+                    ("DataHandler methods", self.methods),
+                    ("Queries", self.queries)]
+        for (title, timings) in sections:
+            rows = timings.sorted()
+            print(f"{title} ({len(rows)}):", file=file)
+            print(f"{'calls':>8}{'total ms':>12}{'max ms':>10}  name",
+                  file=file)
+            for (key, calls, seconds, slowest) in rows[:REPORT_ROWS]:
+                longest = slowest[0][0] if len(slowest) > 0 else 0
+                if len(key) > 100:
+                    key = key[:97] + "..."
+                print(f"{calls:>8}{seconds * 1000:>12.2f}"
+                      f"{longest * 1000:>10.2f}  {key}", file=file)
+            print(file=file)
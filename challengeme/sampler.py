@@ -0,0 +1,49 @@
+import bisect
+import itertools
+import random
+from contextlib import nullcontext
+
+class ChallengeSampler:
+    """Pick uniformly random (challenge, language, modifier) triples.
+
+    Every language has the modifiers that apply to it, and sets with
+    modifiers disabled use none. A challenge and language with no modifier
+    to go with them make a single triple, with None for the modifier.
+
+    The eligible triples come in groups that share a set and language:
+    groups(set_id, language) returns them as (language, size, part) tuples
+    and fetch(part, i) returns the i-th (challenge, modifier) pair of a
+    group. A pick is a bisect over the running total of the sizes and a
+    single fetch, and never has to be retried. Both are called inside
+    snapshot(), so that the sizes match what is fetched.
+    """
+
+    def __init__(self, groups, fetch, snapshot=nullcontext):
+        self.groups = groups
+        self.fetch = fetch
+        self.snapshot = snapshot
+
+    def count(self, set_id=None, language=None):
+        """Return the number of eligible (challenge, language, modifier)
+        triples."""
+        with self.snapshot():
+            return sum(size for (lang, size, part)
+                       in self.groups(set_id, language))
+
+    def sample(self, rng=random, set_id=None, language=None):
+        """Return a random (challenge, language, modifier) triple, or None
+        if no challenge can be done in any saved language."""
+        with self.snapshot():
+            groups = self.groups(set_id, language)
+            totals = list(itertools.accumulate(size for (lang, size, part)
+                                               in groups))
+            if len(totals) == 0 or totals[-1] == 0:
+                return None
+
+            pick = rng.randrange(totals[-1])
+            i = bisect.bisect_right(totals, pick)
+            if i > 0:
+                pick -= totals[i - 1]
+            (lang, size, part) = groups[i]
+            (chall, modifier) = self.fetch(part, pick)
+            return chall, lang, modifier
@@ -0,0 +1,250 @@
+"""Serve the DataHandler operations as a local HTTP/JSON API.
+
+Requests are handled on threads, each borrowing a warm connection from a
+ConnectionPool. Languages and sets come from the DataHandler's read cache,
+so they aren't re-read every time, and picks are made from running counts
+that the DB keeps up to date.
+"""
+import json
+import queue
+import random
+import sqlite3
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .config import personal
+from .exceptions import InvalidChallengeError
+from .handlers.datahandler import parse_challenge
+
+def challenge_json(chall):
+    return {"id": chall.id, "set_id": chall.set_id,
+            "description": chall.description, "notes": chall.notes,
+            "language_constraints": chall.language_constraints,
+            "date_started": chall.date_started,
+            "date_finished": chall.date_finished,
+            "language_used": chall.language_used,
+            "modifier_used": chall.modifier_used, "number": chall.number}
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class ConnectionPool:
+    """A fixed number of open DB connections shared between threads."""
+
+    def __init__(self, datahandler, size):
+        self.datahandler = datahandler
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(datahandler.load_db(shared=True))
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, waiting for one to be returned if needed."""
+        con = self.connections.get()
+        try:
+            yield con
+        finally:
+            self.connections.put(con)
+
+    def close(self):
+        while not self.connections.empty():
+            self.datahandler.unload_db(self.connections.get())
+
+class ChallengeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+    def __init__(self, address, datahandler, pool_size=4):
+        self.datahandler = datahandler
+        self.pool = ConnectionPool(datahandler, pool_size)
+        super().__init__(address, RequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close()
+
+class RequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so clients don't pay for a new connection per request,
+    # without Nagle's algorithm holding back the body after the headers.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.__dispatch({"/languages": self.get_languages,
+                         "/sets": self.get_sets,
+                         "/challenges": self.get_challenges,
+                         "/pick": self.get_pick,
+                         "/search": self.get_search,
+                         "/stats": self.get_stats})
+
+    def do_POST(self):
+        self.__dispatch({"/challenges": self.post_challenge,
+                         "/accept": self.post_accept,
+                         "/exclude": self.post_exclude,
+                         "/finish": self.post_finish})
+
+    def __dispatch(self, routes):
+        url = urlsplit(self.path)
+        self.query = {key: values[-1] for (key, values)
+                      in parse_qs(url.query).items()}
+        try:
+            if url.path not in routes:
+                raise HttpError(404, f"No such endpoint {url.path}")
+            with self.server.pool.connection() as con:
+                (status, body) = (200, routes[url.path](con))
+        except HttpError as err:
+            (status, body) = (err.status, {"error": str(err)})
+        except (ValueError, InvalidChallengeError) as err:
+            (status, body) = (400, {"error": str(err)})
+        except sqlite3.Error as err:
+            # A DB still locked once begin_write gave up is worth retrying,
+            # anything else is an error of the server.
+            busy = "locked" in str(err) or "busy" in str(err)
+            (status, body) = (503 if busy else 500, {"error": str(err)})
+
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        if status == 503:
+            self.send_header("Retry-After", "1")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def __body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not isinstance(body, dict):
+            raise HttpError(400, "The request body must be a JSON object")
+        return body
+
+    def __int(self, params, name, default=None):
+        value = params.get(name, default)
+        return None if value is None else int(value)
+
+    def __set_id(self, con, name):
+        if name is None:
+            return None
+        set_id = self.server.datahandler.get_challenge_set_id(con, name)
+        if set_id is None:
+            raise HttpError(404, f"There is no challenge set called {name}")
+        return set_id
+
+    def get_languages(self, con):
+        return [lang[1] for lang
+                in self.server.datahandler.get_languages(con)]
+
+    def get_sets(self, con):
+        return [{"id": set_id, "name": name}
+                for (set_id, name)
+                in self.server.datahandler.get_challenge_sets(con)]
+
+    def __flag(self, name):
+        value = self.query.get(name)
+        if value not in (None, "true", "false"):
+            raise HttpError(400, f"{name} must be true or false")
+        return None if value is None else value == "true"
+
+    def get_challenges(self, con):
+        return [challenge_json(chall) for chall
+                in self.server.datahandler.query_challenges(
+                    con, set_id=self.__set_id(con, self.query.get("set")),
+                    started=self.__flag("started"),
+                    finished=self.__flag("finished"),
+                    limit=self.__int(self.query, "limit", 100),
+                    offset=self.__int(self.query, "offset", 0))]
+
+    def get_pick(self, con):
+        set_id = self.__set_id(con, self.query.get("set"))
+        seed = self.__int(self.query, "seed")
+        rng = random if seed is None else random.Random(seed)
+        pick = self.server.datahandler.get_sampler(con).sample(
+            rng, set_id, self.query.get("language"))
+        if pick is None:
+            raise HttpError(404, "There are no unstarted challenges "
+                                 "matching your languages")
+        return {"challenge": challenge_json(pick[0]), "language": pick[1],
+                "modifier": pick[2]}
+
+    def get_search(self, con):
+        if "q" not in self.query:
+            raise HttpError(400, "Missing the q parameter")
+        return [challenge_json(chall) for chall
+                in self.server.datahandler.search_challenges(
+                    con, self.query["q"], self.__int(self.query, "limit", 20))]
+
+    def get_stats(self, con):
+        datahandler = self.server.datahandler
+        days = self.__int(self.query, "days", 30)
+        (started, finished) = datahandler.get_activity(con, days)
+        return {"recent": {"days": days, "started": started,
+                           "finished": finished},
+                "languages": [dict(zip(("language", "started", "finished",
+                                        "total_days"), row))
+                              for row in datahandler.get_language_stats(con)],
+                "sets": [dict(zip(("set", "started", "finished",
+                                   "total_days"), row))
+                         for row in datahandler.get_set_stats(con)],
+                "durations": datahandler.get_duration_histogram(con)}
+
+    def post_challenge(self, con):
+        body = self.__body()
+        (desc, notes, langs) = parse_challenge(body, "The challenge")
+        set_id = self.__set_id(con, body.get("set", personal))
+        [chall_id] = self.server.datahandler.add_challenges(
+            con, set_id, [(desc, notes, langs)])
+        if chall_id is None:
+            raise HttpError(409, f"Challenge {desc} is already in the DB")
+        return {"id": chall_id}
+
+    def __chall_id(self, con, body):
+        """Return the id of the challenge given by id, or by set_id and
+        number for a challenge of a numbered set that was picked but has no
+        id yet."""
+        chall_id = self.__int(body, "id")
+        if chall_id is None:
+            if body.get("set_id") is None or body.get("number") is None:
+                raise HttpError(400, "Missing the id, or the set_id and "
+                                     "number, of the challenge")
+            chall_id = self.server.datahandler.materialise_challenge(
+                con, self.__int(body, "set_id"), self.__int(body, "number"))
+        return chall_id
+
+    def __modifier(self, body):
+        if not isinstance(body.get("modifier", ""), (str, type(None))):
+            raise HttpError(400, "The modifier must be a string")
+        return body.get("modifier")
+
+    def post_accept(self, con):
+        body = self.__body()
+        chall_id = self.__chall_id(con, body)
+        if not isinstance(body.get("language"), str):
+            raise HttpError(400, "Missing the language to accept it in")
+        accepted = self.server.datahandler.accept_challenge(
+            con, chall_id, body["language"], self.__modifier(body))
+        return {"id": chall_id, "accepted": accepted}
+
+    def post_exclude(self, con):
+        """Exclude a pair of the challenge, language and modifier given."""
+        body = self.__body()
+        chall_id = None
+        if "id" in body or "set_id" in body:
+            chall_id = self.__chall_id(con, body)
+        if not isinstance(body.get("language", ""), (str, type(None))):
+            raise HttpError(400, "The language must be a string")
+        added = self.server.datahandler.add_exclusion(
+            con, chall_id, body.get("language"), self.__modifier(body))
+        return {"id": chall_id, "added": added}
+
+    def post_finish(self, con):
+        chall_id = self.__int(self.__body(), "id")
+        if chall_id is None:
+            raise HttpError(400, "Missing the id of the challenge")
+        finished = self.server.datahandler.finish_challenge(con, chall_id)
+        return {"id": chall_id, "finished": finished}
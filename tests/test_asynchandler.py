@@ -0,0 +1,78 @@
+import asyncio
+import os
+import random
+import tempfile
+import unittest
+
+import context
+import challengeme.config as conf
+from challengeme.asynchandler import AsyncDataHandler
+
+DEFAULTS_DIR = os.path.join(os.path.dirname(__file__), "..", "defaults")
+
+class TestAsyncDataHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.test_dir.name, "test_db.db")
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_concurrent_coroutines(self):
+        async def run():
+            async with AsyncDataHandler(DEFAULTS_DIR, self.db_file) as handler:
+                datahandler = handler.datahandler
+                reads = []
+                get_challenges = datahandler.get_challenges
+                def counted(con):
+                    reads.append(con)
+                    return get_challenges(con)
+                datahandler.get_challenges = counted
+
+                await handler.add_language("Rust")
+                sets = dict((name, set_id) for (set_id, name)
+                            in await handler.get_challenge_sets())
+                personal = sets[conf.personal]
+
+                # Hundreds of reads at once are served by a few queries.
+                lists = await asyncio.gather(*(handler.get_challenges()
+                                               for _ in range(300)))
+                self.assertTrue(all(challs == lists[0] for challs in lists))
+                self.assertLess(len(reads), 10)
+
+                # Writes and reads interleave, and a read that starts after
+                # a write sees it.
+                async def add(i):
+                    chall_id = await handler.add_challenge(personal,
+                                                           f"Async {i}")
+                    challs = await handler.get_challenges()
+                    self.assertIn(chall_id, [chall.id for chall in challs])
+                    return chall_id
+                ids = await asyncio.gather(*(add(i) for i in range(200)))
+                self.assertEqual(len(set(ids)), 200)
+
+                # Only one of many concurrent accepts of a challenge wins.
+                accepted = await asyncio.gather(
+                    *(handler.accept_challenge(ids[0], "C")
+                      for _ in range(100)))
+                self.assertEqual(accepted.count(True), 1)
+                self.assertTrue(await handler.finish_challenge(ids[0]))
+
+                picks = await asyncio.gather(
+                    *(handler.pick(set_id=personal, language="Rust",
+                                   rng=random.Random(i))
+                      for i in range(200)))
+                for (chall, lang, modifier) in picks:
+                    self.assertEqual(lang, "Rust")
+                    self.assertNotEqual(chall.id, ids[0])
+
+                finished = await handler.query_challenges(finished=True)
+                self.assertEqual([chall.id for chall in finished], [ids[0]])
+            return handler
+
+        handler = asyncio.run(run())
+        self.assertEqual(handler.connections, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+import context
+from challengeme.challenges import (Challenge, LANGUAGE_SEPARATOR,
+                                    nth_unmaterialised)
+
+class TestChallenge(unittest.TestCase):
+
+    def test_language_constraints(self):
+        chall = Challenge(1, 1, "Desc", "", f"C{LANGUAGE_SEPARATOR}Rust",
+                          None, None, None)
+        self.assertEqual(chall.language_constraints, ["C", "Rust"])
+        self.assertIs(chall.language_constraints, chall.language_constraints)
+
+        chall = Challenge(1, 1, "Desc", "", None, None, None, None)
+        self.assertEqual(chall.language_constraints, [])
+        chall.language_constraints = ["COBOL"]
+        self.assertEqual(chall.language_constraints, ["COBOL"])
+
+        self.assertFalse(hasattr(chall, "__dict__"))
+
+    def test_nth_unmaterialised(self):
+        materialised = [0, 2, 3, 7]
+        free = [i for i in range(20) if i not in materialised]
+        self.assertEqual([nth_unmaterialised(materialised, n)
+                          for n in range(10)], free[:10])
+
+if __name__ == "__main__":
+    unittest.main()
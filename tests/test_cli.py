@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import context
+from challengeme.cli import build_parser
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+class TestCli(unittest.TestCase):
+
+    def test_handlers_are_named(self):
+        args = build_parser().parse_args(["pick-challenge", "--seed", "3"])
+        self.assertEqual(args.func,
+                         "challengeme.handlers.commandhandler:pick_challenge")
+        self.assertEqual(args.seed, 3)
+
+    def test_user_options(self):
+        # --profile still means profiling next to --profile-user.
+        args = build_parser().parse_args(["--profile", "--profile-user",
+                                          "alice", "stats"])
+        self.assertTrue(args.profile)
+        self.assertEqual(args.profile_user, "alice")
+        self.assertIsNone(args.db)
+
+    def test_lazy_imports(self):
+        # Only the commands that need these modules should import them.
+        code = ("import sys, challengeme.cli, "
+                "challengeme.handlers.commandhandler; "
+                "print(' '.join(m for m in ('json', 'random', 'pathlib', "
+                "'hashlib') if m in sys.modules))")
+        proc = subprocess.run([sys.executable, "-S", "-c", code], cwd=ROOT,
+                              capture_output=True, text=True, check=True)
+        self.assertEqual(proc.stdout.strip(), "")
+
+    def test_decline_with_stdin_closed(self):
+        # Declining a pick and then closing stdin leaves nothing excluded.
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.symlink(os.path.join(ROOT, "defaults"),
+                       os.path.join(tmp_dir, "defaults"))
+            main = os.path.join(ROOT, "main.py")
+            subprocess.run([sys.executable, main, "add-language", "C"],
+                           cwd=tmp_dir, capture_output=True, check=True)
+            proc = subprocess.run([sys.executable, main, "pick-challenge",
+                                   "--seed", "0"], input="n\n", cwd=tmp_dir,
+                                  capture_output=True, text=True)
+            self.assertEqual(proc.returncode, 0, proc.stderr)
+            self.assertIn("Exclude any of these?", proc.stdout)
+            self.assertNotIn("You will not be offered", proc.stdout)
+
+    def test_finished_challenge_is_not_active(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.symlink(os.path.join(ROOT, "defaults"),
+                       os.path.join(tmp_dir, "defaults"))
+            main = os.path.join(ROOT, "main.py")
+
+            def run(*args, stdin=""):
+                return subprocess.run([sys.executable, main, *args],
+                                      input=stdin, cwd=tmp_dir,
+                                      capture_output=True, text=True,
+                                      check=True).stdout
+
+            run("add-language", "C")
+            run("pick-challenge", "--seed", "0", stdin="y\n")
+            self.assertIn("Started:", run("active-challenges"))
+            run("set-finished", stdin="0\ny\n")
+            self.assertNotIn("Started:", run("active-challenges"))
+            self.assertIn("You have no active challenges",
+                          run("set-finished"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import unittest
+
+import context
+import challengeme.config as conf
+from challengeme.handlers.datahandler import DataHandler
+
+WORKERS = 8
+PICKS = 12
+
+def worker(db_file, seed):
+    """Pick, accept and finish challenges like a CLI user would, each step
+    on a fresh connection. Returns the ids this worker accepted and
+    finished."""
+    rng = random.Random(seed)
+    handler = DataHandler(os.path.dirname(db_file), db_file)
+    accepted = []
+    finished = []
+    for _ in range(PICKS):
+        con = handler.load_db()
+        pick = handler.get_sampler(con).sample(rng)
+        if pick is not None:
+            (chall, lang, modifier) = pick
+            if chall.id is None:
+                chall.id = handler.materialise_challenge(con, chall.set_id,
+                                                         chall.number)
+            if handler.accept_challenge(con, chall.id, lang, modifier):
+                accepted.append(chall.id)
+        handler.unload_db(con)
+
+        if len(accepted) > 0 and rng.random() < 0.5:
+            chall_id = rng.choice(accepted)
+            con = handler.load_db()
+            if handler.finish_challenge(con, chall_id):
+                finished.append(chall_id)
+            handler.unload_db(con)
+    return accepted, finished
+
+class TestConcurrency(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_parallel_picks(self):
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler(self.test_dir.name, db_file)
+        con = handler.load_db()
+        handler.add_language(con, "C")
+        handler.add_language(con, "Rust")
+        set_id = handler.get_challenge_set_id(con, conf.personal)
+        handler.add_challenges(con, set_id, ((f"Challenge {i}", "", [])
+                                             for i in range(40)))
+        cur = con.cursor()
+        cur.execute("INSERT INTO challenge_sets(name) VALUES('Numbered');")
+        cur.execute("""INSERT INTO virtual_sets(set_id, num_challenges)
+                       VALUES(?, 20);""", (cur.lastrowid,))
+        handler.unload_db(con)
+
+        # Fewer challenges than picks, so the workers collide.
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(WORKERS) as pool:
+            results = pool.starmap(worker, [(db_file, seed)
+                                            for seed in range(WORKERS)])
+
+        # No challenge was accepted or finished twice.
+        accepted = [chall_id for (ids, _) in results for chall_id in ids]
+        finished = [chall_id for (_, ids) in results for chall_id in ids]
+        self.assertEqual(len(accepted), len(set(accepted)))
+        self.assertEqual(len(finished), len(set(finished)))
+        self.assertGreater(len(accepted), 0)
+
+        con = handler.load_db()
+        cur = con.cursor()
+        cur.execute("""SELECT COUNT(*), COUNT(date_finished) FROM challenges
+                       WHERE date_started IS NOT NULL;""")
+        self.assertEqual(cur.fetchone(), (len(accepted), len(finished)))
+
+        # The trigger-maintained stats saw every update.
+        cur.execute("SELECT SUM(started), SUM(finished) FROM stats_languages;")
+        self.assertEqual(cur.fetchone(), (len(accepted), len(finished)))
+        handler.unload_db(con)
+
+if __name__ == "__main__":
+    unittest.main()
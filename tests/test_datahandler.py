@@ -1,3 +1,5 @@
+import io
+import json
 import os
 import tempfile
 import sqlite3
@@ -5,8 +7,13 @@ import unittest
 
 import context
 import challengeme.config as conf
+from challengeme.handlers.commandhandler import read_snapshot, write_snapshot
 from challengeme.handlers.datahandler import DataHandler
-from challengeme.exceptions import CorruptDatabaseError
+from challengeme.handlers.schema import DEFAULT_REVISIT_DAYS, SCHEMA_VERSION
+from challengeme.exceptions import (CorruptDatabaseError, InvalidChallengeError,
+                                    InvalidSnapshotError)
+
+DEFAULTS_DIR = os.path.join(os.path.dirname(__file__), "..", "defaults")
 
 class TestDataHandler(unittest.TestCase):
 
@@ -37,7 +44,31 @@ class TestDataHandler(unittest.TestCase):
         self.assertEqual(set(rows),
                          {('challenge_sets',),
                           ('challenges',),
-                          ('languages',)})
+                          ('languages',),
+                          ('virtual_sets',),
+                          ('virtual_challenges',),
+                          ('challenge_languages',),
+                          ('defaults_manifest',),
+                          ('stats_languages',),
+                          ('stats_sets',),
+                          ('stats_durations',),
+                          ('stats_days',),
+                          ('challenges_fts',),
+                          ('challenges_fts_config',),
+                          ('challenges_fts_data',),
+                          ('challenges_fts_docsize',),
+                          ('challenges_fts_idx',),
+                          ('modifiers',),
+                          ('modifier_languages',),
+                          ('excluded_challenge_languages',),
+                          ('excluded_challenge_modifiers',),
+                          ('excluded_language_modifiers',),
+                          ('revisit_intervals',),
+                          ('revisits',),
+                          ('pick_challenges',),
+                          ('pick_pairs',),
+                          ('pick_modifiers',),
+                          ('pick_fallbacks',)})
 
         cur.execute('SELECT * FROM challenge_sets LIMIT 0;')
         challset_cols = [desc[0] for desc in cur.description]
@@ -46,12 +77,15 @@ class TestDataHandler(unittest.TestCase):
         cur.execute('SELECT * FROM languages LIMIT 0;')
         language_cols = [desc[0] for desc in cur.description]
 
-        self.assertEqual(challset_cols, ['id', 'name'])
+        self.assertEqual(challset_cols, ['id', 'name', 'modifiers_enabled'])
         self.assertEqual(chall_cols,
                          ['id', 'set_id', 'description', 'notes',
                           'language_constraints', 'date_started',
-                          'date_finished', 'language_used'])
-        self.assertEqual(language_cols, ['id', 'name'])
+                          'date_finished', 'language_used',
+                          'modifier_used'])
+        self.assertEqual(language_cols, ['id', 'name', 'saved'])
+        cur.execute('PRAGMA user_version;')
+        self.assertEqual(cur.fetchone()[0], SCHEMA_VERSION)
 
         handler.unload_db(con)
 
@@ -76,7 +110,15 @@ class TestDataHandler(unittest.TestCase):
             fp.truncate()
 
         # See if an exception is raised after truncating
-        handler.load_db()
+        con = handler.load_db()
+        handler.unload_db(con)
+
+        # A DB from a newer version can't be used.
+        con = sqlite3.connect(db_file)
+        con.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1};")
+        con.close()
+        with self.assertRaises(CorruptDatabaseError):
+            handler.load_db()
 
     def test_add_challenge(self):
         db_file = os.path.join(self.test_dir.name, "test_db.db")
@@ -97,5 +139,742 @@ class TestDataHandler(unittest.TestCase):
 
         handler.unload_db(con)
 
+    def test_load_defaults(self):
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler(DEFAULTS_DIR, db_file)
+        con = handler.load_db()
+
+        set_id = handler.get_challenge_set_id(con, "Project Euler")
+        self.assertIsNotNone(set_id)
+        euler = [chall for chall in handler.get_challenges(con)
+                 if chall.set_id == set_id]
+        self.assertEqual(len(euler), 765)
+        self.assertIsNotNone(handler.get_challenge_id(con, "Telnet"))
+
+        # Numbered sets don't get a row per challenge.
+        cur = con.cursor()
+        cur.execute("SELECT COUNT(*) FROM challenges WHERE set_id = ?;",
+                    (set_id,))
+        self.assertEqual(cur.fetchone()[0], 0)
+
+        handler.unload_db(con)
+
+    def test_virtual_challenges(self):
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler(DEFAULTS_DIR, db_file)
+        con = handler.load_db()
+        set_id = handler.get_challenge_set_id(con, "Project Euler")
+
+        chall_id = handler.materialise_challenge(con, set_id, 42)
+        self.assertEqual(handler.materialise_challenge(con, set_id, 42),
+                         chall_id)
+        with self.assertRaises(ValueError):
+            handler.materialise_challenge(con, set_id, 765)
+        handler.accept_challenge(con, chall_id, "C")
+
+        euler = [chall for chall in handler.get_challenges(con)
+                 if chall.set_id == set_id]
+        self.assertEqual(len(euler), 765)
+        started = [chall for chall in euler if chall.date_started is not None]
+        self.assertEqual(len(started), 1)
+        self.assertEqual(started[0].id, chall_id)
+        self.assertEqual(started[0].description,
+                         "Project Euler challenge 42")
+
+        handler.unload_db(con)
+
+    def test_import_challenges(self):
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler('../challengeme/defaults/', db_file)
+        con = handler.load_db()
+        set_id = handler.get_challenge_set_id(con, conf.personal)
+
+        handler.add_challenge(con, set_id, "Already there")
+        skipped = handler.import_challenges(con, set_id, [
+            {"description": "First", "notes": "",
+             "languageConstraints": ["C"]},
+            {"description": "Already there", "notes": ""},
+            {"description": "Second"},
+            {"description": "First", "notes": "again"},
+        ])
+        self.assertEqual(sorted(skipped), ["Already there", "First"])
+        self.assertIsNotNone(handler.get_challenge_id(con, "First"))
+        self.assertIsNotNone(handler.get_challenge_id(con, "Second"))
+
+        # Nothing is written if any challenge in the list is invalid.
+        with self.assertRaises(InvalidChallengeError):
+            handler.import_challenges(con, set_id, [
+                {"description": "Third"},
+                {"notes": "no description"},
+            ])
+        self.assertIsNone(handler.get_challenge_id(con, "Third"))
+
+        handler.unload_db(con)
+
+    def test_batch_methods(self):
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler('../challengeme/defaults/', db_file)
+        con = handler.load_db()
+        set_id = handler.get_challenge_set_id(con, conf.personal)
+
+        # A generator bigger than a chunk, with a duplicate in it.
+        rows = ((f"Batch {i}", "", ["C"] if i % 2 else [])
+                for i in list(range(1200)) + [3])
+        ids = handler.add_challenges(con, set_id, rows)
+        self.assertEqual(len(ids), 1201)
+        self.assertIsNone(ids[-1])
+        self.assertEqual(ids[3], handler.get_challenge_id(con, "Batch 3"))
+        self.assertEqual(handler.count_challenges(con, set_id), 1200)
+        constrained = handler.query_challenges(con, set_id=set_id,
+                                               allowed_language="Rust")
+        self.assertEqual(len(constrained), 600)
+
+        self.assertEqual(handler.accept_challenges(
+            con, [(ids[0], "C"), (ids[1], "Rust"), (ids[0], "C"), (-1, "C")]),
+            [True, True, False, False])
+        self.assertEqual(handler.finish_challenges(con, [ids[0], ids[2]]),
+                         [True, False])
+        self.assertEqual(handler.delete_challenges(con, [ids[2], ids[2], -1]),
+                         [True, False, False])
+        self.assertIsNone(handler.get_challenge_id(con, "Batch 2"))
+
+        # Only challenges in the given set are deleted.
+        self.assertEqual(handler.delete_challenges(con, [ids[4]], set_id + 1),
+                         [False])
+
+        # A failing batch leaves the DB untouched.
+        def failing_rows():
+            yield ("Never added", "", [])
+            raise InvalidChallengeError("Line 2 has no description")
+        with self.assertRaises(InvalidChallengeError):
+            handler.add_challenges(con, set_id, failing_rows())
+        self.assertIsNone(handler.get_challenge_id(con, "Never added"))
+
+        handler.unload_db(con)
+
+    def test_query_challenges(self):
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler(DEFAULTS_DIR, db_file)
+        con = handler.load_db()
+        euler_id = handler.get_challenge_set_id(con, "Project Euler")
+        personal_id = handler.get_challenge_set_id(con, conf.personal)
+
+        first = handler.add_challenge(con, personal_id, "First")
+        second = handler.add_challenge(con, personal_id, "Second")
+        handler.accept_challenge(con, second, "C")
+        handler.finish_challenge(con, second)
+        euler_7 = handler.materialise_challenge(con, euler_id, 7)
+        handler.accept_challenge(con, euler_7, "Rust")
+
+        started = handler.query_challenges(con, started=True)
+        self.assertEqual([chall.id for chall in started], [second, euler_7])
+        finished = handler.query_challenges(con, finished=True)
+        self.assertEqual([chall.id for chall in finished], [second])
+        rust = handler.query_challenges(con, language_used="Rust")
+        self.assertEqual([chall.id for chall in rust], [euler_7])
+        personal = handler.query_challenges(con, set_id=personal_id,
+                                            order_by="description",
+                                            descending=True)
+        self.assertEqual([chall.id for chall in personal], [second, first])
+
+        # Unstarted numbered challenges are paged after the real rows.
+        euler = handler.query_challenges(con, set_id=euler_id, started=False,
+                                         limit=3, offset=6)
+        self.assertEqual([chall.number for chall in euler], [6, 8, 9])
+        self.assertEqual(len(handler.query_challenges(con, set_id=euler_id)),
+                         765)
+
+        with self.assertRaises(ValueError):
+            handler.query_challenges(con, order_by="notes; DROP TABLE x")
+
+        cur = con.cursor()
+        cur.execute("""SELECT name FROM sqlite_master
+                       WHERE type = 'index' AND tbl_name = 'challenges'
+                       AND name NOT LIKE 'sqlite_%';""")
+        self.assertEqual(set(cur.fetchall()),
+                         {('challenges_set_id',),
+                          ('challenges_unstarted',),
+                          ('challenges_date_started',),
+                          ('challenges_date_finished',),
+                          ('challenges_language_used',)})
+
+        handler.unload_db(con)
+
+    def test_language_constraints(self):
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler('../challengeme/defaults/', db_file)
+        con = handler.load_db()
+        set_id = handler.get_challenge_set_id(con, conf.personal)
+
+        handler.add_language(con, "Rust")
+        anything = handler.add_challenge(con, set_id, "Anything")
+        rusty = handler.add_challenge(con, set_id, "Rusty",
+                                      langs=["Rust", "C, but old"])
+        handler.add_challenge(con, set_id, "Not rusty", langs=["C, but old"])
+
+        challs = {chall.id: chall for chall in handler.get_challenges(con)}
+        self.assertEqual(sorted(challs[rusty].language_constraints),
+                         ["C, but old", "Rust"])
+        self.assertEqual(challs[anything].language_constraints, [])
+
+        # Languages only named in constraints aren't saved languages.
+        self.assertEqual([lang[1] for lang in handler.get_languages(con)],
+                         ["Rust"])
+        self.assertIsNone(handler.get_language_id(con, "C, but old"))
+        handler.add_language(con, "C, but old")
+        self.assertEqual(len(handler.get_languages(con)), 2)
+
+        rust = handler.query_challenges(con, started=False,
+                                        allowed_language="Rust")
+        self.assertEqual([chall.id for chall in rust], [anything, rusty])
+
+        handler.unload_db(con)
+
+    def test_migrate_language_constraints(self):
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+
+        # The original schema, with comma-separated constraints.
+        con = sqlite3.connect(db_file)
+        con.executescript("""
+            CREATE TABLE challenge_sets (id integer PRIMARY KEY,
+                                         name text NOT NULL);
+            CREATE TABLE languages (id integer PRIMARY KEY,
+                                    name text NOT NULL);
+            CREATE TABLE challenges (id integer PRIMARY KEY,
+                                     set_id integer NOT NULL,
+                                     description text NOT NULL UNIQUE,
+                                     notes text,
+                                     language_constraints text,
+                                     date_started text,
+                                     date_finished text,
+                                     language_used integer);
+            INSERT INTO challenge_sets(name) VALUES('Self-added challenges');
+            INSERT INTO languages(name) VALUES('C');
+            INSERT INTO challenges(set_id, description, notes,
+                                   language_constraints)
+            VALUES(1, 'Old', '', 'C,Haskell'), (1, 'Free', '', '');
+        """)
+        con.close()
+
+        handler = DataHandler('../challengeme/defaults/', db_file)
+        con = handler.load_db()
+        self.assertTrue(handler.is_db_valid(con))
+        challs = {chall.description: chall
+                  for chall in handler.get_challenges(con)}
+        self.assertEqual(sorted(challs["Old"].language_constraints),
+                         ["C", "Haskell"])
+        self.assertEqual(challs["Free"].language_constraints, [])
+        self.assertEqual([lang[1] for lang in handler.get_languages(con)],
+                         ["C"])
+        handler.unload_db(con)
+
+    def test_rescan_defaults(self):
+        defaults_dir = os.path.join(self.test_dir.name, "defaults")
+        os.mkdir(defaults_dir)
+        set_file = os.path.join(defaults_dir, "set.json")
+        numbered_file = os.path.join(defaults_dir, "numbered.json")
+
+        def write_set(path, data):
+            with open(path, "w", encoding="utf8") as fp:
+                json.dump(data, fp)
+
+        write_set(set_file, {"name": "Set", "challenges": [
+            {"description": "Kept", "notes": ""},
+            {"description": "Started", "notes": ""},
+            {"description": "Removed", "notes": ""}]})
+        write_set(numbered_file, {"name": "Numbered", "num-challenges": 10})
+
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler(defaults_dir, db_file)
+        con = handler.load_db()
+        self.assertEqual(handler.rescan_defaults(con), [])
+
+        started = handler.get_challenge_id(con, "Started")
+        handler.accept_challenge(con, started, "C")
+        numbered_id = handler.get_challenge_set_id(con, "Numbered")
+        handler.accept_challenge(
+            con, handler.materialise_challenge(con, numbered_id, 3), "C")
+
+        write_set(set_file, {"name": "Set", "challenges": [
+            {"description": "Kept", "notes": "new notes",
+             "languageConstraints": ["C"]},
+            {"description": "Added", "notes": ""}]})
+        write_set(os.path.join(defaults_dir, "new.json"),
+                  {"name": "New", "challenges": [{"description": "Fresh"}]})
+        write_set(os.path.join(defaults_dir, "duplicate.json"),
+                  {"name": "Set", "challenges": [{"description": "Dup"}]})
+        # Same size and modification time, so it is skipped unread.
+        stat = os.stat(numbered_file)
+        write_set(numbered_file, {"name": "Numbered", "num-challenges": 99})
+        os.utime(numbered_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        self.assertEqual(sorted(handler.rescan_defaults(con)),
+                         ["new.json", "set.json"])
+        self.assertEqual(handler.rescan_defaults(con), [])
+
+        challs = {chall.description: chall
+                  for chall in handler.get_challenges(con)}
+        self.assertEqual(challs["Kept"].notes, "new notes")
+        self.assertEqual(challs["Kept"].language_constraints, ["C"])
+        self.assertIn("Added", challs)
+        self.assertIn("Fresh", challs)
+        self.assertNotIn("Removed", challs)
+        self.assertNotIn("Dup", challs)
+        self.assertEqual(challs["Started"].id, started)
+        self.assertEqual(challs["Started"].language_used, "C")
+        self.assertEqual(len(handler.query_challenges(con,
+                                                      set_id=numbered_id)),
+                         10)
+
+        # A real change to the numbered set keeps its started challenge.
+        write_set(numbered_file, {"name": "Numbered", "num-challenges": 5})
+        self.assertEqual(handler.rescan_defaults(con), ["numbered.json"])
+        numbered = handler.query_challenges(con, set_id=numbered_id)
+        self.assertEqual(len(numbered), 5)
+        self.assertEqual(numbered[0].description, "Numbered challenge 3")
+        self.assertIsNotNone(numbered[0].date_started)
+
+        handler.unload_db(con)
+
+    def test_modifiers(self):
+        defaults_dir = os.path.join(self.test_dir.name, "defaults")
+        os.mkdir(defaults_dir)
+        modifiers_file = os.path.join(defaults_dir, "modifiers.json")
+
+        def write_json(path, data):
+            with open(path, "w", encoding="utf8") as fp:
+                json.dump(data, fp)
+
+        write_json(os.path.join(defaults_dir, "set.json"), {
+            "name": "No modifiers", "allowModifiers": False,
+            "challenges": [{"description": "Plain"}]})
+        write_json(modifiers_file, {"modifiers": [
+            {"description": "Nice UI"},
+            {"description": "OpenCL", "languageConstraints": ["C"]}]})
+
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler(defaults_dir, db_file)
+        con = handler.load_db()
+        self.assertEqual(handler.get_modifiers(con),
+                         [("Nice UI", []), ("OpenCL", ["C"])])
+        self.assertEqual(handler.get_sets_without_modifiers(con),
+                         [handler.get_challenge_set_id(con, "No modifiers")])
+        # Languages that only constrain modifiers aren't saved.
+        self.assertEqual(handler.get_languages(con), [])
+
+        handler.add_language(con, "C")
+        plain = handler.get_challenge_id(con, "Plain")
+        self.assertIsNone(handler.get_sampler(con).sample()[2])
+        handler.accept_challenge(con, plain, "C", "Nice UI")
+        self.assertEqual(handler.query_challenges(con, started=True)[0]
+                         .modifier_used, "Nice UI")
+
+        write_json(modifiers_file, {"modifiers": [
+            {"description": "OpenCL", "languageConstraints": ["C", "Rust"]},
+            {"description": "OpenBSD"}]})
+        self.assertEqual(handler.rescan_defaults(con), ["modifiers.json"])
+        self.assertEqual(handler.get_modifiers(con),
+                         [("OpenCL", ["C", "Rust"]), ("OpenBSD", [])])
+
+        handler.unload_db(con)
+
+    def test_exclusions(self):
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler(DEFAULTS_DIR, db_file)
+        con = handler.load_db()
+        handler.add_language(con, "C")
+        handler.add_language(con, "Rust")
+        euler_id = handler.get_challenge_set_id(con, "Project Euler")
+        [modifier, other] = [desc for (desc, langs)
+                             in handler.get_modifiers(con)][:2]
+
+        # Declining a numbered challenge gives it a row to hang the
+        # exclusion on, which survives a rescan of its set.
+        chall_id = handler.materialise_challenge(con, euler_id, 7)
+        self.assertTrue(handler.add_exclusion(con, chall_id, language="C"))
+        self.assertFalse(handler.add_exclusion(con, chall_id, language="C"))
+        handler.add_exclusion(con, language="Rust", modifier=modifier)
+        telnet = handler.get_challenge_id(con, "Telnet")
+        handler.add_exclusion(con, telnet, modifier=other)
+        with self.assertRaises(ValueError):
+            handler.add_exclusion(con, telnet, "C", modifier)
+        with self.assertRaises(ValueError):
+            handler.add_exclusion(con, telnet, modifier="No such modifier")
+
+        con.execute("DELETE FROM defaults_manifest;")
+        handler.rescan_defaults(con)
+        self.assertEqual(handler.get_materialised_numbers(con, euler_id),
+                         [7])
+        self.assertEqual(handler.get_exclusions(con),
+                         ({chall_id: {"C"}}, {telnet: {other}},
+                          {"Rust": {modifier}}))
+
+        sampler = handler.get_sampler(con)
+        for _ in range(200):
+            (chall, lang, mod) = sampler.sample(set_id=euler_id)
+            self.assertFalse(chall.id == chall_id and lang == "C")
+            self.assertFalse(lang == "Rust" and mod == modifier)
+
+        handler.del_challenge(con, telnet)
+        self.assertEqual(handler.get_exclusions(con)[1], {})
+        handler.unload_db(con)
+
+    def test_revisits(self):
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler(DEFAULTS_DIR, db_file)
+        con = handler.load_db()
+        handler.add_language(con, "C")
+        personal = handler.get_challenge_set_id(con, conf.personal)
+        ids = [handler.add_challenge(con, personal, f"Revisit {i}")
+               for i in range(3)]
+        handler.accept_challenges(con, [(ids[0], "C"), (ids[1], "C"),
+                                        (ids[2], "Rust")])
+        handler.finish_challenges(con, ids)
+        cur = con.cursor()
+        cur.execute("""SELECT CAST(julianday('now', 'localtime') - 2440587.5
+                                   AS integer);""")
+        today = cur.fetchone()[0]
+
+        # Nothing is due until the default interval has passed.
+        self.assertEqual(handler.get_due_revisits(con), [])
+        later = today + DEFAULT_REVISIT_DAYS
+        self.assertEqual([chall.id for (chall, due)
+                          in handler.get_due_revisits(con, later)], ids)
+
+        # A set's interval wins over a language's, and changing either
+        # reschedules the waiting challenges.
+        handler.set_revisit_interval(con, 0, language="C")
+        self.assertEqual([chall.id for (chall, due)
+                          in handler.get_due_revisits(con)], ids[:2])
+        handler.set_revisit_interval(con, 7, set_id=personal)
+        self.assertEqual(handler.get_due_revisits(con), [])
+        self.assertEqual(handler.get_revisit_intervals(con),
+                         [(None, "C", 0), (conf.personal, None, 7)])
+        handler.set_revisit_interval(con, None, set_id=personal)
+        [(chall, due)] = handler.get_due_revisits(con, limit=1)
+        self.assertEqual(chall.id, ids[0])
+        self.assertEqual(handler.get_due_revisits(con, language="Rust"), [])
+        with self.assertRaises(ValueError):
+            handler.set_revisit_interval(con, 1)
+
+        self.assertTrue(handler.complete_revisit(con, ids[0]))
+        self.assertFalse(handler.complete_revisit(con, ids[0]))
+        handler.del_challenge(con, ids[1])
+        self.assertEqual(handler.get_due_revisits(con), [])
+
+        # The due challenges are found through the index.
+        cur.execute("""EXPLAIN QUERY PLAN
+                       SELECT challenge_id FROM revisits WHERE due <= ?
+                       ORDER BY due;""", (today,))
+        self.assertIn("USING COVERING INDEX revisits_due",
+                      " ".join(row[-1] for row in cur.fetchall()))
+        cur.close()
+        handler.unload_db(con)
+
+    def test_snapshot(self):
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler(DEFAULTS_DIR, db_file)
+        con = handler.load_db()
+        handler.add_language(con, "C")
+        euler_id = handler.get_challenge_set_id(con, "Project Euler")
+        chall_id = handler.materialise_challenge(con, euler_id, 3)
+        handler.accept_challenge(con, chall_id, "C")
+        handler.finish_challenge(con, chall_id)
+        handler.add_exclusion(con, handler.get_challenge_id(con, "Telnet"),
+                              language="C")
+
+        snapshot = io.StringIO()
+        write_snapshot(handler, con, snapshot)
+        backup_file = os.path.join(self.test_dir.name, "backup.db")
+        handler.backup_db(con, backup_file, pages=4)
+
+        # Both copies load into DBs that hold the same data.
+        copy = DataHandler(DEFAULTS_DIR,
+                           os.path.join(self.test_dir.name, "copy.db"))
+        copy_con = copy.load_db()
+        snapshot.seek(0)
+        copy.import_snapshot(copy_con, *read_snapshot(snapshot))
+        backup = DataHandler(DEFAULTS_DIR, backup_file)
+        backup_con = backup.load_db()
+        for (other, other_con) in ((copy, copy_con), (backup, backup_con)):
+            self.assertEqual(
+                [(c.description, c.date_finished, c.language_used)
+                 for c in other.get_challenges(other_con)],
+                [(c.description, c.date_finished, c.language_used)
+                 for c in handler.get_challenges(con)])
+            self.assertEqual(other.get_exclusions(other_con),
+                             handler.get_exclusions(con))
+            self.assertEqual(other.get_language_stats(other_con),
+                             handler.get_language_stats(con))
+            self.assertEqual(
+                [due for (chall, due) in other.get_due_revisits(other_con,
+                                                                 1 << 20)],
+                [due for (chall, due) in handler.get_due_revisits(con,
+                                                                  1 << 20)])
+            self.assertEqual(other.search_challenges(other_con, "telnet")[0]
+                             .description, "Telnet")
+
+        # A broken snapshot leaves the DB as it was.
+        lines = snapshot.getvalue().splitlines(keepends=True)
+        with self.assertRaises(InvalidSnapshotError):
+            copy.import_snapshot(copy_con, *read_snapshot(lines[:-1]
+                                                          + ["[1, 2]\n"]))
+        with self.assertRaises(InvalidSnapshotError):
+            read_snapshot(lines[1:])
+        self.assertEqual(len(copy.get_challenges(copy_con)),
+                         len(handler.get_challenges(con)))
+
+        for (other, other_con) in ((handler, con), (copy, copy_con),
+                                   (backup, backup_con)):
+            other.unload_db(other_con)
+
+    def test_catalogue(self):
+        defaults_dir = os.path.join(self.test_dir.name, "defaults")
+        os.mkdir(defaults_dir)
+        with open(os.path.join(defaults_dir, "set.json"), "w") as fp:
+            json.dump({"name": "Set", "challenges": [
+                {"description": f"Challenge {i}", "notes": "",
+                 "languageConstraints": ["Rust"] if i % 3 == 0 else []}
+                for i in range(300)]}, fp)
+        with open(os.path.join(defaults_dir, "numbered.json"), "w") as fp:
+            json.dump({"name": "Numbered", "num-challenges": 50}, fp)
+
+        def build_catalogue(path):
+            handler = DataHandler(defaults_dir, path)
+            con = handler.load_db()
+            handler.seal_catalogue(con)
+            handler.unload_db(con)
+
+        catalogue = os.path.join(self.test_dir.name, "catalogue.db")
+        build_catalogue(catalogue)
+        standalone = DataHandler(defaults_dir,
+                                 os.path.join(self.test_dir.name, "own.db"))
+        own_con = standalone.load_db()
+        handler = DataHandler(defaults_dir,
+                              os.path.join(self.test_dir.name, "user.db"),
+                              catalogue)
+        con = handler.load_db()
+
+        # The user's DB lists the same challenges without holding them.
+        def descs(challs):
+            return sorted(chall.description for chall in challs)
+        self.assertEqual(descs(handler.get_challenges(con)),
+                         descs(standalone.get_challenges(own_con)))
+        self.assertEqual(
+            descs(handler.query_challenges(con, allowed_language="C")),
+            descs(standalone.query_challenges(own_con, allowed_language="C")))
+        self.assertEqual(con.execute("SELECT COUNT(*) FROM main.challenges;")
+                         .fetchone()[0], 0)
+        pages = [chall.description
+                 for offset in range(0, 400, 70)
+                 for chall in handler.iter_challenges(con, limit=70,
+                                                      offset=offset)]
+        self.assertEqual(pages, [chall.description for chall
+                                 in handler.get_challenges(con)])
+
+        # Picking one gives it a row in the user's DB, which takes its place.
+        handler.add_language(con, "C")
+        set_id = handler.get_challenge_set_id(con, "Set")
+        (chall, lang, modifier) = handler.get_sampler(con).sample(
+            set_id=set_id)
+        self.assertIsNone(chall.id)
+        chall_id = handler.materialise_challenge(con, set_id, chall.number)
+        self.assertEqual(handler.materialise_challenge(con, set_id,
+                                                       chall.number), chall_id)
+        handler.accept_challenge(con, chall_id, lang)
+        self.assertEqual(handler.count_challenges(con),
+                         standalone.count_challenges(own_con))
+        self.assertEqual([c.description for c
+                          in handler.query_challenges(con, started=True)],
+                         [chall.description])
+        self.assertEqual(handler.search_challenges(con, "Challenge 7")[0]
+                         .description, "Challenge 7")
+
+        # A new version of the catalogue is picked up when it is moved in.
+        with open(os.path.join(defaults_dir, "new.json"), "w") as fp:
+            json.dump({"name": "New",
+                       "challenges": [{"description": "Fresh"}]}, fp)
+        build_catalogue(catalogue + ".new")
+        os.replace(catalogue + ".new", catalogue)
+        handler.unload_db(con)
+        con = handler.load_db()
+        self.assertIsNotNone(handler.get_challenge_set_id(con, "New"))
+        self.assertIn("Fresh", descs(handler.get_challenges(con)))
+        self.assertEqual(handler.rescan_defaults(con), [])
+        handler.unload_db(con)
+
+        # A DB with sets of its own can't switch to a catalogue.
+        standalone.unload_db(own_con)
+        with self.assertRaises(CorruptDatabaseError):
+            DataHandler(defaults_dir, standalone.dbfile, catalogue).load_db()
+
+    def test_iter_challenges(self):
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler(DEFAULTS_DIR, db_file)
+        con = handler.load_db()
+        euler_id = handler.get_challenge_set_id(con, "Project Euler")
+        handler.materialise_challenge(con, euler_id, 0)
+
+        challenges = handler.iter_challenges(con, batch_size=10)
+        first = next(challenges)
+        self.assertEqual(first.description, "Download manager")
+        self.assertEqual(len(list(challenges)) + 1,
+                         handler.count_challenges(con))
+        self.assertEqual(handler.count_challenges(con, euler_id), 765)
+
+        page = list(handler.iter_challenges(con, set_id=euler_id,
+                                            limit=2, offset=1, batch_size=1))
+        self.assertEqual([chall.number for chall in page], [1, 2])
+
+        handler.unload_db(con)
+
+    def test_read_cache(self):
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler(DEFAULTS_DIR, db_file)
+        con = handler.load_db()
+        statements = []
+        con.set_trace_callback(statements.append)
+
+        challenges = handler.get_challenges(con)
+        statements.clear()
+        self.assertEqual(handler.get_challenges(con), challenges)
+        self.assertEqual(statements, ["PRAGMA data_version;"])
+
+        # Writes through the handler are seen straight away...
+        set_id = handler.get_challenge_set_id(con, conf.personal)
+        handler.add_challenge(con, set_id, "Cached")
+        self.assertEqual(len(handler.get_challenges(con)),
+                         len(challenges) + 1)
+
+        # ...and so are writes committed by another process.
+        other = DataHandler(DEFAULTS_DIR, db_file)
+        other_con = other.load_db()
+        other.add_language(other_con, "Rust")
+        other.unload_db(other_con)
+        self.assertEqual([lang[1] for lang in handler.get_languages(con)],
+                         ["Rust"])
+
+        # Per-set lists are evicted least recently used first.
+        handler.cache.max_size = 800
+        sets = [chall_set[0] for chall_set in handler.get_challenge_sets(con)]
+        for set_id in sets:
+            handler.query_challenges(con, set_id=set_id)
+        cached = [key[1] for key in handler.cache.entries
+                  if key[0] == "challenges"]
+        self.assertLess(len(cached), len(sets))
+        self.assertEqual(cached, sets[-len(cached):])
+        self.assertLessEqual(handler.cache.size, 800)
+
+        handler.unload_db(con)
+
+    def test_stats(self):
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler(DEFAULTS_DIR, db_file)
+        con = handler.load_db()
+        euler_id = handler.get_challenge_set_id(con, "Project Euler")
+
+        ids = [handler.materialise_challenge(con, euler_id, i)
+               for i in range(3)]
+        for chall_id in ids:
+            handler.accept_challenge(con, chall_id, "C")
+        handler.finish_challenge(con, ids[0])
+        handler.finish_challenge(con, ids[1])
+        telnet = handler.get_challenge_id(con, "Telnet")
+        handler.accept_challenge(con, telnet, "Rust")
+
+        self.assertEqual(handler.get_language_stats(con),
+                         [("C", 3, 2, 0), ("Rust", 1, 0, 0)])
+        self.assertEqual(handler.get_set_stats(con),
+                         [("Project Euler", 3, 2, 0), ("Protocols", 1, 0, 0)])
+        self.assertEqual(handler.get_duration_histogram(con),
+                         [2, 0, 0, 0, 0, 0])
+        self.assertEqual(handler.get_activity(con, 1), (4, 2))
+
+        handler.del_challenge(con, ids[0])
+        self.assertEqual(handler.get_language_stats(con)[0], ("C", 2, 1, 0))
+        self.assertEqual(handler.get_duration_histogram(con, "C"),
+                         [1, 0, 0, 0, 0, 0])
+
+        # Progress that predates the stats tables is counted when migrating.
+        cur = con.cursor()
+        cur.execute("UPDATE challenges SET date_started = '2020-01-01' "
+                    "WHERE id = ?;", (ids[1],))
+        cur.execute("DELETE FROM stats_languages;")
+        cur.execute("DELETE FROM stats_sets;")
+        cur.execute("DELETE FROM stats_durations;")
+        cur.execute("DELETE FROM stats_days;")
+        cur.execute("DROP TRIGGER stats_insert;")
+        cur.execute("DROP TRIGGER stats_update;")
+        cur.execute("DROP TRIGGER stats_delete;")
+        cur.execute("DROP TABLE stats_languages;")
+        cur.execute("DROP TABLE stats_sets;")
+        cur.execute("DROP TABLE stats_durations;")
+        cur.execute("DROP TABLE stats_days;")
+        cur.execute("""SELECT name FROM sqlite_master
+                       WHERE type = 'trigger' AND name LIKE '%pick%';""")
+        for (name,) in cur.fetchall():
+            cur.execute(f"DROP TRIGGER {name};")
+        cur.execute("DROP TABLE pick_challenges;")
+        cur.execute("DROP TABLE pick_pairs;")
+        cur.execute("DROP TABLE pick_modifiers;")
+        cur.execute("DROP TABLE pick_fallbacks;")
+        cur.execute("DROP INDEX challenges_unstarted;")
+        cur.execute("DROP TABLE modifiers;")
+        cur.execute("DROP TABLE modifier_languages;")
+        cur.execute("DROP TABLE excluded_challenge_languages;")
+        cur.execute("DROP TABLE excluded_challenge_modifiers;")
+        cur.execute("DROP TABLE excluded_language_modifiers;")
+        cur.execute("DROP TRIGGER revisits_finish;")
+        cur.execute("DROP TRIGGER revisits_delete;")
+        cur.execute("DROP TABLE revisits;")
+        cur.execute("DROP TABLE revisit_intervals;")
+        cur.execute("ALTER TABLE challenge_sets DROP COLUMN modifiers_enabled;")
+        cur.execute("ALTER TABLE challenges DROP COLUMN modifier_used;")
+        cur.execute("PRAGMA user_version = 2;")
+        handler.unload_db(con)
+
+        con = handler.load_db()
+        self.assertEqual([row[:3] for row in handler.get_language_stats(con)],
+                         [("C", 2, 1), ("Rust", 1, 0)])
+        self.assertEqual(handler.get_duration_histogram(con),
+                         [0, 0, 0, 0, 0, 1])
+        handler.unload_db(con)
+
+    def test_search_challenges(self):
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        handler = DataHandler(DEFAULTS_DIR, db_file)
+        con = handler.load_db()
+        set_id = handler.get_challenge_set_id(con, conf.personal)
+
+        results = handler.search_challenges(con, "transfer protocol")
+        self.assertEqual(results[0].description, "File Transfer Protocol")
+        self.assertEqual(handler.search_challenges(con, "RFC 854")[0]
+                         .description, "Telnet")
+        # Words are matched as prefixes and odd input isn't an error.
+        self.assertTrue(any(chall.description == "IRC client" for chall
+                            in handler.search_challenges(con, "irc")))
+        handler.search_challenges(con, 'C++ "AND (')
+        self.assertEqual(handler.search_challenges(con, "   "), [])
+        self.assertEqual(len(handler.search_challenges(con, "protocol",
+                                                       limit=2)), 2)
+
+        # The index follows inserts, updates and deletes.
+        chall_id = handler.add_challenge(con, set_id, "Zebra crossing",
+                                         "Traffic lights")
+        self.assertEqual([chall.id for chall
+                          in handler.search_challenges(con, "zebra")],
+                         [chall_id])
+        cur = con.cursor()
+        cur.execute("UPDATE challenges SET notes = 'Pelican' WHERE id = ?;",
+                    (chall_id,))
+        self.assertEqual(handler.search_challenges(con, "traffic"), [])
+        self.assertEqual(len(handler.search_challenges(con, "pelican")), 1)
+        self.assertEqual(len(handler.query_challenges(con, set_id=set_id,
+                                                      search="pelic")), 1)
+        handler.del_challenge(con, chall_id)
+        self.assertEqual(handler.search_challenges(con, "zebra"), [])
+
+        handler.unload_db(con)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+import tracemalloc
+import unittest
+
+import context
+from challengeme.exceptions import InvalidChallengeError
+from challengeme.handlers import defaultsloader
+from challengeme.handlers.datahandler import DataHandler
+from challengeme.handlers.defaultsloader import read_defaults_file
+
+class TestDefaultsLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.defaults_dir = os.path.join(self.test_dir.name, "defaults")
+        os.mkdir(self.defaults_dir)
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def write_set(self, name, challenges, **fields):
+        path = os.path.join(self.defaults_dir, name)
+        with open(path, "w", encoding="utf8") as f:
+            f.write(json.dumps({"name": name, **fields})[:-1]
+                    + ', "challenges": [\n')
+            f.write(",\n".join(json.dumps(chall) for chall in challenges))
+            f.write("\n]}")
+        return path
+
+    def test_errors_have_positions(self):
+        path = self.write_set("broken.json", [{"description": "Fine"},
+                                              {"notes": "No description"}])
+        with self.assertRaisesRegex(InvalidChallengeError,
+                                    "Challenge 1 has no description at "
+                                    "line 3, column 1"):
+            list(read_defaults_file(path))
+
+        path = self.write_set("broken.json", [{"description": "Fine"}])
+        with open(path, "a", encoding="utf8") as f:
+            f.write("\n]")
+        with self.assertRaisesRegex(InvalidChallengeError,
+                                    "Unexpected data after the object at "
+                                    "line 4, column 1"):
+            list(read_defaults_file(path))
+
+    def test_memory_is_bounded(self):
+        path = self.write_set("big.json", ({"description": f"Challenge {i}",
+                                            "notes": "x" * 200}
+                                           for i in range(20000)))
+        self.assertGreater(os.path.getsize(path), 4 << 20)
+
+        tracemalloc.start()
+        count = 0
+        for (kind, value) in read_defaults_file(path):
+            if kind == "challenges":
+                count += len(value)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.assertEqual(count, 20000)
+        self.assertLess(peak, 1 << 20)
+
+    def test_parallel_load(self):
+        self.write_set("a.json", ({"description": f"A {i}"}
+                                  for i in range(3000)))
+        self.write_set("b.json", [{"description": "B 0"},
+                                  {"description": "B 1",
+                                   "languageConstraints": "C"}])
+        self.write_set("c.json", [{"description": "A 0"},
+                                  {"description": "C 1"},
+                                  {"description": "C 1"}],
+                       allowModifiers=False)
+
+        # Parse on the process pool however small the files are.
+        threshold = defaultsloader.PARALLEL_MIN_BYTES
+        defaultsloader.PARALLEL_MIN_BYTES = 0
+        try:
+            handler = DataHandler(self.defaults_dir,
+                                  os.path.join(self.test_dir.name, "db.db"))
+            con = handler.load_db()
+        finally:
+            defaultsloader.PARALLEL_MIN_BYTES = threshold
+
+        sets = {name: set_id for (set_id, name)
+                in handler.get_challenge_sets(con)}
+        self.assertNotIn("b.json", sets)
+        self.assertEqual(len(handler.query_challenges(con,
+                                                      set_id=sets["a.json"])),
+                         3000)
+        # "A 0" is already in a.json, and "C 1" is only added once.
+        self.assertEqual([chall.description for chall
+                          in handler.query_challenges(con,
+                                                      set_id=sets["c.json"])],
+                         ["C 1"])
+        self.assertEqual(handler.get_sets_without_modifiers(con),
+                         [sets["c.json"]])
+        handler.unload_db(con)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import context
+from challengeme.handlers.datahandler import DataHandler
+from challengeme.profiler import Profiler, query_shape
+
+DEFAULTS_DIR = os.path.join(os.path.dirname(__file__), "..", "defaults")
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.test_dir.name, "test_db.db")
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_query_shape(self):
+        self.assertEqual(query_shape("SELECT id\n   FROM t WHERE id IN "
+                                     "(?, ?,?);"),
+                         "SELECT id FROM t WHERE id IN (?, ...);")
+
+    def test_profile(self):
+        original = DataHandler.get_language_id
+        profiler = Profiler()
+        profiler.enable()
+        try:
+            handler = DataHandler(DEFAULTS_DIR, self.db_file)
+            con = profiler.run_command("test", handler.load_db)
+            for lang in ("C", "Rust", "Haskell"):
+                handler.add_language(con, lang)
+            handler.delete_challenges(con, [1, 2, 3])
+            self.assertEqual(len(list(handler.iter_challenges(con,
+                                                              limit=5))), 5)
+            handler.unload_db(con)
+        finally:
+            profiler.disable()
+        self.assertIs(DataHandler.get_language_id, original)
+        self.assertIs(DataHandler.connection_factory, sqlite3.Connection)
+
+        profile = profiler.to_json()
+        self.assertEqual(profile["commands"]["test"]["calls"], 1)
+        methods = profile["methods"]
+        self.assertEqual(methods["add_language"]["calls"], 3)
+        # get_language_id runs before and after each language is added.
+        self.assertEqual(methods["get_language_id"]["calls"], 6)
+        self.assertIn("__scan_defaults", methods)
+        self.assertIn("iter_challenges", methods)
+        query = query_shape("""SELECT id FROM languages
+                               WHERE name = ? AND saved = 1;""")
+        self.assertEqual(profile["queries"][query]["calls"], 6)
+        self.assertEqual(len(profile["queries"][query]["slowest"]), 3)
+        self.assertIn("'Rust'", "".join(
+            call["details"] for query in profile["queries"].values()
+            for call in query["slowest"]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,291 @@
+import collections
+import json
+import os
+import random
+import tempfile
+import time
+import unittest
+
+import context
+from challengeme.handlers.datahandler import DataHandler
+from challengeme.sampler import ChallengeSampler
+
+def write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+class TestChallengeSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.defaults_dir = os.path.join(self.test_dir.name, "defaults")
+        os.mkdir(self.defaults_dir)
+        self.db_file = os.path.join(self.test_dir.name, "test_db.db")
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def load(self, modifiers=(), set_two_modifiers=True):
+        """Create a DB with challenges 1 to 4 in two sets, a numbered set of
+        5 whose numbers 0 and 2 were already accepted, and `modifiers`."""
+        write_json(os.path.join(self.defaults_dir, "one.json"),
+                   {"name": "Set One", "challenges": [
+                       {"description": "Challenge 1"},
+                       {"description": "Challenge 2",
+                        "languageConstraints": ["Rust"]}]})
+        write_json(os.path.join(self.defaults_dir, "two.json"),
+                   {"name": "Set Two", "allowModifiers": set_two_modifiers,
+                    "challenges": [
+                        {"description": "Challenge 3",
+                         "languageConstraints": ["COBOL"]},
+                        {"description": "Challenge 4",
+                         "languageConstraints": ["C", "Rust"]}]})
+        write_json(os.path.join(self.defaults_dir, "euler.json"),
+                   {"name": "Project Euler", "num-challenges": 5})
+        write_json(os.path.join(self.defaults_dir, "modifiers.json"),
+                   {"modifiers": [{"description": desc,
+                                   "languageConstraints": langs}
+                                  for (desc, langs) in modifiers]})
+
+        self.handler = DataHandler(self.defaults_dir, self.db_file)
+        self.con = self.handler.load_db()
+        for lang in ["C", "Rust", "Haskell"]:
+            self.handler.add_language(self.con, lang)
+        self.ids = {self.handler.get_challenge_id(self.con,
+                                                  f"Challenge {n}"): n
+                    for n in range(1, 5)}
+        self.sets = {name: self.handler.get_challenge_set_id(self.con, name)
+                     for name in ["Set One", "Set Two", "Project Euler"]}
+        for number in [0, 2]:
+            chall_id = self.handler.materialise_challenge(
+                self.con, self.sets["Project Euler"], number)
+            self.handler.accept_challenge(self.con, chall_id, "C")
+        return self.handler.get_sampler(self.con)
+
+    def key(self, chall):
+        """Challenge n, or the number in the numbered set."""
+        if chall.number is not None:
+            return ("Project Euler", chall.number)
+        return self.ids[chall.id]
+
+    def test_only_eligible_pairs(self):
+        sampler = self.load()
+        set_two = self.sets["Set Two"]
+
+        # 3 for challenge 1, 1 for 2, 0 for 3, 2 for 4, 3 * 3 for the set.
+        self.assertEqual(sampler.count(), 15)
+        self.assertEqual(sampler.count(set_id=set_two), 2)
+        self.assertEqual(sampler.count(language="Rust"), 6)
+        self.assertEqual(sampler.count(set_id=set_two, language="COBOL"), 0)
+        self.assertIsNone(sampler.sample(set_id=set_two, language="COBOL"))
+
+        rng = random.Random(0)
+        seen = collections.Counter()
+        for _ in range(3000):
+            (chall, lang, modifier) = sampler.sample(rng)
+            self.assertIsNone(modifier)
+            if len(chall.language_constraints) > 0:
+                self.assertIn(lang, chall.language_constraints)
+            self.assertNotEqual(self.key(chall), 3)
+            self.assertNotIn(chall.number, [0, 2])
+            seen[(self.key(chall), lang)] += 1
+
+        # Every eligible pair turns up, roughly as often as the others.
+        self.assertEqual(len(seen), 15)
+        self.assertTrue(all(100 < n < 300 for n in seen.values()))
+
+    def test_filters(self):
+        sampler = self.load()
+        euler = self.sets["Project Euler"]
+
+        rng = random.Random(1)
+        for _ in range(100):
+            (chall, lang, _) = sampler.sample(rng, set_id=euler,
+                                              language="Haskell")
+            self.assertEqual(chall.set_id, euler)
+            self.assertIn(chall.number, [1, 3, 4])
+            self.assertEqual(chall.description,
+                             f"Project Euler challenge {chall.number}")
+            self.assertEqual(lang, "Haskell")
+
+    def test_seed_is_repeatable(self):
+        self.load()
+
+        def picks(seed):
+            rng = random.Random(seed)
+            sampler = self.handler.get_sampler(self.con)
+            return [(chall.description, lang) for (chall, lang, _)
+                    in (sampler.sample(rng) for _ in range(20))]
+
+        self.assertEqual(picks(42), picks(42))
+
+    def test_picks_follow_the_db(self):
+        sampler = self.load()
+        self.assertEqual(sampler.count(), 15)
+
+        # Accepting or deleting a challenge, or saving a language, is seen
+        # by the next pick without building a new sampler.
+        ids = {n: i for (i, n) in self.ids.items()}
+        self.handler.accept_challenge(self.con, ids[1], "C")
+        self.assertEqual(sampler.count(), 12)
+        self.handler.delete_challenges(self.con, [ids[4]])
+        self.assertEqual(sampler.count(), 10)
+        self.handler.add_language(self.con, "COBOL")
+        self.assertEqual(sampler.count(), 14)
+
+    def test_modifiers(self):
+        modifiers = [("Nice UI", []), ("Use OpenCL", ["C"]),
+                     ("Rewrite it", ["Rust"])]
+        sampler = self.load(modifiers, set_two_modifiers=False)
+
+        # Challenge 1: C x 2, Rust x 2, Haskell x 1. Challenge 2: Rust x 2.
+        # Challenge 4 has no modifiers: C, Rust. The numbered set: 3 x 5.
+        self.assertEqual(sampler.count(), 24)
+        self.assertEqual(sampler.count(language="C"), 2 + 1 + 3 * 2)
+
+        rng = random.Random(2)
+        seen = collections.Counter()
+        for _ in range(4800):
+            (chall, lang, modifier) = sampler.sample(rng)
+            if chall.set_id == self.sets["Set Two"]:
+                self.assertIsNone(modifier)
+            else:
+                self.assertIn(modifier, ["Nice UI", "Use OpenCL",
+                                         "Rewrite it"])
+                self.assertIn(lang, dict(modifiers)[modifier] or [lang])
+            seen[(self.key(chall), lang, modifier)] += 1
+
+        self.assertEqual(len(seen), 24)
+        self.assertTrue(all(100 < n < 300 for n in seen.values()))
+
+    def test_exclusions(self):
+        modifiers = [("Nice UI", []), ("Use OpenCL", ["C"])]
+        sampler = self.load(modifiers)
+        ids = {n: i for (i, n) in self.ids.items()}
+        self.handler.add_exclusion(self.con, ids[1], language="C")
+        self.handler.add_exclusion(self.con, ids[4], language="Rust")
+        self.handler.add_exclusion(self.con, ids[1], modifier="Nice UI")
+        self.handler.add_exclusion(self.con, language="Haskell",
+                                   modifier="Nice UI")
+        exclusions = self.handler.get_exclusions(self.con)
+
+        # Challenge 1: Rust, Haskell, without modifiers. Challenge 2: Rust.
+        # Challenge 4: C x 2. The numbered set: C x 2, Rust, Haskell.
+        self.assertEqual(sampler.count(), 2 + 1 + 2 + 4 * 3)
+
+        rng = random.Random(3)
+        seen = set()
+        for _ in range(2000):
+            (chall, lang, modifier) = sampler.sample(rng)
+            self.assertNotIn(lang, exclusions[0].get(chall.id, ()))
+            self.assertNotIn(modifier, exclusions[1].get(chall.id, ()))
+            self.assertNotIn(modifier, exclusions[2].get(lang, ()))
+            seen.add((self.key(chall), lang, modifier))
+        self.assertEqual(len(seen), sampler.count())
+
+    def test_groups(self):
+        # Groups of 3 and 1 triples, and an empty one.
+        groups = [("C", 3, "a"), ("Rust", 1, "b"), ("Haskell", 0, "c")]
+        sampler = ChallengeSampler(lambda set_id, language: groups,
+                                   lambda part, i: ((part, i), None))
+        self.assertEqual(sampler.count(), 4)
+
+        rng = random.Random(6)
+        seen = collections.Counter(sampler.sample(rng) for _ in range(4000))
+        self.assertEqual(set(seen), {(("a", 0), "C", None),
+                                     (("a", 1), "C", None),
+                                     (("a", 2), "C", None),
+                                     (("b", 0), "Rust", None)})
+        self.assertTrue(all(800 < n < 1200 for n in seen.values()))
+
+    def test_cold_pick_cost_is_flat(self):
+        write_json(os.path.join(self.defaults_dir, "big.json"),
+                   {"name": "Big", "challenges": []})
+        write_json(os.path.join(self.defaults_dir, "modifiers.json"),
+                   {"modifiers": [{"description": f"Modifier {i}"}
+                                  for i in range(8)]})
+        handler = DataHandler(self.defaults_dir, self.db_file)
+        con = handler.load_db()
+        for lang in ["C", "Rust", "Haskell"]:
+            handler.add_language(con, lang)
+        set_id = handler.get_challenge_set_id(con, "Big")
+
+        def pick_time():
+            # A pick from a new process: open the DB and pick once.
+            best = None
+            for seed in range(5):
+                start = time.perf_counter()
+                handler = DataHandler(self.defaults_dir, self.db_file)
+                con = handler.load_db()
+                handler.get_sampler(con).sample(random.Random(seed))
+                con.close()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            return best
+
+        handler.add_challenges(con, set_id, ((f"Challenge {i}", "", [])
+                                             for i in range(1000)))
+        small = pick_time()
+        handler.add_challenges(con, set_id, ((f"Challenge {i}", "", [])
+                                             for i in range(1000, 20000)))
+        self.assertLess(pick_time(), 3 * small)
+        con.close()
+
+    def test_pick_cost_is_flat(self):
+        write_json(os.path.join(self.defaults_dir, "big.json"),
+                   {"name": "Big", "challenges": []})
+        write_json(os.path.join(self.defaults_dir, "modifiers.json"),
+                   {"modifiers": [{"description": f"Modifier {i}"}
+                                  for i in range(8)]})
+        handler = DataHandler(self.defaults_dir, self.db_file)
+        con = handler.load_db()
+        languages = ["C", "Rust", "Haskell"]
+        for lang in languages:
+            handler.add_language(con, lang)
+        set_id = handler.get_challenge_set_id(con, "Big")
+        ids = handler.add_challenges(con, set_id, ((f"Challenge {i}", "", [])
+                                                   for i in range(20000)))
+
+        def pick_time():
+            # A pick from a new process: open the DB, build the sampler and
+            # pick once, with nothing read beforehand.
+            best = None
+            for seed in range(5):
+                start = time.perf_counter()
+                handler = DataHandler(self.defaults_dir, self.db_file)
+                con = handler.load_db()
+                (chall, lang, modifier) = handler.get_sampler(con).sample(
+                    random.Random(seed))
+                elapsed = time.perf_counter() - start
+                picks.append((chall.id, lang, modifier))
+                con.close()
+                best = elapsed if best is None else min(best, elapsed)
+            return best
+
+        picks = []
+        without = pick_time()
+
+        # Tens of thousands of exclusions of each kind, added in one
+        # transaction.
+        rng = random.Random(5)
+        con.execute("BEGIN;")
+        for chall_id in ids:
+            handler.add_exclusion(con, chall_id,
+                                  language=rng.choice(languages))
+        for chall_id in ids:
+            handler.add_exclusion(con, chall_id,
+                                  modifier=f"Modifier {rng.randrange(8)}")
+        handler.add_exclusion(con, language="C", modifier="Modifier 0")
+        con.commit()
+
+        picks.clear()
+        self.assertLess(pick_time(), 3 * without)
+        excluded = handler.get_exclusions(con)
+        for (chall_id, lang, modifier) in picks:
+            self.assertNotIn(lang, excluded[0].get(chall_id, ()))
+            self.assertNotIn(modifier, excluded[1].get(chall_id, ()))
+            self.assertNotIn(modifier, excluded[2].get(lang, ()))
+        con.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+
+import context
+from challengeme.handlers.datahandler import DataHandler
+from challengeme.server import ChallengeServer
+
+DEFAULTS_DIR = os.path.join(os.path.dirname(__file__), "..", "defaults")
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        db_file = os.path.join(self.test_dir.name, "test_db.db")
+        self.handler = DataHandler(DEFAULTS_DIR, db_file)
+        con = self.handler.load_db()
+        self.handler.add_language(con, "C")
+        self.handler.unload_db(con)
+
+        self.server = ChallengeServer(("127.0.0.1", 0), self.handler, 2)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.test_dir.cleanup()
+
+    def request(self, path, body=None):
+        data = None if body is None else json.dumps(body).encode()
+        try:
+            with urllib.request.urlopen(self.url + path, data) as response:
+                return (response.status, json.load(response))
+        except urllib.error.HTTPError as err:
+            return (err.code, json.load(err))
+
+    def test_pick_accept_finish(self):
+        (status, pick) = self.request("/pick?set=Project%20Euler&seed=1")
+        self.assertEqual(status, 200)
+        self.assertEqual(pick["language"], "C")
+        chall = pick["challenge"]
+        self.assertIsNone(chall["id"])
+
+        accept = {"set_id": chall["set_id"], "number": chall["number"],
+                  "language": "C"}
+        (status, result) = self.request("/accept", accept)
+        self.assertEqual(status, 200)
+        self.assertTrue(result["accepted"])
+        # The second accept of the same challenge loses.
+        self.assertFalse(self.request("/accept", accept)[1]["accepted"])
+
+        (status, active) = self.request("/challenges?started=true")
+        self.assertEqual([c["description"] for c in active],
+                         [chall["description"]])
+        self.assertTrue(self.request("/finish",
+                                     {"id": result["id"]})[1]["finished"])
+
+        # The picks come from a catalogue that saw the accept.
+        for seed in range(20):
+            (status, pick) = self.request("/pick?set=Project%20Euler&"
+                                          f"seed={seed}")
+            self.assertNotEqual(pick["challenge"]["number"], chall["number"])
+
+    def test_errors(self):
+        self.assertEqual(self.request("/nothing")[0], 404)
+        self.assertEqual(self.request("/pick?set=Nothing")[0], 404)
+        self.assertEqual(self.request("/challenges?limit=many")[0], 400)
+        self.assertEqual(self.request("/challenges", {"notes": ""})[0], 400)
+        self.assertEqual(self.request("/challenges",
+                                      {"description": "Telnet"})[0], 409)
+
+    def test_db_errors(self):
+        body = {"description": "Write a tiny HTTP proxy"}
+        locked = sqlite3.OperationalError("database is locked")
+        with mock.patch.object(self.handler, "add_challenges",
+                               side_effect=locked):
+            (status, result) = self.request("/challenges", body)
+        self.assertEqual(status, 503)
+        self.assertEqual(result["error"], "database is locked")
+
+        corrupt = sqlite3.DatabaseError("database disk image is malformed")
+        with mock.patch.object(self.handler, "add_challenges",
+                               side_effect=corrupt):
+            self.assertEqual(self.request("/challenges", body)[0], 500)
+
+        # The connections went back to the pool.
+        self.assertEqual(self.request("/challenges", body)[0], 200)
+
+if __name__ == "__main__":
+    unittest.main()